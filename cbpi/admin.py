@@ -1,31 +1,132 @@
-from django.contrib import admin
+from django.conf import settings
+from django.contrib import admin, messages
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.utils.functional import cached_property
+from django.utils.html import format_html
+
+from . import refcache, search, thumbnails, versions
 from .models import *
 
 
-class ParticipationInline(admin.TabularInline):
+class ReferenceFieldListFilter(admin.RelatedFieldListFilter):
+    """Фильтр по FK на справочник: варианты берутся из кеша, без запроса."""
+
+    def field_choices(self, field, request, model_admin):
+        return [(obj.pk, str(obj)) for obj in refcache.objects(field.related_model).values()]
+
+
+admin.FieldListFilter.register(
+    lambda field: field.remote_field is not None and field.related_model in refcache.REFERENCE_MODELS,
+    ReferenceFieldListFilter, take_priority=True)
+
+
+class PlaceTreeFilter(admin.SimpleListFilter):
+    title = "место (с вложенными)"
+    parameter_name = "place_tree"
+
+    def lookups(self, request, model_admin):
+        places = Place.objects.order_by("path").only("name", "path")
+        return [(place.pk, "— " * place.depth + place.name) for place in places]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            path = Place.objects.filter(pk=self.value()).values_list("path", flat=True).first()
+            if path is None:
+                return queryset.none()
+            return queryset.filter(Place.objects.subtree_filter(path, prefix="place__"))
+        return queryset
+
+
+class FullTextSearchMixin:
+    # Поля, поиск по которым идёт через FTS-индекс: "pk" — сама модель,
+    # иначе FK на модель из search.INDEXES. search_fields нужны для автодополнения.
+    fulltext_search = ()
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip() or not self.fulltext_search:
+            return super().get_search_results(request, queryset, search_term)
+        condition = Q()
+        for path in self.fulltext_search:
+            if path == "pk":
+                condition |= search.matching(self.model, search_term)
+            else:
+                target = self.model._meta.get_field(path).related_model
+                condition |= search.matching(target, search_term, prefix=f"{path}__")
+        return queryset.filter(condition), False
+
+
+class ReferenceChoicesMixin:
+    """Выпадающие списки справочников строятся по кешу, в том числе в каждой строке inline."""
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if (db_field.related_model in refcache.REFERENCE_MODELS
+                and db_field.name not in (*self.get_autocomplete_fields(request), *self.raw_id_fields)):
+            kwargs.setdefault("form_class", refcache.ReferenceChoiceField)
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+
+class EstimatedCountPaginator(Paginator):
+    """Число строк без полного COUNT(*).
+
+    Без фильтров — счётчик строк таблицы (versions.row_count), с фильтрами —
+    COUNT не больше ADMIN_COUNT_LIMIT строк: дальше лимита страницы не листаются.
+    """
+
+    @cached_property
+    def count(self):
+        query = self.object_list.query
+        if not query.where and not query.distinct:
+            rows = versions.row_count(self.object_list.model)
+            if rows is not None:
+                return rows
+        return self.object_list.order_by()[:settings.ADMIN_COUNT_LIMIT].count()
+
+
+class EstimatedCountMixin:
+    """Список большой таблицы: без второго COUNT(*) по всей таблице и с оценкой числа строк."""
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+class PhotoPreviewMixin:
+    @admin.display(description="Фото")
+    def photo_preview(self, obj):
+        if not obj.photo_file:
+            return "—"
+        return format_html('<img src="{}" alt="" height="32">', thumbnails.url(obj.photo_file, obj.photo_hash))
+
+
+class ParticipationInline(ReferenceChoicesMixin, admin.TabularInline):
     model = Participation
     extra = 1
+    autocomplete_fields = ("hero",)
 
 
-class HeroValueInline(admin.TabularInline):
+class HeroValueInline(ReferenceChoicesMixin, admin.TabularInline):
     model = HeroValue
     extra = 1
+    autocomplete_fields = ("event_after",)
 
 
-class HeroActionInline(admin.TabularInline):
+class HeroActionInline(ReferenceChoicesMixin, admin.TabularInline):
     model = HeroAction
     extra = 1
+    autocomplete_fields = ("based_on_decision", "cause_event", "in_role")
 
 
-class DecisionInline(admin.TabularInline):
+class DecisionInline(ReferenceChoicesMixin, admin.TabularInline):
     model = Decision
     extra = 1
+    autocomplete_fields = ("event_after",)
 
 
 class FactRelationInline(admin.TabularInline):
     model = FactRelation
     fk_name = "based_fact"
     extra = 1
+    autocomplete_fields = ("followed_fact", "event_relation")
 
 
 @admin.register(Universe)
@@ -43,12 +144,16 @@ class CountryAdmin(admin.ModelAdmin):
 @admin.register(GlobalActorList)
 class GlobalActorListAdmin(admin.ModelAdmin):
     list_display = ("id", "nickname", "date_of_registration", "registered_by_user")
+    list_select_related = ("registered_by_user",)
     search_fields = ("nickname",)
+    ordering = ("-id",)
 
 
 @admin.register(User)
-class UserAdmin(admin.ModelAdmin):
+class UserAdmin(ReferenceChoicesMixin, admin.ModelAdmin):
     list_display = ("id", "country",)
+    list_select_related = ("country",)
+    autocomplete_fields = ("gla",)
     search_fields = ("id",)
     list_filter = ("country",)
 
@@ -60,15 +165,19 @@ class StampStatusAdmin(admin.ModelAdmin):
 
 
 @admin.register(UserStamp)
-class UserStampAdmin(admin.ModelAdmin):
+class UserStampAdmin(EstimatedCountMixin, ReferenceChoicesMixin, admin.ModelAdmin):
     list_display = ("id", "user", "datetime", "status")
+    list_select_related = ("user", "status")
     list_filter = ("status",)
-    search_fields = ("user__name",)
+    search_fields = ("user__user__username",)
+    ordering = ("-id",)
 
 
 @admin.register(Author)
-class AuthorAdmin(admin.ModelAdmin):
-    list_display = ("id", "name", "date_of_birth", "country_of_birth")
+class AuthorAdmin(PhotoPreviewMixin, ReferenceChoicesMixin, admin.ModelAdmin):
+    list_display = ("id", "photo_preview", "name", "date_of_birth", "country_of_birth")
+    list_select_related = ("country_of_birth",)
+    autocomplete_fields = ("gla",)
     search_fields = ("name",)
     list_filter = ("country_of_birth",)
 
@@ -80,37 +189,71 @@ class CompositionTypeAdmin(admin.ModelAdmin):
 
 
 @admin.register(Saga)
-class SagaAdmin(admin.ModelAdmin):
-    list_display = ("id", "name", "universe_of_events", "date_first_published")
+class SagaAdmin(ReferenceChoicesMixin, admin.ModelAdmin):
+    list_display = ("id", "name", "universe_of_events", "date_first_published", "composition_count")
+    list_select_related = ("universe_of_events",)
+    autocomplete_fields = ("user_stamp",)
     search_fields = ("name",)
     list_filter = ("universe_of_events", "country_first_published")
+    actions = ["recompute", "rebuild_indexes"]
+
+    @admin.action(description="Пересчитать траектории, шкалу времени и порядок эпизодов")
+    def recompute(self, request, queryset):
+        for saga in queryset:
+            for kind in ("value_trajectories", "timeline", "episode_order"):
+                Job.objects.enqueue(kind, saga)
+        self.message_user(request, f"Задачи поставлены в очередь для саг: {queryset.count()}")
+
+    @admin.action(description="Перестроить замыкание порядка событий и поисковый индекс (всей базы)")
+    def rebuild_indexes(self, request, queryset):
+        # Обе задачи общие для всех саг: выбор саг на них не влияет.
+        for kind in ("event_closure", "search_index"):
+            Job.objects.enqueue(kind)
+        self.message_user(request, "Задачи поставлены в очередь")
 
 
 @admin.register(Place)
 class PlaceAdmin(admin.ModelAdmin):
     list_display = ("id", "name", "parent", "real_flag")
+    list_select_related = ("parent",)
     search_fields = ("name",)
     list_filter = ("real_flag",)
 
 
 @admin.register(Composition)
-class CompositionAdmin(admin.ModelAdmin):
-    list_display = ("id", "title", "saga", "date_published", "composition_type")
+class CompositionAdmin(ReferenceChoicesMixin, admin.ModelAdmin):
+    list_display = ("id", "title", "saga", "date_published", "composition_type", "episode_count")
+    list_select_related = ("saga", "composition_type")
     search_fields = ("title",)
     list_filter = ("composition_type",)
 
 
 @admin.register(Event)
-class EventAdmin(admin.ModelAdmin):
-    list_display = ("id", "title", "composition", "place", "zero_event_flag")
+class EventAdmin(EstimatedCountMixin, FullTextSearchMixin, admin.ModelAdmin):
+    list_display = ("id", "title", "composition", "place", "zero_event_flag", "date_time_from_zero_event", "timeline_offset")
+    list_select_related = ("composition", "place")
+    autocomplete_fields = ("user_stamp",)
     search_fields = ("title",)
-    list_filter = ("zero_event_flag", "place")
+    fulltext_search = ("pk",)
+    ordering = ("-id",)
+    list_filter = ("zero_event_flag", PlaceTreeFilter)
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        # Дата свободная: неразобранная просто не попадает на шкалу.
+        if obj.date_time_from_zero_event and obj.timeline_offset is None:
+            self.message_user(request, f"Дата «{obj.date_time_from_zero_event}» не разобрана: события нет на шкале.",
+                              messages.WARNING)
 
 
 @admin.register(Hero)
-class HeroAdmin(admin.ModelAdmin):
-    list_display = ("id", "name", "saga", "birth_event")
+class HeroAdmin(PhotoPreviewMixin, FullTextSearchMixin, admin.ModelAdmin):
+    list_display = ("id", "photo_preview", "name", "saga", "birth_event", "participation_count", "action_count")
+    list_select_related = ("saga", "birth_event")
+    autocomplete_fields = ("birth_event", "user_stamp", "gla")
     search_fields = ("name",)
+    fulltext_search = ("pk",)
+    ordering = ("-id",)
     list_filter = ("saga",)
     inlines = [HeroValueInline, HeroActionInline, DecisionInline]
     fieldsets = (
@@ -124,28 +267,37 @@ class HeroAdmin(admin.ModelAdmin):
 
 
 @admin.register(Episode)
-class EpisodeAdmin(admin.ModelAdmin):
+class EpisodeAdmin(FullTextSearchMixin, admin.ModelAdmin):
     list_display = ("id", "title", "composition", "start_event")
+    list_select_related = ("composition", "start_event")
+    autocomplete_fields = ("start_event", "previous_episode", "user_stamp")
     search_fields = ("title",)
+    fulltext_search = ("pk",)
+    ordering = ("-id",)
     list_filter = ("composition",)
     inlines = [ParticipationInline]
 
 
 @admin.register(RoleType)
 class RoleTypeAdmin(admin.ModelAdmin):
-    list_display = ("id", "name")
+    list_display = ("id", "name", "weight")
     search_fields = ("name",)
 
 
 @admin.register(Participation)
-class ParticipationAdmin(admin.ModelAdmin):
+class ParticipationAdmin(EstimatedCountMixin, FullTextSearchMixin, ReferenceChoicesMixin, admin.ModelAdmin):
     list_display = ("id", "hero", "episode", "role_type")
+    list_select_related = ("hero", "episode", "role_type")
+    autocomplete_fields = ("hero", "episode")
     search_fields = ("hero__name", "episode__title")
+    fulltext_search = ("hero", "episode")
+    ordering = ("-id",)
 
 
 @admin.register(ValueDimension)
 class ValueDimensionAdmin(admin.ModelAdmin):
     list_display = ("id", "title")
+    autocomplete_fields = ("user_stamp",)
     search_fields = ("title",)
 
 
@@ -157,9 +309,13 @@ class FactTypeAdmin(admin.ModelAdmin):
 
 
 @admin.register(Fact)
-class FactAdmin(admin.ModelAdmin):
+class FactAdmin(FullTextSearchMixin, ReferenceChoicesMixin, admin.ModelAdmin):
     list_display = ("id", "title", "composition", "fact_type", "numeric_value")
+    list_select_related = ("composition", "fact_type")
+    autocomplete_fields = ("result_of_event",)
     search_fields = ("title",)
+    fulltext_search = ("pk",)
+    ordering = ("-id",)
     list_filter = ("fact_type",)
     inlines = [FactRelationInline]
     fieldsets = (
@@ -173,47 +329,92 @@ class FactAdmin(admin.ModelAdmin):
 
 
 @admin.register(AffectOnValue)
-class AffectOnValueAdmin(admin.ModelAdmin):
+class AffectOnValueAdmin(ReferenceChoicesMixin, admin.ModelAdmin):
     list_display = ("id", "value_dimension", "fact_type", "weight")
+    list_select_related = ("value_dimension", "fact_type")
     list_filter = ("value_dimension",)
 
 
 @admin.register(HeroValue)
-class HeroValueAdmin(admin.ModelAdmin):
+class HeroValueAdmin(EstimatedCountMixin, ReferenceChoicesMixin, admin.ModelAdmin):
     list_display = ("id", "hero", "value_dimension", "weight", "event_after")
+    list_select_related = ("hero", "value_dimension", "event_after")
+    autocomplete_fields = ("hero", "event_after")
 
 
 @admin.register(DecisionType)
 class DecisionTypeAdmin(admin.ModelAdmin):
     list_display = ("id", "title")
+    autocomplete_fields = ("user_stamp",)
     search_fields = ("title",)
 
 
 @admin.register(Decision)
-class DecisionAdmin(admin.ModelAdmin):
+class DecisionAdmin(FullTextSearchMixin, ReferenceChoicesMixin, admin.ModelAdmin):
     list_display = ("id", "hero", "decision_type", "event_after")
+    list_select_related = ("hero", "decision_type", "event_after")
+    autocomplete_fields = ("hero", "event_after")
+    search_fields = ("hero__name",)
+    fulltext_search = ("hero",)
+    ordering = ("-id",)
 
 
 @admin.register(ActionType)
 class ActionTypeAdmin(admin.ModelAdmin):
     list_display = ("id", "title")
+    autocomplete_fields = ("user_stamp",)
 
 
 @admin.register(HeroAction)
-class HeroActionAdmin(admin.ModelAdmin):
-    list_display = ("id", "hero", "action_type", "based_on_decision")
+class HeroActionAdmin(FullTextSearchMixin, ReferenceChoicesMixin, admin.ModelAdmin):
+    list_display = ("id", "hero", "action_type", "based_on_decision", "evaluation_count")
+    list_select_related = ("hero", "action_type", "based_on_decision")
+    autocomplete_fields = ("hero", "based_on_decision", "cause_event", "in_role")
+    search_fields = ("hero__name",)
+    fulltext_search = ("hero",)
+    ordering = ("-id",)
 
 
 @admin.register(DecisionEvaluation)
-class DecisionEvaluationAdmin(admin.ModelAdmin):
+class DecisionEvaluationAdmin(ReferenceChoicesMixin, admin.ModelAdmin):
     list_display = ("id", "hero_was_evaluated", "eval_for_ha", "weight")
+    list_select_related = ("hero_was_evaluated", "eval_for_ha")
+    autocomplete_fields = ("hero_was_evaluated", "eval_for_ha", "gla_evaluator", "event_after")
 
 
 @admin.register(EventSequence)
 class EventSequenceAdmin(admin.ModelAdmin):
     list_display = ("id", "event_before", "event_after", "straight")
+    list_select_related = ("event_before", "event_after")
+    autocomplete_fields = ("event_before", "event_after")
 
 
 @admin.register(FactRelation)
 class FactRelationAdmin(admin.ModelAdmin):
     list_display = ("id", "based_fact", "followed_fact", "event_relation")
+    list_select_related = ("based_fact", "followed_fact", "event_relation")
+    autocomplete_fields = ("based_fact", "followed_fact", "event_relation")
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ("id", "kind", "saga", "status", "attempts", "coalesced", "run_after", "finished", "worker")
+    list_select_related = ("saga",)
+    list_filter = ("status", "kind")
+    readonly_fields = [field.name for field in Job._meta.fields]
+    ordering = ("-id",)
+    actions = ["retry"]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    @admin.action(description="Повторить")
+    def retry(self, request, queryset):
+        retried = 0
+        for job in queryset.filter(status=Job.FAILED):
+            Job.objects.enqueue(job.kind, job.saga_id)
+            retried += 1
+        self.message_user(request, f"Поставлено в очередь: {retried}")
@@ -0,0 +1,139 @@
+"""Пакетные расчёты по героям саги на массивах NumPy.
+
+Таблицы читаются по одному запросу на модель через values_list, дальше вся
+работа идёт над плотными массивами герой × ценность × позиция события.
+"""
+import numpy as np
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from . import refcache
+from .models import AffectOnValue, DecisionEvaluation, Event, EventSequenceClosure, Fact, Hero, HeroValue, ValueDimension
+from .routers import analytics_reads
+
+
+def saga_timeline(saga):
+    """Id событий саги в порядке EventSequence (по числу предшественников)."""
+    predecessors = Subquery(
+        EventSequenceClosure.objects.filter(event_after=OuterRef("pk")).order_by()
+        .values("event_after").annotate(n=Count("pk")).values("n")
+    )
+    events = (
+        Event.objects.filter(composition__saga=saga)
+        .annotate(rank=Coalesce(predecessors, 0))
+        .order_by("rank", "pk")
+        .values_list("pk", flat=True)
+    )
+    return np.fromiter(events, dtype=np.int64)
+
+
+def _positions(ids, values, missing=-1):
+    """Позиции `values` в массиве `ids`; отсутствующие (и None) — `missing`."""
+    values = np.array([missing if v is None else v for v in values], dtype=np.int64)
+    if not len(ids) or not len(values):
+        return np.full(len(values), missing, dtype=np.int64)
+    sorter = np.argsort(ids)
+    found = np.searchsorted(ids, values, sorter=sorter).clip(max=len(ids) - 1)
+    positions = sorter[found]
+    return np.where(ids[positions] == values, positions, missing)
+
+
+def _columns(queryset, *fields):
+    rows = list(queryset.values_list(*fields))
+    return [list(column) for column in zip(*rows)] if rows else [[] for _ in fields]
+
+
+def _forward_fill(values):
+    observed = ~np.isnan(values)
+    index = np.where(observed, np.arange(values.shape[-1]), 0)
+    np.maximum.accumulate(index, axis=-1, out=index)
+    return np.take_along_axis(values, index, axis=-1)
+
+
+class Trajectories:
+    """Результат value_trajectories.
+
+    declared — последнее заявленное HeroValue (NaN до первого),
+    evaluations — накопленная сумма весов DecisionEvaluation,
+    facts — накопленное влияние фактов саги (numeric_value × AffectOnValue.weight)
+    по ценностям, общее для всех героев.
+    """
+
+    def __init__(self, hero_ids, dimension_ids, event_ids, declared, evaluations, facts):
+        self.hero_ids = hero_ids
+        self.dimension_ids = dimension_ids
+        self.event_ids = event_ids
+        self.declared = declared
+        self.evaluations = evaluations
+        self.facts = facts
+
+    @property
+    def score(self):
+        """Итоговая оценка: заявленная ценность плюс накопленные оценки поступков."""
+        return np.nan_to_num(self.declared) + self.evaluations
+
+    def hero(self, hero_id):
+        """Оценки героя (ценность × событие); KeyError, если героя нет в расчёте."""
+        position = int(_positions(self.hero_ids, [hero_id])[0])
+        if position < 0:
+            raise KeyError(hero_id)
+        return self.score[position]
+
+
+@analytics_reads()
+def value_trajectories(saga, heroes=None, dtype=np.float32):
+    """Траектории ценностей героев саги по всем её событиям.
+
+    Запись без события (event_after пуст) действует с начала саги; записи о
+    событиях вне саги отбрасываются.
+    """
+    if heroes is None:
+        heroes = Hero.objects.filter(saga=saga)
+    hero_ids = np.fromiter(heroes.order_by("pk").values_list("pk", flat=True), dtype=np.int64)
+    dimension_ids = np.fromiter(refcache.objects(ValueDimension), dtype=np.int64)
+    event_ids = saga_timeline(saga)
+    shape = (len(hero_ids), len(dimension_ids), len(event_ids))
+
+    def locate(hero, dimension, event):
+        h = _positions(hero_ids, hero)
+        d = _positions(dimension_ids, dimension)
+        t = np.where(np.array([e is None for e in event], dtype=bool), 0, _positions(event_ids, event))
+        keep = (h >= 0) & (d >= 0) & (t >= 0) & (t < len(event_ids))
+        return h[keep], d[keep], t[keep], keep
+
+    declared = np.full(shape, np.nan, dtype=dtype)
+    pk, hero, dimension, weight, event = _columns(
+        HeroValue.objects.filter(hero__in=heroes), "pk", "hero", "value_dimension", "weight", "event_after")
+    h, d, t, keep = locate(hero, dimension, event)
+    # При нескольких записях в одной точке побеждает последняя по id.
+    order = np.lexsort((np.asarray(pk, dtype=np.int64)[keep], t, d, h))
+    h, d, t = h[order], d[order], t[order]
+    last = np.ones(len(order), dtype=bool)
+    last[:-1] = (h[1:] != h[:-1]) | (d[1:] != d[:-1]) | (t[1:] != t[:-1])
+    declared[h[last], d[last], t[last]] = np.asarray(weight, dtype=dtype)[keep][order][last]
+    declared = _forward_fill(declared)
+
+    evaluations = np.zeros(shape, dtype=dtype)
+    hero, dimension, weight, event = _columns(
+        DecisionEvaluation.objects.filter(hero_was_evaluated__in=heroes),
+        "hero_was_evaluated", "affects_on_vd", "weight", "event_after")
+    h, d, t, keep = locate(hero, dimension, event)
+    np.add.at(evaluations, (h, d, t), np.asarray(weight, dtype=dtype)[keep])
+    np.cumsum(evaluations, axis=-1, out=evaluations)
+
+    fact_type, dimension, weight = _columns(AffectOnValue.objects.all(), "fact_type", "value_dimension", "weight")
+    fact_type_ids = np.unique(np.asarray(fact_type, dtype=np.int64))
+    affects = np.zeros((len(fact_type_ids), len(dimension_ids)), dtype=dtype)
+    affects[_positions(fact_type_ids, fact_type), _positions(dimension_ids, dimension)] = weight
+
+    facts = np.zeros((len(dimension_ids), len(event_ids)), dtype=dtype)
+    fact_type, value, event = _columns(
+        Fact.objects.filter(composition__saga=saga, numeric_value__isnull=False, result_of_event__isnull=False),
+        "fact_type", "numeric_value", "result_of_event")
+    f = _positions(fact_type_ids, fact_type)
+    t = _positions(event_ids, event)
+    keep = (f >= 0) & (t >= 0)
+    np.add.at(facts.T, t[keep], np.asarray(value, dtype=dtype)[keep, None] * affects[f[keep]])
+    np.cumsum(facts, axis=-1, out=facts)
+
+    return Trajectories(hero_ids, dimension_ids, event_ids, declared, evaluations, facts)
@@ -0,0 +1,156 @@
+"""Read-only JSON API над основными моделями.
+
+Списки листаются ключом (cursor — последний отданный id), а не OFFSET:
+каждая страница — диапазонный запрос по первичному ключу, сколько бы строк ни
+было до неё. ?fields= сужает набор полей, фильтры — по полям из Resource.filters.
+Валидаторы ETag/Last-Modified берутся из версии таблицы (versions), поэтому
+повторный запрос без изменений отвечает 304 одним запросом к базе.
+
+Представления асинхронные (views): строки читаются aiterator(), страница
+отдаётся по мере чтения, и медленный клиент не держит рабочий поток.
+"""
+import base64
+import hashlib
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+from .models import Composition, Episode, Event, Fact, Hero, Saga
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+
+class ApiError(Exception):
+    pass
+
+
+class Resource:
+    def __init__(self, model, filters=()):
+        self.model = model
+        self.fields = tuple(field.name for field in model._meta.concrete_fields)
+        self.filters = filters
+
+    def select(self, fields=None):
+        if not fields:
+            return self.fields
+        fields = [name.strip() for name in fields.split(",") if name.strip()]
+        unknown = set(fields) - set(self.fields)
+        if unknown:
+            raise ApiError(f"неизвестные поля: {', '.join(sorted(unknown))}")
+        return ("id", *(name for name in fields if name != "id"))
+
+    def queryset(self, params):
+        queryset = self.model.objects.all()
+        for name in self.filters:
+            if name in params:
+                field = self.model._meta.get_field(name)
+                try:
+                    value = (field.target_field if field.is_relation else field).to_python(params[name])
+                except ValidationError as exc:
+                    raise ApiError(f"{name}: {'; '.join(exc.messages)}")
+                queryset = queryset.filter(**{name: value})
+        return queryset
+
+
+RESOURCES = {
+    "sagas": Resource(Saga, filters=("universe_of_events", "author")),
+    "compositions": Resource(Composition, filters=("saga", "composition_type")),
+    "events": Resource(Event, filters=("composition", "place", "zero_event_flag")),
+    "heroes": Resource(Hero, filters=("saga",)),
+    "episodes": Resource(Episode, filters=("composition",)),
+    "facts": Resource(Fact, filters=("composition", "fact_type", "result_of_event")),
+}
+
+
+def encode_cursor(*values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, size=1):
+    """Значения ключа из cursor (size чисел)."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        raise ApiError("неверный cursor")
+    if (not isinstance(values, list) or len(values) != size
+            or not all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values)):
+        raise ApiError("неверный cursor")
+    return values
+
+
+def limit(params):
+    try:
+        value = int(params.get("limit", DEFAULT_LIMIT))
+    except ValueError:
+        raise ApiError("limit должен быть числом")
+    return max(1, min(value, MAX_LIMIT))
+
+
+def number(params, name):
+    if params.get(name) in (None, ""):
+        return None
+    try:
+        return float(params[name])
+    except ValueError:
+        raise ApiError(f"{name} должен быть числом")
+
+
+def etag(name, table_versions, params, *key):
+    """ETag по версиям таблиц (versions.version) и параметрам запроса."""
+    if any(table_version is None for table_version in table_versions):
+        return None
+    query = "&".join(f"{k}={v}" for k, v in sorted(params.items()))
+    state = ",".join(str(table_version[0]) for table_version in table_versions)
+    return f'"{hashlib.sha1(f"{name}:{state}:{key}:{query}".encode()).hexdigest()}"'
+
+
+def page(resource, params):
+    """Поля, размер страницы и queryset на limit + 1 строк: лишняя значит, что есть следующая."""
+    fields = resource.select(params.get("fields"))
+    queryset = resource.queryset(params)
+    if params.get("cursor"):
+        queryset = queryset.filter(pk__gt=decode_cursor(params["cursor"])[0])
+    size = limit(params)
+    return fields, size, queryset.order_by("pk").values(*fields)[:size + 1]
+
+
+TIMELINE_FIELDS = ("id", "title", "timeline_offset", "date_time_from_zero_event", "composition", "place")
+
+
+def timeline_page(params):
+    """События на отрезке шкалы [start, end], ключ страницы — (timeline_offset, id)."""
+    universe = params.get("universe")
+    if universe is not None and not universe.isdigit():
+        raise ApiError("universe должен быть id")
+    queryset = Event.objects.between(number(params, "start"), number(params, "end"), universe=universe)
+    if params.get("saga"):
+        if not params["saga"].isdigit():
+            raise ApiError("saga должен быть id")
+        queryset = queryset.filter(composition__saga=params["saga"])
+    if params.get("cursor"):
+        offset, pk = decode_cursor(params["cursor"], size=2)
+        queryset = queryset.filter(Q(timeline_offset__gt=offset) | Q(timeline_offset=offset, pk__gt=pk))
+    size = limit(params)
+    return size, queryset.values(*TIMELINE_FIELDS)[:size + 1]
+
+
+async def stream_page(rows, size, next_url, key=("id",)):
+    """Части JSON-ответа {"results": [...], "next": url} из асинхронного итератора строк.
+
+    next_url(cursor) строит ссылку на следующую страницу, key — поля ключа страницы.
+    """
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    yield '{"results": ['
+    count, last = 0, None
+    async for row in rows:
+        if count == size:
+            break
+        yield ("," if count else "") + encoder.encode(row)
+        count, last = count + 1, row
+    else:
+        last = None
+    cursor = encode_cursor(*(last[name] for name in key)) if last is not None else None
+    yield '], "next": ' + json.dumps(next_url(cursor) if cursor else None) + "}"
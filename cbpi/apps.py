@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class CbpiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'cbpi'
+
+    def ready(self):
+        from . import signals
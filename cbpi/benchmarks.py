@@ -0,0 +1,204 @@
+"""Замеры страниц админки, API и аналитики на текущей базе.
+
+Замер (Case) выполняется для прогрева, ещё раз с подсчётом запросов ко всем
+соединениям, затем repeat раз по времени. Перед каждым запуском reset
+сбрасывает кеши процесса, чтобы аналитика мерилась «с холода»; страницы и API
+мерятся как в долго живущем процессе. Запросы идут через тестовый клиент
+Django в процессе, без сети.
+
+Результат — словарь для JSON: окружение, число строк в больших таблицах и по
+строке на замер. compare() сравнивает его с прошлым результатом: медиана
+выросла больше чем в threshold раз (и больше чем на slack_ms) или стало больше
+запросов к базе — регрессия. Данные для замеров создаёт generate_universe.
+"""
+import platform
+import sqlite3
+import time
+from contextlib import ExitStack
+
+import django
+import numpy as np
+from django.db import connection, connections
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from . import causality, documents, history, network, similarity, versions
+from .analytics import saga_timeline, value_trajectories
+from .models import (DecisionEvaluation, Episode, Event, EventSequence, EventSequenceClosure, Fact, FactRelation, Hero,
+                     HeroValue, Participation, Place, Saga)
+
+GROUPS = ("admin", "api", "analytics")
+ROW_COUNTS = (Place, Event, EventSequence, EventSequenceClosure, Episode, Fact, FactRelation, Hero, Participation,
+              HeroValue, DecisionEvaluation)
+ADMIN_CHANGELISTS = ("saga", "place", "event", "episode", "hero", "participation", "herovalue", "decisionevaluation",
+                     "eventsequence", "factrelation")
+SEARCH_TEXT = "битва"
+
+
+class Case:
+    def __init__(self, group, name, run, reset=None):
+        self.group = group
+        self.name = name
+        self.run = run
+        self.reset = reset or (lambda: None)
+
+
+class _QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def _get(client, url):
+    response = client.get(url)
+    if response.streaming:
+        for _ in response.streaming_content:
+            pass
+    if response.status_code >= 400:
+        raise RuntimeError(f"{url}: HTTP {response.status_code}")
+    return response
+
+
+def targets(saga=None):
+    """Сага (по умолчанию — с наибольшим числом произведений), её самый занятый герой,
+    событие из середины шкалы и первый факт."""
+    sagas = Saga.objects.filter(pk=saga) if saga is not None else Saga.objects.order_by("-composition_count", "pk")
+    saga = sagas.first()
+    if saga is None:
+        return None, None, None, None
+    hero = Hero.objects.filter(saga=saga).order_by("-participation_count", "pk").first()
+    events = Event.objects.filter(composition__saga=saga, timeline_offset__isnull=False).order_by("timeline_offset", "pk")
+    event = events[events.count() // 2] if events.exists() else None
+    fact = Fact.objects.filter(composition__saga=saga).order_by("pk").first()
+    return saga, hero, event, fact
+
+
+def cases(client, saga, hero=None, event=None, fact=None):
+    def page(group, name, url):
+        return Case(group, name, lambda: _get(client, url))
+
+    found = [page("admin", name, reverse(f"admin:cbpi_{name}_changelist")) for name in ADMIN_CHANGELISTS]
+    found.append(page("admin", "event?q", f"{reverse('admin:cbpi_event_changelist')}?q={SEARCH_TEXT}"))
+    found += [
+        page("api", "events", reverse("cbpi:resource-list", args=["events"]) + "?limit=100"),
+        page("api", "heroes?saga", reverse("cbpi:resource-list", args=["heroes"]) + f"?saga={saga.pk}&limit=100"),
+        page("api", "timeline", reverse("cbpi:timeline") + "?limit=100"),
+        page("api", "search", reverse("cbpi:search") + f"?q={SEARCH_TEXT}"),
+        page("api", "saga-document", reverse("cbpi:saga-document", args=[saga.pk])),
+        page("api", "saga-export", reverse("cbpi:saga-export", args=[saga.pk])),
+    ]
+    found += [
+        Case("analytics", "saga_timeline", lambda: saga_timeline(saga)),
+        Case("analytics", "value_trajectories", lambda: value_trajectories(saga)),
+        Case("analytics", "documents.build", lambda: documents.build(saga.pk)),
+        Case("analytics", "hero_network.eigenvector", lambda: network.hero_network(saga).cooccurrence().eigenvector(),
+             reset=network.invalidate_networks),
+    ]
+    if hero is not None:
+        found += [
+            page("admin", "hero-change", reverse("admin:cbpi_hero_change", args=[hero.pk])),
+            page("api", "hero-trajectory", reverse("cbpi:hero-trajectory", args=[hero.pk])),
+            page("api", "hero-similar", reverse("cbpi:hero-similar", args=[hero.pk])),
+            Case("analytics", "value_index.similar", lambda: similarity.value_index().similar(hero.pk),
+                 reset=similarity.invalidate_index),
+        ]
+    if event is not None:
+        found += [
+            page("api", "event-states", reverse("cbpi:event-states", args=[event.pk]) + f"?saga={saga.pk}"),
+            Case("analytics", "history.states_at", lambda: history.states_at(event, Hero.objects.filter(saga=saga))),
+            Case("analytics", "closure.events_after",
+                 lambda: EventSequenceClosure.objects.events_after(event).count()),
+            Case("analytics", "events.between",
+                 lambda: Event.objects.between(event.timeline_offset - 10, event.timeline_offset + 10).count()),
+        ]
+        if hero is not None:
+            found.append(page("api", "hero-state", reverse("cbpi:hero-state", args=[hero.pk]) + f"?event={event.pk}"))
+        if event.place_id:
+            root = Place.objects.get(pk=event.place.path.strip("/").split("/")[0])
+            found.append(Case("analytics", "place.events_within", lambda: root.events_within().count()))
+    if fact is not None:
+        found.append(Case("analytics", "fact_graph.propagate",
+                          lambda: causality.fact_graph(saga=saga).propagate(fact.pk),
+                          reset=causality.invalidate_fact_graphs))
+    return sorted(found, key=lambda case: GROUPS.index(case.group))
+
+
+def measure(case, repeat=5):
+    result = {"group": case.group, "name": case.name}
+    try:
+        # Прогрев: запросы считаются в состоянии, в котором идут замеры.
+        case.reset()
+        case.run()
+        case.reset()
+        counter = _QueryCounter()
+        with ExitStack() as stack:
+            # Обёртка не открывает соединений, в отличие от CaptureQueriesContext.
+            for wrapper in connections.all():
+                stack.enter_context(wrapper.execute_wrapper(counter))
+            case.run()
+        timings = []
+        for _ in range(repeat):
+            case.reset()
+            started = time.perf_counter()
+            case.run()
+            timings.append((time.perf_counter() - started) * 1000)
+    except Exception as exc:
+        return {**result, "status": f"{type(exc).__name__}: {exc}"}
+    result.update(status="ok", queries=counter.count, runs=repeat)
+    if timings:
+        result.update({f"{name}_ms": round(float(value), 3) for name, value in (
+            ("min", min(timings)), ("median", np.median(timings)), ("p95", np.percentile(timings, 95)),
+            ("max", max(timings)))})
+    return result
+
+
+def row_counts():
+    counts = {}
+    for model in ROW_COUNTS:
+        count = versions.row_count(model)
+        counts[model.__name__] = model.objects.count() if count is None else count
+    return counts
+
+
+def environment(label=""):
+    return {
+        "label": label,
+        "created": timezone.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "database": connection.vendor,
+        "sqlite": sqlite3.sqlite_version,
+    }
+
+
+def compare(results, baseline, threshold=1.25, slack_ms=1.0):
+    """Регрессии относительно прошлого результата: список строк для отчёта."""
+    previous = {(row["group"], row["name"]): row for row in baseline.get("results", ()) if row.get("status") == "ok"}
+    regressions = []
+    for row in results:
+        before = previous.get((row["group"], row["name"]))
+        if before is None:
+            continue
+        name = f"{row['group']}/{row['name']}"
+        if row["status"] != "ok":
+            regressions.append(f"{name}: {row['status']}")
+            continue
+        if "median_ms" in row and "median_ms" in before and (
+                row["median_ms"] > before["median_ms"] * threshold
+                and row["median_ms"] - before["median_ms"] > slack_ms):
+            regressions.append(f"{name}: медиана {before['median_ms']:.1f} → {row['median_ms']:.1f} мс")
+        if row["queries"] > before["queries"]:
+            regressions.append(f"{name}: запросов {before['queries']} → {row['queries']}")
+    return regressions
+
+
+def make_client(user=None, host="localhost"):
+    """Тестовый клиент Django; с user — с входом в админку."""
+    result = Client(HTTP_HOST=host)
+    if user is not None:
+        result.force_login(user)
+    return result
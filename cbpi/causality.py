@@ -0,0 +1,118 @@
+"""Граф причинности фактов (FactRelation) в памяти процесса.
+
+Граф строится один раз на сагу или произведение тремя запросами и
+кешируется до изменения FactRelation, Fact или AffectOnValue: в своём процессе
+кеш сбрасывают сигналы, изменения из других процессов видны по версиям таблиц
+(versions.VersionedCache).
+"""
+from collections import defaultdict, deque
+
+from .models import AffectOnValue, Fact, FactRelation
+from .routers import analytics_reads
+from .versions import VersionedCache
+
+_graphs = VersionedCache(Fact, FactRelation, AffectOnValue)
+
+
+class FactGraph:
+    def __init__(self, facts, relations, affects):
+        # facts: {id: (fact_type_id, numeric_value, result_of_event_id)}
+        self.facts = facts
+        self.successors = defaultdict(list)
+        self.predecessors = defaultdict(list)
+        self.edge_events = {}
+        for based, followed, event in relations:
+            self.successors[based].append(followed)
+            self.predecessors[followed].append(based)
+            if event is not None:
+                self.edge_events[based, followed] = event
+        self.affects = defaultdict(dict)
+        for fact_type, dimension, weight in affects:
+            self.affects[fact_type][dimension] = weight
+
+    @classmethod
+    @analytics_reads()
+    def load(cls, saga=None, composition=None):
+        facts = Fact.objects.all()
+        if saga is not None:
+            facts = facts.filter(composition__saga=saga)
+        if composition is not None:
+            facts = facts.filter(composition=composition)
+        relations = FactRelation.objects.filter(based_fact__in=facts, followed_fact__in=facts)
+        return cls(
+            {pk: rest for pk, *rest in facts.values_list("pk", "fact_type", "numeric_value", "result_of_event")},
+            relations.values_list("based_fact", "followed_fact", "event_relation"),
+            AffectOnValue.objects.values_list("fact_type", "value_dimension", "weight"),
+        )
+
+    def _walk(self, start, edges):
+        depths = {start: 0}
+        queue = deque([start])
+        while queue:
+            node = queue.popleft()
+            for nxt in edges.get(node, ()):
+                if nxt not in depths:
+                    depths[nxt] = depths[node] + 1
+                    queue.append(nxt)
+        del depths[start]
+        return depths
+
+    def downstream(self, fact_id):
+        """Факты, следующие из данного, с расстоянием в рёбрах."""
+        return self._walk(fact_id, self.successors)
+
+    def upstream(self, fact_id):
+        return self._walk(fact_id, self.predecessors)
+
+    def downstream_events(self, fact_id):
+        reached = {fact_id, *self.downstream(fact_id)}
+        events = {self.facts[f][2] for f in reached if f in self.facts and self.facts[f][2] is not None}
+        events.update(event for (a, b), event in self.edge_events.items() if a in reached)
+        return events
+
+    def propagate(self, fact_id, decay=1.0):
+        """Влияние факта и его следствий на ценности: {value_dimension_id: вес}.
+
+        Каждый факт даёт numeric_value × AffectOnValue.weight (нечисловой — 1 ×
+        weight), ослабленное в decay**расстояние раз.
+        """
+        impact = defaultdict(float)
+        for fact, depth in {fact_id: 0, **self.downstream(fact_id)}.items():
+            if fact not in self.facts:
+                continue
+            fact_type, value, _ = self.facts[fact]
+            factor = (1.0 if value is None else value) * decay ** depth
+            for dimension, weight in self.affects.get(fact_type, {}).items():
+                impact[dimension] += factor * weight
+        return dict(impact)
+
+    def find_cycle(self):
+        """Один цикл фактов в виде списка id или None, если граф ацикличен."""
+        state = {}
+        for root in list(self.successors):
+            if root in state:
+                continue
+            path = [root]
+            stack = [iter(self.successors[root])]
+            state[root] = "open"
+            while stack:
+                nxt = next(stack[-1], None)
+                if nxt is None:
+                    state[path.pop()] = "done"
+                    stack.pop()
+                elif state.get(nxt) == "open":
+                    return path[path.index(nxt):]
+                elif nxt not in state:
+                    state[nxt] = "open"
+                    path.append(nxt)
+                    stack.append(iter(self.successors.get(nxt, ())))
+        return None
+
+
+def fact_graph(saga=None, composition=None):
+    key = (getattr(saga, "pk", saga), getattr(composition, "pk", composition))
+    return _graphs.get(key, lambda: FactGraph.load(saga=saga, composition=composition))
+
+
+def invalidate_fact_graphs():
+    _graphs.clear()
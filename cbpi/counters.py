@@ -0,0 +1,73 @@
+"""Счётчики дочерних строк (CounterField) у саг, произведений, героев и действий.
+
+Счётчик меняют триггеры SQLite на вставку, удаление и перенос дочерней строки
+к другому родителю — в той же транзакции, что и само изменение, поэтому он
+верен и при bulk_create/update/delete. Как и у versions, триггеры создаёт
+миграция, а после каждого migrate их восстанавливает install(). На других
+СУБД триггеров нет: счётчики пересчитывает repair() (команда repair_counters).
+"""
+from django.db import connection
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .models import Composition, DecisionEvaluation, Episode, Hero, HeroAction, Participation, Saga
+
+# (родитель, счётчик, дочерняя модель, FK на родителя)
+COUNTERS = (
+    (Saga, "composition_count", Composition, "saga"),
+    (Composition, "episode_count", Episode, "composition"),
+    (Hero, "participation_count", Participation, "hero"),
+    (Hero, "action_count", HeroAction, "hero"),
+    (HeroAction, "evaluation_count", DecisionEvaluation, "eval_for_ha"),
+)
+
+
+def _trigger(child, counter):
+    return f"{child._meta.db_table}_{counter}"
+
+
+def install(connection=connection):
+    if connection.vendor != "sqlite":
+        return
+    tables = connection.introspection.table_names()
+    with connection.cursor() as cursor:
+        for parent, counter, child, fk in COUNTERS:
+            table, child_table = parent._meta.db_table, child._meta.db_table
+            if table not in tables or child_table not in tables:
+                continue
+            column = child._meta.get_field(fk).column
+            name = _trigger(child, counter)
+
+            def change(row, sign):
+                return f"UPDATE {table} SET {counter} = {counter} {sign} 1 WHERE id = {row}.{column};"
+
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {name}_ai AFTER INSERT ON {child_table} "
+                f"WHEN new.{column} IS NOT NULL BEGIN {change('new', '+')} END")
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {name}_ad AFTER DELETE ON {child_table} "
+                f"WHEN old.{column} IS NOT NULL BEGIN {change('old', '-')} END")
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {name}_au AFTER UPDATE OF {column} ON {child_table} "
+                f"WHEN old.{column} IS NOT new.{column} BEGIN {change('old', '-')} {change('new', '+')} END")
+
+
+def uninstall(connection=connection):
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        for _, counter, child, _ in COUNTERS:
+            for suffix in ("ai", "ad", "au"):
+                cursor.execute(f"DROP TRIGGER IF EXISTS {_trigger(child, counter)}_{suffix}")
+
+
+def repair():
+    """Пересчитывает все счётчики одним UPDATE на каждый; {счётчик: исправлено строк}."""
+    repaired = {}
+    for parent, counter, child, fk in COUNTERS:
+        actual = Coalesce(Subquery(
+            child.objects.filter(**{fk: OuterRef("pk")}).order_by().values(fk)
+            .annotate(count=Count("pk")).values("count")), Value(0))
+        repaired[f"{parent.__name__}.{counter}"] = (
+            parent.objects.exclude(**{counter: actual}).update(**{counter: actual}))
+    return repaired
@@ -0,0 +1,140 @@
+"""Готовые документы саг для страницы обзора.
+
+Документ — сага с автором и вселенной, произведения с цепочками эпизодов и
+составом, герои с ролями — хранится в SagaDocument и читается одним запросом.
+При сборке записываются все строки, из которых он собран
+(SagaDocumentDependency). Сигналы моделей из TRACKED ищут документы, зависящие
+от изменённой строки или от её родителей (новый эпизод — через произведение),
+помечают их устаревшими и ставят задачу saga_document; устаревший документ
+при чтении собирается заново сразу. Bulk-операции сигналов не шлют: их
+вызывающие (задачи timeline и episode_order, импорт) помечают документы саг
+через sagas_changed, после остальных нужна команда build_saga_documents.
+"""
+from django.db import transaction
+from django.db.models import Q
+
+from . import refcache
+from .models import (Author, Composition, CompositionType, Episode, Hero, Job, Participation, RoleType, Saga,
+                     SagaDocument, SagaDocumentDependency, Universe)
+
+TRACKED = (Saga, Author, Universe, Composition, CompositionType, Episode, Hero, Participation, RoleType)
+
+
+def _name(model, pk, field="name"):
+    obj = refcache.get(model, pk) if pk is not None else None
+    return getattr(obj, field) if obj is not None else None
+
+
+def build(saga_id):
+    """(документ, {(таблица, id)}) или (None, None), если саги нет."""
+    saga = Saga.objects.filter(pk=saga_id).values(
+        "id", "name", "zero_event_abbreviature", "date_first_published",
+        "author", "author__name", "universe_of_events", "universe_of_events__name").first()
+    if saga is None:
+        return None, None
+    dependencies = {(Saga._meta.db_table, saga["id"])}
+    document = {key: saga[key] for key in ("id", "name", "zero_event_abbreviature", "date_first_published")}
+    for key, model, pk in (("author", Author, saga["author"]), ("universe", Universe, saga["universe_of_events"])):
+        document[key] = None
+        if pk is not None:
+            dependencies.add((model._meta.db_table, pk))
+            document[key] = {"id": pk, "name": saga["author__name" if model is Author else "universe_of_events__name"]}
+
+    compositions = {}
+    for row in Composition.objects.filter(saga=saga_id).order_by("date_published", "pk").values(
+            "id", "title", "date_published", "composition_type"):
+        dependencies.add((Composition._meta.db_table, row["id"]))
+        if row["composition_type"] is not None:
+            dependencies.add((CompositionType._meta.db_table, row["composition_type"]))
+        compositions[row["id"]] = {**row, "composition_type": _name(CompositionType, row["composition_type"], "title"),
+                                   "episodes": []}
+    episodes = {}
+    for row in Episode.objects.filter(composition__saga=saga_id).order_by("composition", "position", "pk").values(
+            "id", "composition", "title", "position", "previous_episode", "start_event"):
+        dependencies.add((Episode._meta.db_table, row["id"]))
+        episodes[row["id"]] = {key: value for key, value in row.items() if key != "composition"}
+        episodes[row["id"]]["cast"] = []
+        compositions[row["composition"]]["episodes"].append(episodes[row["id"]])
+
+    heroes = {}
+    for row in Hero.objects.filter(saga=saga_id).order_by("name", "pk").values("id", "name"):
+        dependencies.add((Hero._meta.db_table, row["id"]))
+        heroes[row["id"]] = {**row, "roles": []}
+    for row in Participation.objects.filter(episode__composition__saga=saga_id).order_by("pk").values(
+            "id", "hero", "hero__name", "episode", "role_type"):
+        dependencies.update({(Participation._meta.db_table, row["id"]), (Hero._meta.db_table, row["hero"])})
+        if row["role_type"] is not None:
+            dependencies.add((RoleType._meta.db_table, row["role_type"]))
+        role = _name(RoleType, row["role_type"])
+        episodes[row["episode"]]["cast"].append({"hero": row["hero"], "name": row["hero__name"], "role": role})
+        # Гости из других саг тоже попадают в список героев.
+        heroes.setdefault(row["hero"], {"id": row["hero"], "name": row["hero__name"], "roles": []})
+        heroes[row["hero"]]["roles"].append({"episode": row["episode"], "role": role})
+
+    document["compositions"] = list(compositions.values())
+    document["heroes"] = list(heroes.values())
+    return document, dependencies
+
+
+def refresh(saga_id):
+    """Собирает и сохраняет документ саги; None, если саги нет."""
+    # Чтение и запись в одной транзакции: если сагу успели изменить между ними,
+    # SQLite не даст записать документ по старому снимку, и задача повторится.
+    with transaction.atomic():
+        document, dependencies = build(saga_id)
+        if document is None:
+            SagaDocument.objects.filter(pk=saga_id).delete()
+            return None
+        SagaDocument.objects.update_or_create(saga_id=saga_id, defaults={"document": document, "stale": False})
+        SagaDocumentDependency.objects.filter(document=saga_id).delete()
+        SagaDocumentDependency.objects.bulk_create(
+            [SagaDocumentDependency(document_id=saga_id, table_name=table, row_id=pk) for table, pk in dependencies],
+            batch_size=1000)
+    return document
+
+
+def saga_document(saga_id):
+    document = SagaDocument.objects.filter(pk=saga_id, stale=False).values_list("document", flat=True).first()
+    return document if document is not None else refresh(saga_id)
+
+
+def rebuild(saga_id=None):
+    """Задача saga_document: одна сага или все документы, помеченные устаревшими."""
+    sagas = [saga_id] if saga_id is not None else SagaDocument.objects.filter(stale=True).values_list("pk", flat=True)
+    for pk in list(sagas):
+        refresh(pk)
+
+
+def row_changed(instance):
+    """Помечает устаревшими документы, зависящие от строки или её родителей из TRACKED."""
+    rows = {(instance._meta.db_table, instance.pk)}
+    for field in instance._meta.concrete_fields:
+        if field.is_relation and field.related_model in TRACKED and getattr(instance, field.attname) is not None:
+            rows.add((field.related_model._meta.db_table, getattr(instance, field.attname)))
+    condition = Q()
+    for table, pk in rows:
+        condition |= Q(table_name=table, row_id=pk)
+    sagas = list(SagaDocumentDependency.objects.filter(condition, document__stale=False)
+                 .values_list("document", flat=True).distinct())
+    if sagas:
+        SagaDocument.objects.filter(pk__in=sagas).update(stale=True)
+        # Задачи — после коммита: сага могла удаляться вместе со строкой.
+        transaction.on_commit(lambda: _enqueue(sagas))
+    return sagas
+
+
+def sagas_changed(sagas=None):
+    """Помечает устаревшими документы саг (None — всех) после bulk-операций без сигналов."""
+    documents = SagaDocument.objects.filter(stale=False)
+    if sagas is not None:
+        documents = documents.filter(pk__in=list(sagas))
+    marked = list(documents.values_list("pk", flat=True))
+    if marked:
+        SagaDocument.objects.filter(pk__in=marked).update(stale=True)
+        transaction.on_commit(lambda: _enqueue(marked))
+    return marked
+
+
+def _enqueue(sagas):
+    for saga_id in SagaDocument.objects.filter(pk__in=sagas, stale=True).values_list("pk", flat=True):
+        Job.objects.enqueue("saga_document", saga_id)
@@ -0,0 +1,105 @@
+"""Потоковая выгрузка саги в JSONL (по желанию — gzip или zstd).
+
+Каждая строка — объект {"model": ..., поля модели}; ссылки записаны как id.
+Модели идут в порядке зависимостей (EXPORTS), так что объект всегда
+встречается раньше ссылок на него. Строки читаются .iterator(chunk_size),
+поэтому память не зависит от размера саги. Справочники (места, типы ролей,
+фактов и т. п.) не выгружаются — в записях остаются их id.
+"""
+import zlib
+from collections import Counter
+from contextlib import nullcontext
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import router, transaction
+
+from .models import (Composition, Decision, DecisionEvaluation, Episode, Event, EventSequence, Fact, FactRelation,
+                     Hero, HeroAction, HeroValue, Participation, Saga)
+from .routers import ANALYTICS_DATABASE, analytics_reads
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# (имя записи, модель, путь к саге, порядок)
+EXPORTS = (
+    ("saga", Saga, "pk", ("pk",)),
+    ("composition", Composition, "saga", ("pk",)),
+    ("event", Event, "composition__saga", ("pk",)),
+    ("hero", Hero, "saga", ("pk",)),
+    # Предыдущий эпизод всегда стоит раньше по позиции.
+    ("episode", Episode, "composition__saga", ("composition", "position", "pk")),
+    ("participation", Participation, "hero__saga", ("pk",)),
+    ("event_sequence", EventSequence, "event_before__composition__saga", ("pk",)),
+    ("fact", Fact, "composition__saga", ("pk",)),
+    ("fact_relation", FactRelation, "based_fact__composition__saga", ("pk",)),
+    ("hero_value", HeroValue, "hero__saga", ("pk",)),
+    ("decision", Decision, "hero__saga", ("pk",)),
+    ("hero_action", HeroAction, "hero__saga", ("pk",)),
+    ("decision_evaluation", DecisionEvaluation, "hero_was_evaluated__saga", ("pk",)),
+)
+
+COMPRESSIONS = ("gzip", "zstd")
+
+
+class ExportError(Exception):
+    pass
+
+
+def compressor(compression):
+    """Объект с compress()/flush() для потокового сжатия."""
+    if compression == "gzip":
+        return zlib.compressobj(6, zlib.DEFLATED, 31)
+    if compression == "zstd":
+        if zstandard is None:
+            raise ExportError("для zstd нужен пакет zstandard")
+        return zstandard.ZstdCompressor().compressobj()
+    raise ExportError(f"неизвестное сжатие {compression!r}")
+
+
+class SagaExporter:
+    def __init__(self, saga, chunk_size=1000):
+        self.saga = saga
+        self.chunk_size = chunk_size
+        self.exported = Counter()
+
+    def records(self):
+        with analytics_reads():
+            using = router.db_for_read(Saga)
+        # На read-only соединении вся выгрузка читает один снимок базы (WAL);
+        # на основном транзакцию не открываем, чтобы не держать блокировку записи.
+        with transaction.atomic(using=using) if using == ANALYTICS_DATABASE else nullcontext():
+            for name, model, lookup, ordering in EXPORTS:
+                fields = [field.name for field in model._meta.concrete_fields]
+                rows = (model.objects.using(using).filter(**{lookup: self.saga.pk})
+                        .order_by(*ordering).values(*fields))
+                for row in rows.iterator(chunk_size=self.chunk_size):
+                    self.exported[name] += 1
+                    yield {"model": name, **row}
+
+    def lines(self):
+        """Строки JSONL, склеенные порциями по chunk_size."""
+        encoder = DjangoJSONEncoder(ensure_ascii=False)
+        chunk = []
+        for record in self.records():
+            chunk.append(encoder.encode(record) + "\n")
+            if len(chunk) >= self.chunk_size:
+                yield "".join(chunk)
+                chunk = []
+        if chunk:
+            yield "".join(chunk)
+
+    def chunks(self, compression=None):
+        """Байты выгрузки, сжатые на лету; неверное сжатие — ExportError сразу."""
+        return self._pack(compressor(compression) if compression else None)
+
+    def _pack(self, packer):
+        for lines in self.lines():
+            data = lines.encode()
+            if packer:
+                data = packer.compress(data)
+            if data:
+                yield data
+        if packer:
+            yield packer.flush()
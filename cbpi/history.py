@@ -0,0 +1,137 @@
+"""Состояние героя на момент события: ценности и оценки поступков.
+
+HeroValue и DecisionEvaluation хранят в as_of позицию своего события на шкале
+(Event.timeline_offset; без события — -inf, то есть с начала саги). Колонку
+ведут триггеры SQLite: на вставку и смену event_after строки и на изменение
+timeline_offset события, поэтому она верна и после sync_timeline и
+bulk-операций. По индексу (герой, as_of) состояние любого числа героев на
+одно событие выбирается одним запросом: последняя запись по каждой ценности и
+все оценки не позже события. Записи события без позиции на шкале (as_of
+NULL) видны только на нём самом и считаются последними; такое событие видит
+их и записи «с начала». Как и у versions, триггеров на других СУБД нет.
+"""
+from collections import defaultdict
+
+from django.db import connection, connections, router
+from django.db.models import QuerySet
+
+from .models import DecisionEvaluation, Event, Hero, HeroValue
+from .routers import analytics_reads
+
+TABLES = (HeroValue, DecisionEvaluation)
+
+
+def _position(row):
+    event = Event._meta.db_table
+    return (f"CASE WHEN {row}.event_after_id IS NULL THEN -9e999 "
+            f"ELSE (SELECT timeline_offset FROM {event} WHERE id = {row}.event_after_id) END")
+
+
+def install(connection=connection):
+    if connection.vendor != "sqlite":
+        return
+    tables = connection.introspection.table_names()
+    event = Event._meta.db_table
+    with connection.cursor() as cursor:
+        for model in TABLES:
+            table = model._meta.db_table
+            if table not in tables:
+                continue
+            if "as_of" not in {column.name for column in connection.introspection.get_table_description(cursor, table)}:
+                # Миграции до 0015: триггеры создаст она.
+                return
+            for suffix, when in (("ai", "INSERT"), ("au", "UPDATE OF event_after_id, as_of")):
+                cursor.execute(
+                    f"CREATE TRIGGER IF NOT EXISTS {table}_as_of_{suffix} AFTER {when} ON {table} BEGIN "
+                    f"UPDATE {table} SET as_of = {_position('new')} WHERE id = new.id; END")
+        updates = " ".join(f"UPDATE {model._meta.db_table} SET as_of = new.timeline_offset WHERE event_after_id = new.id;"
+                           for model in TABLES if model._meta.db_table in tables)
+        if event in tables and updates:
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {event}_as_of_au AFTER UPDATE OF timeline_offset ON {event} "
+                f"BEGIN {updates} END")
+
+
+def uninstall(connection=connection):
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        for model in TABLES:
+            for suffix in ("ai", "au"):
+                cursor.execute(f"DROP TRIGGER IF EXISTS {model._meta.db_table}_as_of_{suffix}")
+        cursor.execute(f"DROP TRIGGER IF EXISTS {Event._meta.db_table}_as_of_au")
+
+
+def backfill(connection=connection):
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        for model in TABLES:
+            table = model._meta.db_table
+            cursor.execute(f"UPDATE {table} SET as_of = {_position(table)}")
+
+
+class HeroState:
+    """Состояние героя: values — {ценность: вес} по последним HeroValue,
+    evaluations — оценки поступков (id, действие, ценность, вес, событие) в порядке шкалы."""
+
+    def __init__(self, hero_id):
+        self.hero_id = hero_id
+        self.values = {}
+        self.evaluations = []
+
+    @property
+    def totals(self):
+        """Сумма весов оценок по ценностям."""
+        totals = defaultdict(float)
+        for _, _, dimension, weight, _ in self.evaluations:
+            if dimension is not None:
+                totals[dimension] += weight
+        return dict(totals)
+
+
+def _last(as_of):
+    return float("inf") if as_of is None else as_of
+
+
+def states_at(event, heroes):
+    """{id героя: HeroState} на момент события одним запросом.
+
+    heroes — queryset героев или список id; герои без записей тоже попадают в результат.
+    """
+    if not isinstance(heroes, QuerySet):
+        heroes = Hero.objects.filter(pk__in=list(heroes))
+    hero_sql, hero_params = heroes.order_by().values_list("pk", flat=True).query.sql_with_params()
+    values, evaluations = HeroValue._meta.db_table, DecisionEvaluation._meta.db_table
+    position = f"COALESCE((SELECT timeline_offset FROM {Event._meta.db_table} WHERE id = %s), -9e999)"
+    # as_of NULL — запись события вне шкалы: видна только на своём событии.
+    visible = f"(as_of <= {position} OR event_after_id = %s)"
+    sql = (
+        f"SELECT 'hero', h.*, NULL, NULL, NULL, NULL, NULL, NULL FROM ({hero_sql}) h "
+        f"UNION ALL "
+        f"SELECT 'value', hero_id, id, NULL, value_dimension_id, weight, event_after_id, as_of FROM ("
+        f"SELECT *, ROW_NUMBER() OVER (PARTITION BY hero_id, value_dimension_id "
+        f"ORDER BY COALESCE(as_of, 9e999) DESC, id DESC) AS latest "
+        f"FROM {values} WHERE hero_id IN ({hero_sql}) AND {visible}) WHERE latest = 1 "
+        f"UNION ALL "
+        f"SELECT 'evaluation', hero_was_evaluated_id, id, eval_for_ha_id, affects_on_vd_id, weight, event_after_id, as_of "
+        f"FROM {evaluations} WHERE hero_was_evaluated_id IN ({hero_sql}) AND {visible}"
+    )
+    event_id = getattr(event, "pk", event)
+    with analytics_reads():
+        using = router.db_for_read(HeroValue)
+    with connections[using].cursor() as cursor:
+        cursor.execute(sql, (*hero_params, *hero_params, event_id, event_id, *hero_params, event_id, event_id))
+        rows = cursor.fetchall()
+    states = {hero: HeroState(hero) for kind, hero, *_ in rows if kind == "hero"}
+    for kind, hero, pk, action, dimension, weight, event_after, as_of in sorted(
+            (row for row in rows if row[0] != "hero"), key=lambda row: (_last(row[7]), row[2])):
+        if kind == "value":
+            states[hero].values[dimension] = weight
+        else:
+            states[hero].evaluations.append((pk, action, dimension, weight, event_after))
+    return states
+
+
+def state_at(hero, event):
+    return states_at(event, [getattr(hero, "pk", hero)]).get(getattr(hero, "pk", hero))
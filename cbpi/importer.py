@@ -0,0 +1,253 @@
+"""Потоковая загрузка саги из JSONL/CSV.
+
+Каждая запись — словарь с ключом "model" (composition, event, hero, episode,
+participation, event_sequence) и полями модели. Ссылки задаются естественными
+ключами в пределах саги:
+
+    composition — название произведения;
+    hero        — имя героя;
+    event, episode — [произведение, название] (в CSV — "произведение|название");
+                  строка без произведения ищется в произведении самой записи;
+    place, role_type, composition_type — название, недостающие создаются.
+
+Записи читаются порциями по chunk_size; каждая порция разрешает ссылки одним
+запросом на модель и пишется bulk_create в своей транзакции, поэтому память
+не зависит от размера входа. previous_episode может ссылаться на эпизод из
+следующих порций и файлов: такие ссылки и позиции эпизодов ставит finish()
+после последней порции, каждое произведение перенумеровывается один раз.
+"""
+import csv
+import json
+from collections import Counter, defaultdict
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from . import documents
+from .models import (Composition, CompositionType, Episode, Event, EventSequence, EventSequenceClosure, Hero,
+                     Participation, Place, RoleType)
+from .timeline import event_offset
+
+KEY_SEPARATOR = "|"
+
+# Порядок обработки внутри порции: ссылки всегда указывают на уже записанные модели.
+SPECS = {
+    "composition": (Composition, ("title", "date_published"), {"composition_type": "composition_type"}),
+    "event": (Event, ("title", "description", "zero_event_flag", "date_time_from_zero_event", "cm_position"),
+              {"composition": "composition", "place": "place"}),
+    "hero": (Hero, ("name", "description"), {"birth_event": "event"}),
+    "episode": (Episode, ("title", "story_resume"),
+                {"composition": "composition", "start_event": "event", "previous_episode": "episode"}),
+    "participation": (Participation, (), {"hero": "hero", "episode": "episode", "role_type": "role_type"}),
+    "event_sequence": (EventSequence, ("straight",), {"event_before": "event", "event_after": "event"}),
+}
+
+
+class RowError(Exception):
+    pass
+
+
+def read_jsonl(lines):
+    for number, line in enumerate(lines, 1):
+        if line.strip():
+            # Ошибка разбора уходит в on_error вместе с остальными ошибками строк.
+            try:
+                record = json.loads(line)
+            except ValueError as exc:
+                yield number, RowError(f"неверный JSON: {exc}")
+                continue
+            yield number, record if isinstance(record, dict) else RowError("строка должна быть объектом JSON")
+
+
+def read_csv(lines, model):
+    for number, row in enumerate(csv.DictReader(lines), 2):
+        yield number, {"model": model, **{k: v for k, v in row.items() if v != ""}}
+
+
+class SagaImporter:
+    def __init__(self, saga, chunk_size=1000, on_progress=None, on_error=None):
+        self.saga = saga
+        self.chunk_size = chunk_size
+        self.on_progress = on_progress
+        self.on_error = on_error
+        self.created = Counter()
+        self.errors = 0
+        self.rows = 0
+        # (номер строки, id эпизода, ключ previous_episode, обработчик ошибок файла)
+        self.pending_links = []
+        self.compositions = set()
+
+    def run(self, records):
+        """records — итератор пар (номер строки, словарь или RowError)."""
+        records = iter(records)
+        while chunk := list(islice(records, self.chunk_size)):
+            with transaction.atomic():
+                self._import_chunk(chunk)
+            self.rows += len(chunk)
+            if self.on_progress:
+                self.on_progress(self)
+        return self
+
+    def finish(self):
+        """Ставит отложенные previous_episode и позиции эпизодов; вызывается после всех файлов."""
+        with transaction.atomic():
+            resolved = self._resolve("episode", {key for _, _, key, _ in self.pending_links})
+            linked = []
+            for number, pk, key, on_error in self.pending_links:
+                if resolved.get(key) is None:
+                    self._error(number, f"не найден previous_episode {KEY_SEPARATOR.join(map(str, key))!r}", on_error)
+                else:
+                    linked.append(Episode(pk=pk, previous_episode_id=resolved[key]))
+            Episode.objects.bulk_update(linked, ["previous_episode"], batch_size=self.chunk_size)
+            for composition_id in self.compositions:
+                Episode.objects.renumber(composition_id)
+            # Строки созданы bulk_create без сигналов.
+            documents.sagas_changed([self.saga.pk])
+        self.pending_links.clear()
+        self.compositions.clear()
+        return self
+
+    def _error(self, number, message, on_error=None):
+        self.errors += 1
+        on_error = on_error or self.on_error
+        if on_error:
+            on_error(number, message)
+
+    def _import_chunk(self, chunk):
+        by_model = defaultdict(list)
+        for number, record in chunk:
+            if isinstance(record, RowError):
+                self._error(number, str(record))
+            elif record.get("model") not in SPECS:
+                self._error(number, f"неизвестная модель {record.get('model')!r}")
+            else:
+                by_model[record["model"]].append((number, record))
+        for name in SPECS:
+            if by_model[name]:
+                getattr(self, f"_import_{name}", self._import_rows)(name, by_model[name])
+
+    def _import_rows(self, name, rows):
+        built = self._build(name, rows)
+        SPECS[name][0].objects.bulk_create([instance for _, instance in built], batch_size=self.chunk_size)
+        self.created[name] += len(built)
+        return built
+
+    def _import_episode(self, name, rows):
+        # Предыдущий эпизод может прийти в той же порции: ставим его вторым проходом.
+        previous = {number: (record.pop("previous_episode"), record)
+                    for number, record in rows if record.get("previous_episode") is not None}
+        built = self._import_rows(name, rows)
+        keys = {number: self._key("episode", key, record) for number, (key, record) in previous.items()}
+        resolved = self._resolve("episode", keys.values())
+        linked = []
+        for number, instance in built:
+            if number in keys:
+                instance.previous_episode_id = resolved.get(keys[number])
+                if instance.previous_episode_id is None:
+                    # Эпизод может прийти в следующих порциях: ссылку поставит finish().
+                    self.pending_links.append((number, instance.pk, keys[number], self.on_error))
+                else:
+                    linked.append(instance)
+        Episode.objects.bulk_update(linked, ["previous_episode"], batch_size=self.chunk_size)
+        self.compositions.update(instance.composition_id for _, instance in built)
+
+    def _import_event_sequence(self, name, rows):
+        # Вся порция проверяется по замыканию разом; ребро с циклом отклоняется построчно.
+        candidates = [(number, instance, (instance.event_before_id, instance.event_after_id))
+                      for number, instance in self._build(name, rows)]
+        existing = set()
+        if candidates:
+            existing = set(EventSequence.objects.filter(
+                event_before__in={edge[0] for _, _, edge in candidates},
+                event_after__in={edge[1] for _, _, edge in candidates},
+            ).values_list("event_before", "event_after"))
+        built, seen = [], set()
+        for number, instance, edge in candidates:
+            if edge in existing or edge in seen:
+                self._error(number, "такая связь событий уже есть")
+            else:
+                seen.add(edge)
+                built.append((number, instance))
+        rejected = EventSequenceClosure.objects.add_edges(
+            [(instance.event_before_id, instance.event_after_id) for _, instance in built])
+        accepted = []
+        for index, (number, instance) in enumerate(built):
+            if index in rejected:
+                self._error(number, "Связь создаёт цикл в последовательности событий.")
+            else:
+                accepted.append(instance)
+        EventSequence.objects.bulk_create(accepted, batch_size=self.chunk_size)
+        self.created[name] += len(accepted)
+
+    def _key(self, kind, value, record):
+        if kind in ("event", "episode"):
+            if isinstance(value, str):
+                value = value.split(KEY_SEPARATOR, 1) if KEY_SEPARATOR in value else [record.get("composition"), value]
+            return tuple(value)
+        return value
+
+    def _build(self, name, rows):
+        """Экземпляры моделей для строк порции; строки с ошибками отбрасываются."""
+        model, fields, refs = SPECS[name]
+        wanted = defaultdict(set)
+        for number, record in rows:
+            for field, kind in refs.items():
+                if record.get(field) is not None:
+                    wanted[kind].add(self._key(kind, record[field], record))
+        resolved = {kind: self._resolve(kind, keys) for kind, keys in wanted.items()}
+
+        built = []
+        for number, record in rows:
+            try:
+                values = {}
+                for field in fields:
+                    if field in record:
+                        values[field] = model._meta.get_field(field).to_python(record[field])
+                for field, kind in refs.items():
+                    if record.get(field) is None and not model._meta.get_field(field).null:
+                        raise RowError(f"не указан {field}")
+                    if record.get(field) is not None:
+                        pk = resolved[kind].get(self._key(kind, record[field], record))
+                        if pk is None:
+                            raise RowError(f"не найден {field} {record[field]!r}")
+                        values[f"{field}_id"] = pk
+                if name in ("composition", "hero"):
+                    values["saga"] = self.saga
+                if name == "event":
+                    values["timeline_offset"] = event_offset(
+                        values.get("date_time_from_zero_event"), values.get("zero_event_flag", False),
+                        self.saga.zero_event_abbreviature)
+                instance = model(**values)
+                instance.clean_fields(exclude=[f.name for f in model._meta.fields if f.is_relation])
+            except (RowError, ValidationError, TypeError) as exc:
+                self._error(number, "; ".join(getattr(exc, "messages", [str(exc)])))
+            else:
+                built.append((number, instance))
+        return built
+
+    def _resolve(self, kind, keys):
+        """Естественные ключи → pk одним запросом на вид ссылки."""
+        keys = set(keys)
+        if kind == "composition":
+            return dict(Composition.objects.filter(saga=self.saga, title__in=keys).values_list("title", "pk"))
+        if kind == "hero":
+            return dict(Hero.objects.filter(saga=self.saga, name__in=keys).values_list("name", "pk"))
+        if kind in ("event", "episode"):
+            model = Event if kind == "event" else Episode
+            found = model.objects.filter(
+                composition__saga=self.saga,
+                composition__title__in={composition for composition, _ in keys},
+                title__in={title for _, title in keys},
+            ).values_list("composition__title", "title", "pk")
+            return {(composition, title): pk for composition, title, pk in found}
+        model, field = {
+            "place": (Place, "name"),
+            "role_type": (RoleType, "name"),
+            "composition_type": (CompositionType, "title"),
+        }[kind]
+        resolved = dict(model.objects.filter(**{f"{field}__in": keys}).values_list(field, "pk"))
+        for key in keys - resolved.keys():
+            # Справочники малы: создаём по одному, чтобы отработал save().
+            resolved[key] = model.objects.create(**{field: key}).pk
+        return resolved
@@ -0,0 +1,123 @@
+"""Фоновые пересчёты: вид задачи → функция от id саги (None — вся база).
+
+Задачи ставятся через Job.objects.enqueue и выполняются командой run_jobs в
+пуле процессов. Функции вызываются в дочернем процессе, поэтому получают
+только id и сами читают всё нужное из базы.
+"""
+import logging
+import os
+
+import numpy as np
+from django.conf import settings
+from django.db import connection
+
+from . import documents, search, similarity, versions
+from .analytics import Trajectories, value_trajectories
+from .models import (AffectOnValue, Composition, DecisionEvaluation, Episode, Event, EventSequence, EventSequenceClosure,
+                     Fact, Hero, HeroValue, Job, Saga, ValueDimension)
+
+logger = logging.getLogger(__name__)
+
+# Таблицы, по которым считаются траектории: файл годен, пока их версии не менялись.
+TRAJECTORY_TABLES = (Hero, HeroValue, DecisionEvaluation, Fact, AffectOnValue, Event, EventSequence, ValueDimension)
+TRAJECTORY_ARRAYS = ("hero_ids", "dimension_ids", "event_ids", "declared", "evaluations", "facts")
+
+
+def trajectories_path(saga_id):
+    return os.path.join(settings.MEDIA_ROOT, "trajectories", f"saga-{saga_id}.npz")
+
+
+def recompute_trajectories(saga_id):
+    """Считает траектории саги (всех саг) и сохраняет массивы в MEDIA_ROOT/trajectories."""
+    sagas = Saga.objects.all() if saga_id is None else Saga.objects.filter(pk=saga_id)
+    for saga in sagas:
+        # Версии берутся до расчёта: запись во время него сделает файл устаревшим, а не неверным.
+        stamp = versions.stamp(TRAJECTORY_TABLES)
+        if stamp is None:
+            # Без версий таблиц свежесть файла не проверить: читать его некому.
+            continue
+        trajectories = value_trajectories(saga)
+        target = trajectories_path(saga.pk)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        temporary = f"{target}.{os.getpid()}.tmp.npz"
+        np.savez_compressed(temporary, stamp=np.array(stamp, dtype=np.int64),
+                            **{name: getattr(trajectories, name) for name in TRAJECTORY_ARRAYS})
+        os.replace(temporary, target)
+
+
+def load_trajectories(saga_id):
+    """Траектории из файла recompute_trajectories или None, если его нет или данные с тех пор менялись."""
+    stamp = versions.stamp(TRAJECTORY_TABLES)
+    if stamp is None:
+        return None
+    try:
+        with np.load(trajectories_path(saga_id)) as arrays:
+            if tuple(arrays["stamp"].tolist()) != stamp:
+                return None
+            return Trajectories(**{name: arrays[name] for name in TRAJECTORY_ARRAYS})
+    except (FileNotFoundError, KeyError):
+        return None
+
+
+def rebuild_closure(saga_id):
+    # Замыкание общее для всех саг: пересчитывается целиком.
+    skipped = EventSequenceClosure.objects.rebuild()
+    if skipped:
+        logger.warning("Рёбра EventSequence в циклах не вошли в замыкание: %s", skipped)
+
+
+def rebuild_search_index(saga_id):
+    search.install(connection, rebuild=True)
+
+
+def sync_timeline(saga_id):
+    events = Event.objects.all() if saga_id is None else Event.objects.filter(composition__saga=saga_id)
+    updated, _ = Event.objects.sync_timeline(events)
+    # bulk_update не шлёт сигналов: документы саг и индекс ценностей сбрасываются здесь.
+    if updated:
+        documents.sagas_changed(None if saga_id is None else [saga_id])
+        similarity.invalidate_index()
+
+
+def renumber_episodes(saga_id):
+    if saga_id is None:
+        updated = Episode.objects.renumber()
+    else:
+        updated = sum(Episode.objects.renumber(composition_id)
+                      for composition_id in Composition.objects.filter(saga=saga_id).values_list("pk", flat=True))
+    if updated:
+        documents.sagas_changed(None if saga_id is None else [saga_id])
+
+
+JOBS = {
+    "value_trajectories": recompute_trajectories,
+    "event_closure": rebuild_closure,
+    "search_index": rebuild_search_index,
+    "timeline": sync_timeline,
+    "episode_order": renumber_episodes,
+    "saga_document": documents.rebuild,
+}
+
+
+def setup_worker():
+    """Инициализация дочернего процесса пула (spawn): настраивает Django."""
+    import django
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "conf.settings")
+    django.setup()
+
+
+def execute(kind, saga_id):
+    if kind not in JOBS:
+        raise ValueError(f"неизвестная задача {kind!r}")
+    JOBS[kind](saga_id)
+
+
+def run_inline(job):
+    """Выполняет захваченную задачу в текущем процессе и отмечает результат."""
+    try:
+        execute(job.kind, job.saga_id)
+    except Exception as exc:
+        Job.objects.finish(job, error=f"{type(exc).__name__}: {exc}")
+    else:
+        Job.objects.finish(job)
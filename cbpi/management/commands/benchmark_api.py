@@ -0,0 +1,94 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from wsgiref.util import setup_testing_defaults
+
+from django.core.management.base import BaseCommand, CommandError
+
+DEFAULT_PATHS = ("/api/heroes/?limit=100", "/api/events/?limit=100", "/api/timeline/?limit=100")
+
+
+def wsgi_get(application, url):
+    parts = urlsplit(url)
+    environ = {"REQUEST_METHOD": "GET", "PATH_INFO": parts.path, "QUERY_STRING": parts.query}
+    setup_testing_defaults(environ)
+    statuses = []
+    body = application(environ, lambda status, headers, exc_info=None: statuses.append(status))
+    try:
+        for _ in body:
+            pass
+    finally:
+        if hasattr(body, "close"):
+            body.close()
+    return int(statuses[0].split()[0])
+
+
+async def asgi_get(application, url):
+    parts = urlsplit(url)
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": parts.path, "raw_path": parts.path.encode(), "query_string": parts.query.encode(),
+        "root_path": "", "headers": [(b"host", b"localhost")], "client": ("127.0.0.1", 0),
+        "server": ("localhost", 80),
+    }
+    requests = [{"type": "http.request", "body": b"", "more_body": False}]
+    status = None
+
+    async def receive():
+        if requests:
+            return requests.pop()
+        # Клиент не отключается: ждём, пока Django не отменит ожидание сам.
+        await asyncio.Event().wait()
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await application(scope, receive, send)
+    return status
+
+
+class Command(BaseCommand):
+    help = ("Нагрузочный замер API: одни и те же запросы через ASGI и WSGI-приложение в процессе, "
+            "без сети; показывает запросы в секунду.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="*", default=DEFAULT_PATHS, help="Пути с параметрами запроса")
+        parser.add_argument("--requests", type=int, default=500, help="Запросов на каждый интерфейс")
+        parser.add_argument("--concurrency", type=int, default=20)
+        parser.add_argument("--interface", choices=("asgi", "wsgi"), action="append")
+
+    def handle(self, *args, **options):
+        urls = [options["paths"][i % len(options["paths"])] for i in range(options["requests"])]
+        for interface in options["interface"] or ("wsgi", "asgi"):
+            started = time.perf_counter()
+            statuses = getattr(self, f"run_{interface}")(urls, options["concurrency"])
+            elapsed = time.perf_counter() - started
+            errors = sum(status >= 400 for status in statuses)
+            if errors == len(statuses):
+                raise CommandError(f"{interface}: все запросы завершились ошибкой ({statuses[0]})")
+            self.stdout.write(
+                f"{interface.upper()}: {len(statuses)} запросов за {elapsed:.2f} с — "
+                f"{len(statuses) / elapsed:.1f} запр./с, ошибок: {errors}")
+
+    def run_wsgi(self, urls, concurrency):
+        from conf.wsgi import application
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            return list(pool.map(lambda url: wsgi_get(application, url), urls))
+
+    def run_asgi(self, urls, concurrency):
+        from conf.asgi import application
+
+        async def run():
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def one(url):
+                async with semaphore:
+                    return await asgi_get(application, url)
+
+            return await asyncio.gather(*(one(url) for url in urls))
+
+        return asyncio.run(run())
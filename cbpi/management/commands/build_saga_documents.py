@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from cbpi import documents
+from cbpi.models import Saga, SagaDocument
+
+
+class Command(BaseCommand):
+    help = "Собирает документы саг заново (например, после bulk-операций, которые не шлют сигналов)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--saga", type=int, help="Только сага с этим id")
+        parser.add_argument("--stale", action="store_true", help="Только документы, помеченные устаревшими")
+
+    def handle(self, *args, **options):
+        if options["saga"] is not None:
+            sagas = [options["saga"]]
+        elif options["stale"]:
+            sagas = SagaDocument.objects.filter(stale=True).values_list("pk", flat=True)
+        else:
+            sagas = Saga.objects.values_list("pk", flat=True)
+        built = sum(documents.refresh(pk) is not None for pk in list(sagas))
+        self.stdout.write(self.style.SUCCESS(f"Собрано документов: {built}"))
@@ -0,0 +1,41 @@
+import sys
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from cbpi.exporter import COMPRESSIONS, ExportError, SagaExporter
+from cbpi.models import Saga
+
+SUFFIXES = {".gz": "gzip", ".zst": "zstd"}
+
+
+class Command(BaseCommand):
+    help = "Потоковая выгрузка саги со всеми произведениями, событиями, героями и оценками в JSONL."
+
+    def add_arguments(self, parser):
+        parser.add_argument("saga", help="Название или id саги")
+        parser.add_argument("output", help="Файл .jsonl, .jsonl.gz или .jsonl.zst; - — стандартный вывод")
+        parser.add_argument("--compression", choices=COMPRESSIONS, help="По умолчанию — по расширению файла")
+        parser.add_argument("--chunk-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        name = options["saga"]
+        saga = Saga.objects.filter(pk=int(name)).first() if name.isdigit() else None
+        saga = saga or Saga.objects.filter(name=name).first()
+        if saga is None:
+            raise CommandError(f"Сага {name!r} не найдена")
+        output = options["output"]
+        compression = options["compression"] or SUFFIXES.get(Path(output).suffix)
+        exporter = SagaExporter(saga, chunk_size=options["chunk_size"])
+        try:
+            chunks = exporter.chunks(compression)
+        except ExportError as exc:
+            raise CommandError(exc)
+        if output == "-":
+            sys.stdout.buffer.writelines(chunks)
+            sys.stdout.buffer.flush()
+        else:
+            with open(output, "wb") as file:
+                file.writelines(chunks)
+        exported = ", ".join(f"{name}: {count}" for name, count in exporter.exported.items())
+        self.stderr.write(self.style.SUCCESS(f"Выгружено — {exported or 'ничего'}"))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from cbpi.synthetic import SCALE, UniverseGenerator
+
+
+class Command(BaseCommand):
+    help = ("Создаёт синтетическую вселенную заданного масштаба для нагрузочных замеров (см. run_benchmarks): "
+            "дерево мест, саги, события, цепочки эпизодов, графы событий и фактов, ценности и оценки героев.")
+
+    def add_arguments(self, parser):
+        for name, (default, description) in SCALE.items():
+            parser.add_argument(f"--{name.replace('_', '-')}", type=int, default=default,
+                                help=f"{description} (по умолчанию {default})")
+        parser.add_argument("--seed", type=int, default=0, help="Один seed — одни и те же данные")
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        scale = {name: options[name] for name in SCALE}
+        negative = [name for name, value in scale.items() if value < 0]
+        if negative:
+            raise CommandError(f"Отрицательные параметры: {', '.join(negative)}")
+        self.stdout.write(
+            f"Событий: {scale['sagas'] * scale['compositions'] * scale['events']}, "
+            f"строк замыкания EventSequence: ~{scale['sagas'] * scale['compositions'] * scale['events'] ** 2 // 2}")
+        generator = UniverseGenerator(
+            seed=options["seed"], batch_size=options["batch_size"],
+            on_progress=lambda gen: self.stdout.write(
+                f"Саг: {gen.sagas_done} из {gen.scale['sagas']}, строк: {sum(gen.created.values())}"),
+            **scale)
+        universe = generator.run()
+        created = ", ".join(f"{name}: {count}" for name, count in generator.created.items())
+        self.stdout.write(self.style.SUCCESS(f"Создана вселенная «{universe.name}» (id {universe.pk}) — {created}"))
@@ -0,0 +1,46 @@
+import gzip
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from cbpi.importer import SPECS, SagaImporter, read_csv, read_jsonl
+from cbpi.models import Job, Saga
+
+
+class Command(BaseCommand):
+    help = "Потоковый импорт произведений, событий, героев и эпизодов саги из JSONL/CSV."
+
+    def add_arguments(self, parser):
+        parser.add_argument("saga", help="Название саги (создаётся, если её нет)")
+        parser.add_argument("files", nargs="+", help="Файлы .jsonl или .csv (можно .gz)")
+        parser.add_argument("--model", choices=sorted(SPECS), help="Модель для CSV; по умолчанию — имя файла")
+        parser.add_argument("--chunk-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        saga = Saga.objects.filter(name=options["saga"]).first() or Saga.objects.create(name=options["saga"])
+        importer = SagaImporter(
+            saga,
+            chunk_size=options["chunk_size"],
+            on_progress=lambda imp: self.stdout.write(f"{imp.rows} строк, ошибок: {imp.errors}"),
+        )
+        for name in options["files"]:
+            path = Path(name)
+            suffixes = [s for s in path.suffixes if s != ".gz"]
+            opener = gzip.open if path.suffix == ".gz" else open
+            importer.on_error = lambda number, message: self.stderr.write(f"{path}:{number}: {message}")
+            with opener(path, "rt", encoding="utf-8", newline="") as lines:
+                if suffixes[-1:] == [".jsonl"]:
+                    importer.run(read_jsonl(lines))
+                elif suffixes[-1:] == [".csv"]:
+                    model = options["model"] or path.name.split(".")[0]
+                    if model not in SPECS:
+                        raise CommandError(f"Не удалось определить модель для {path}, укажите --model")
+                    importer.run(read_csv(lines, model))
+                else:
+                    raise CommandError(f"Неизвестный формат файла {path}")
+        importer.finish()
+        if importer.created:
+            # Траектории пересчитает воркер run_jobs, а не импорт.
+            Job.objects.enqueue("value_trajectories", saga)
+        created = ", ".join(f"{name}: {count}" for name, count in importer.created.items())
+        self.stdout.write(self.style.SUCCESS(f"Создано — {created or 'ничего'}; ошибок: {importer.errors}"))
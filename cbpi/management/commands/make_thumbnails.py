@@ -0,0 +1,46 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from cbpi import thumbnails
+from cbpi.models import Author, Hero
+
+
+class Command(BaseCommand):
+    help = "Создаёт недостающие миниатюры фото авторов и героев в пуле процессов."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=settings.THUMBNAIL_WORKERS or 1)
+
+    def handle(self, *args, **options):
+        media_root = str(settings.MEDIA_ROOT)
+        sources = {}
+        for model in (Author, Hero):
+            hashed = []
+            for obj in model.objects.exclude(photo_file="").exclude(photo_file=None).only(
+                    "photo_file", "photo_hash").iterator():
+                if not obj.photo_file.storage.exists(obj.photo_file.name):
+                    self.stderr.write(f"{model.__name__} {obj.pk}: нет файла {obj.photo_file.name}")
+                    continue
+                if not obj.photo_hash:
+                    with obj.photo_file.open("rb"):
+                        obj.photo_hash = thumbnails.file_hash(obj.photo_file)
+                    hashed.append(obj)
+                if thumbnails.missing_sizes(obj.photo_hash, media_root, settings.THUMBNAIL_SIZES):
+                    sources.setdefault(obj.photo_hash, obj.photo_file.path)
+            model.objects.bulk_update(hashed, ["photo_hash"], batch_size=1000)
+
+        created = 0
+        with ProcessPoolExecutor(max_workers=options["workers"]) as pool:
+            futures = {
+                pool.submit(thumbnails.make_thumbnails, path, photo_hash, media_root,
+                            settings.THUMBNAIL_SIZES, settings.THUMBNAIL_QUALITY): path
+                for photo_hash, path in sources.items()
+            }
+            for future in as_completed(futures):
+                try:
+                    created += future.result()
+                except OSError as exc:
+                    self.stderr.write(f"{futures[future]}: {exc}")
+        self.stdout.write(self.style.SUCCESS(f"Фото: {len(sources)}, создано миниатюр: {created}"))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from cbpi import counters
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает счётчики дочерних строк (саги, произведения, герои, действия) и чинит расхождения."
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            repaired = counters.repair()
+        for name, count in repaired.items():
+            self.stdout.write(f"{name}: исправлено строк {count}")
+        self.stdout.write(self.style.SUCCESS(f"Исправлено всего: {sum(repaired.values())}"))
@@ -0,0 +1,68 @@
+import json
+from pathlib import Path
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from cbpi import benchmarks
+
+
+class Command(BaseCommand):
+    help = ("Замеряет страницы админки, API и аналитику на текущей базе и пишет результат в JSON; "
+            "с --baseline сравнивает с прошлым результатом и завершается ошибкой при регрессиях.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--group", choices=benchmarks.GROUPS, action="append", help="Только эти группы замеров")
+        parser.add_argument("--repeat", type=int, default=5, help="Замеров времени на каждый случай")
+        parser.add_argument("--saga", type=int, help="Id саги; по умолчанию — с наибольшим числом произведений")
+        parser.add_argument("--user", help="Суперпользователь для админки; по умолчанию — первый")
+        parser.add_argument("--host", default="localhost", help="Заголовок Host запросов (из ALLOWED_HOSTS)")
+        parser.add_argument("--label", default="", help="Метка результата, например версия или коммит")
+        parser.add_argument("--output", default="-", help="Файл для JSON; «-» — stdout")
+        parser.add_argument("--baseline", help="JSON прошлого запуска для сравнения")
+        parser.add_argument("--threshold", type=float, default=1.25, help="Во сколько раз может вырасти медиана")
+        parser.add_argument("--slack", type=float, default=1.0, help="Рост медианы в мс, который не считается")
+
+    def handle(self, *args, **options):
+        groups = options["group"] or benchmarks.GROUPS
+        saga, hero, event, fact = benchmarks.targets(options["saga"])
+        if saga is None:
+            raise CommandError("Нет саги для замеров: сначала создайте данные командой generate_universe")
+        user = None
+        if "admin" in groups:
+            users = get_user_model().objects.filter(is_superuser=True, is_active=True).order_by("pk")
+            if options["user"]:
+                users = users.filter(username=options["user"])
+            user = users.first()
+            if user is None:
+                raise CommandError("Нет суперпользователя для админки: создайте его или укажите --user")
+        client = benchmarks.make_client(user, host=options["host"])
+
+        to_file = options["output"] != "-"
+        results = []
+        for case in benchmarks.cases(client, saga, hero, event, fact):
+            if case.group not in groups:
+                continue
+            result = benchmarks.measure(case, repeat=options["repeat"])
+            results.append(result)
+            if result["status"] != "ok":
+                self.stderr.write(f"{case.group}/{case.name}: {result['status']}")
+            elif to_file:
+                self.stdout.write(f"{case.group}/{case.name}: {result.get('median_ms', 0):.1f} мс "
+                                  f"(p95 {result.get('p95_ms', 0):.1f}), запросов {result['queries']}")
+
+        report = {**benchmarks.environment(options["label"]), "saga": saga.pk, "repeat": options["repeat"],
+                  "rows": benchmarks.row_counts(), "results": results}
+        text = json.dumps(report, ensure_ascii=False, indent=2)
+        if to_file:
+            Path(options["output"]).write_text(text + "\n", encoding="utf-8")
+        else:
+            self.stdout.write(text)
+
+        if options["baseline"]:
+            baseline = json.loads(Path(options["baseline"]).read_text(encoding="utf-8"))
+            regressions = benchmarks.compare(results, baseline, options["threshold"], options["slack"])
+            for line in regressions:
+                self.stderr.write(line)
+            if regressions:
+                raise CommandError(f"Регрессий: {len(regressions)}")
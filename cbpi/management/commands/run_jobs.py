@@ -0,0 +1,94 @@
+import multiprocessing
+import os
+import socket
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from cbpi import jobs
+from cbpi.models import Job
+
+
+class Command(BaseCommand):
+    help = "Воркер фоновых задач: берёт задачи из таблицы Job и выполняет их в пуле процессов."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=settings.JOB_WORKERS,
+                            help="Процессов в пуле; 0 — выполнять в этом процессе")
+        parser.add_argument("--once", action="store_true", help="Выйти, когда готовых задач не останется")
+        parser.add_argument("--poll", type=float, default=1.0, help="Пауза опроса очереди, секунды")
+
+    def handle(self, *args, **options):
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
+        stale = Job.objects.requeue_stale(settings.JOB_TIMEOUT)
+        if stale:
+            self.stderr.write(f"Возвращено брошенных задач: {stale}")
+        self.done = self.failed = 0
+        if options["workers"]:
+            self.run_pool(options["workers"], options["once"], options["poll"])
+        else:
+            self.run_inline(options["once"], options["poll"])
+        self.stdout.write(self.style.SUCCESS(f"Выполнено задач: {self.done}, с ошибкой: {self.failed}"))
+
+    def report(self, job):
+        job.refresh_from_db()
+        if job.status == Job.DONE:
+            self.done += 1
+        else:
+            self.failed += 1
+            self.stderr.write(f"{job}: {job.error.splitlines()[0] if job.error else job.status}")
+
+    def run_inline(self, once, poll):
+        while True:
+            job = Job.objects.claim(self.worker)
+            if job is None:
+                if once:
+                    return
+                time.sleep(poll)
+                continue
+            jobs.run_inline(job)
+            self.report(job)
+
+    def run_pool(self, workers, once, poll):
+        # spawn, а не fork: дочерний процесс не должен унаследовать открытое соединение SQLite.
+        context = multiprocessing.get_context("spawn")
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=jobs.setup_worker)
+        running = {}
+        try:
+            while True:
+                broken = None
+                while not broken and len(running) < workers and (job := Job.objects.claim(self.worker)):
+                    try:
+                        running[pool.submit(jobs.execute, job.kind, job.saga_id)] = job
+                    except BrokenProcessPool as exc:
+                        broken = exc
+                        self.finish(job, exc)
+                if not running and not broken:
+                    if once:
+                        return
+                    time.sleep(poll)
+                    continue
+                finished, _ = wait(running, timeout=poll, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    exc = future.exception()
+                    if isinstance(exc, BrokenProcessPool):
+                        broken = exc
+                    self.finish(running.pop(future), exc)
+                if broken:
+                    # Упавший процесс ломает весь пул: остальные задачи возвращаются
+                    # в очередь как неудачная попытка, пул создаётся заново.
+                    for job in running.values():
+                        self.finish(job, broken)
+                    running.clear()
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    self.stderr.write("Процесс пула аварийно завершился, пул пересоздан.")
+                    pool = ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=jobs.setup_worker)
+        finally:
+            pool.shutdown(wait=True)
+
+    def finish(self, job, exc):
+        Job.objects.finish(job, error=f"{type(exc).__name__}: {exc}" if exc else "")
+        self.report(job)
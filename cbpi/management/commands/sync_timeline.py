@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from cbpi import similarity
+from cbpi.models import Event
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает числовую координату событий (timeline_offset) из даты относительно нуля."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--saga", type=int, help="Только события саги с этим id")
+
+    def handle(self, *args, **options):
+        queryset = Event.objects.all()
+        if options["saga"] is not None:
+            queryset = queryset.filter(composition__saga=options["saga"])
+        updated, unparsed = Event.objects.sync_timeline(queryset)
+        if updated:
+            similarity.invalidate_index()
+        if unparsed:
+            self.stderr.write(f"Не разобрано дат: {unparsed}")
+        self.stdout.write(self.style.SUCCESS(f"Обновлено событий: {updated}"))
@@ -0,0 +1,401 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.db.models import Exists, F, OuterRef
+from django.utils import timezone
+
+from .timeline import event_offset
+
+
+class EventSequenceClosureManager(models.Manager):
+    """Транзитивное замыкание графа EventSequence: пара (до, после) для каждого пути.
+
+    Размер таблицы — число достижимых пар, а не рёбер: цепочка из n событий
+    даёт n(n-1)/2 строк (1 000 событий — полмиллиона, 10 000 — 50 миллионов).
+    Поэтому длинные сквозные цепочки на всю сагу не поддерживаются: порядок
+    стоит задавать внутри произведения, как это делают импорт и генератор.
+    """
+
+    use_in_migrations = True
+    batch_size = 1000
+
+    def is_before(self, event_before, event_after):
+        return self.filter(event_before=event_before, event_after=event_after).exists()
+
+    def events_after(self, event):
+        return self._event_model().objects.filter(
+            pk__in=self.filter(event_before=event).values("event_after"))
+
+    def events_before(self, event):
+        return self._event_model().objects.filter(
+            pk__in=self.filter(event_after=event).values("event_before"))
+
+    def events_between(self, event_from, event_to):
+        return self.events_after(event_from).filter(
+            pk__in=self.filter(event_after=event_to).values("event_before"))
+
+    def check_edge(self, before_id, after_id):
+        if before_id == after_id or self.is_before(after_id, before_id):
+            raise ValidationError("Связь создаёт цикл в последовательности событий.")
+
+    def add_edge(self, before_id, after_id):
+        ancestors = [before_id, *self.filter(event_after=before_id).values_list("event_before", flat=True)]
+        descendants = [after_id, *self.filter(event_before=after_id).values_list("event_after", flat=True)]
+        self.bulk_create(
+            (self.model(event_before_id=a, event_after_id=d) for a in ancestors for d in descendants),
+            batch_size=self.batch_size,
+            ignore_conflicts=True,
+        )
+
+    def add_edges(self, edges):
+        """Проверяет пачку рёбер [(до, после)] и вносит принятые в замыкание.
+
+        Два запроса на всю пачку: предки и потомки концов рёбер. Ребро, дающее
+        цикл с замыканием или с уже принятыми рёбрами пачки, отклоняется;
+        возвращает номера отклонённых рёбер. Сами рёбра записывает вызывающий.
+        """
+        endpoints = {node for edge in edges for node in edge}
+        ancestors, descendants = defaultdict(set), defaultdict(set)
+        for a, b in self.filter(event_after__in=endpoints).values_list("event_before", "event_after").iterator():
+            ancestors[b].add(a)
+        for a, b in self.filter(event_before__in=endpoints).values_list("event_before", "event_after").iterator():
+            descendants[a].add(b)
+        # Граф на концах рёбер: старые пути между ними и принятые рёбра пачки.
+        graph = {node: descendants[node] & endpoints for node in endpoints}
+        rejected, starts = set(), set()
+        for number, (a, b) in enumerate(edges):
+            if a == b or a in self._reachable(graph, b):
+                rejected.add(number)
+            else:
+                graph[a].add(b)
+                starts.add(a)
+
+        rows = []
+        for start in starts:
+            targets = set()
+            for node in self._reachable(graph, start):
+                targets.add(node)
+                targets |= descendants[node]
+            rows.extend((a, d) for a in ancestors[start] | {start} for d in targets)
+        self.bulk_create((self.model(event_before_id=a, event_after_id=d) for a, d in set(rows)),
+                         batch_size=self.batch_size, ignore_conflicts=True)
+        return rejected
+
+    @staticmethod
+    def _reachable(graph, start):
+        found, stack = set(), [start]
+        while stack:
+            for node in graph.get(stack.pop(), ()):
+                if node not in found:
+                    found.add(node)
+                    stack.append(node)
+        return found
+
+    def remove_edge(self, before_id, after_id):
+        # Пересчитываются только пары (предок before, потомок after): остальные
+        # пути ребро не затрагивало. Предки обходятся от ближних к дальним,
+        # чтобы замыкание их преемников было уже исправлено.
+        sequence_model = self._sequence_model()
+        ancestors = {before_id, *self.filter(event_after=before_id).values_list("event_before", flat=True)}
+        descendants = {after_id, *self.filter(event_before=after_id).values_list("event_after", flat=True)}
+        self.filter(event_before__in=ancestors, event_after__in=descendants).delete()
+
+        depth = defaultdict(int)
+        for a, b in self.filter(event_before__in=ancestors, event_after__in=ancestors).values_list(
+                "event_before", "event_after"):
+            depth[b] += 1
+        successors = defaultdict(set)
+        for a, b in sequence_model.objects.filter(event_before__in=ancestors).values_list(
+                "event_before", "event_after"):
+            successors[a].add(b)
+        reach = defaultdict(set)
+        outside = set().union(*successors.values()) - ancestors
+        for a, b in self.filter(event_before__in=outside, event_after__in=descendants).values_list(
+                "event_before", "event_after"):
+            reach[a].add(b)
+
+        restored = []
+        for a in sorted(ancestors, key=lambda node: depth[node], reverse=True):
+            for s in successors[a]:
+                reach[a] |= reach[s]
+                if s in descendants:
+                    reach[a].add(s)
+            restored.extend(self.model(event_before_id=a, event_after_id=d) for d in reach[a])
+        self.bulk_create(restored, batch_size=self.batch_size)
+
+    def rebuild(self):
+        """Пересобирает замыкание с нуля, записывая строки порциями; возвращает пропущенные рёбра.
+
+        Узлы обходятся в обратном топологическом порядке; множество достижимых
+        держится в памяти, только пока его не прочли все предшественники узла.
+        Старые данные могут содержать циклы (раньше они не отклонялись): рёбра
+        внутри цикла в замыкание не попадают и возвращаются списком (до, после).
+        """
+        sequence_model = self._sequence_model()
+        successors = defaultdict(set)
+        for a, b in sequence_model.objects.values_list("event_before", "event_after").iterator():
+            successors[a].add(b)
+        order = self._topological_order(successors)
+        skipped = []
+        if len(order) < len(set(successors).union(*successors.values())):
+            component = self._cycles(successors, set(order))
+            for a in list(successors):
+                for b in [b for b in successors[a] if a in component and component.get(b) == component[a]]:
+                    successors[a].discard(b)
+                    skipped.append((a, b))
+            order = self._topological_order(successors)
+        readers = defaultdict(int)
+        for node in order:
+            for s in successors[node]:
+                readers[s] += 1
+
+        self.all().delete()
+        reach, rows = {}, []
+        for node in reversed(order):
+            reached = set(successors[node])
+            for s in successors[node]:
+                reached |= reach[s]
+                readers[s] -= 1
+                if not readers[s]:
+                    del reach[s]
+            if readers.get(node):
+                reach[node] = reached
+            rows.extend(self.model(event_before_id=node, event_after_id=d) for d in reached)
+            if len(rows) >= self.batch_size:
+                self.bulk_create(rows, batch_size=self.batch_size)
+                rows = []
+        self.bulk_create(rows, batch_size=self.batch_size)
+        return sorted(skipped)
+
+    @staticmethod
+    def _topological_order(successors):
+        """Узлы без циклов в топологическом порядке (Кан); узлы циклов и ниже них не попадают."""
+        indegree = defaultdict(int)
+        for targets in successors.values():
+            for s in targets:
+                indegree[s] += 1
+        order = [node for node in set(successors).union(*successors.values()) if not indegree[node]]
+        for node in order:
+            for s in successors.get(node, ()):
+                indegree[s] -= 1
+                if not indegree[s]:
+                    order.append(s)
+        return order
+
+    @staticmethod
+    def _cycles(successors, ordered):
+        """{узел: номер компоненты} сильно связных компонент вне ordered (Тарьян без рекурсии)."""
+        index, low, component, stack, on_stack = {}, {}, {}, [], set()
+        for root in set(successors).union(*successors.values()) - ordered:
+            if root in index:
+                continue
+            work = [(root, iter(successors.get(root, ())))]
+            index[root] = low[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            while work:
+                node, children = work[-1]
+                child = next(children, None)
+                if child is not None:
+                    if child in ordered:
+                        continue
+                    if child not in index:
+                        index[child] = low[child] = len(index)
+                        stack.append(child)
+                        on_stack.add(child)
+                        work.append((child, iter(successors.get(child, ()))))
+                    elif child in on_stack:
+                        low[node] = min(low[node], index[child])
+                    continue
+                work.pop()
+                if work:
+                    low[work[-1][0]] = min(low[work[-1][0]], low[node])
+                if low[node] == index[node]:
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component[member] = node
+                        if member == node:
+                            break
+        return component
+
+    def _sequence_model(self):
+        return self.model._meta.apps.get_model("cbpi", "EventSequence")
+
+    def _event_model(self):
+        return self.model._meta.get_field("event_after").related_model
+
+
+class PlaceManager(models.Manager):
+    """Материализованный путь дерева мест: "/<id корня>/.../<id места>/"."""
+
+    use_in_migrations = True
+
+    def subtree_filter(self, path, prefix=""):
+        # Все пути поддерева лежат в диапазоне [path, path без "/" + "0"),
+        # поэтому поиск идёт по индексу, а не через LIKE.
+        return models.Q(**{f"{prefix}path__gte": path, f"{prefix}path__lt": path[:-1] + "0"})
+
+    def rebuild_paths(self):
+        children = defaultdict(list)
+        for pk, parent_id in self.values_list("pk", "parent").iterator():
+            children[parent_id].append(pk)
+        stack = [(pk, "/") for pk in children[None]]
+        updated = []
+        while stack:
+            pk, parent_path = stack.pop()
+            path = f"{parent_path}{pk}/"
+            updated.append(self.model(pk=pk, path=path))
+            stack.extend((child, path) for child in children[pk])
+        self.bulk_update(updated, ["path"], batch_size=1000)
+
+
+class EventManager(models.Manager):
+    """Шкала времени: timeline_offset — смещение от нулевого события саги в годах."""
+
+    use_in_migrations = True
+    batch_size = 1000
+
+    def between(self, start=None, end=None, universe=None):
+        """События на отрезке шкалы [start, end] — диапазонный запрос по индексу."""
+        queryset = self.filter(timeline_offset__isnull=False)
+        if start is not None:
+            queryset = queryset.filter(timeline_offset__gte=start)
+        if end is not None:
+            queryset = queryset.filter(timeline_offset__lte=end)
+        if universe is not None:
+            queryset = queryset.filter(composition__saga__universe_of_events=universe)
+        return queryset.order_by("timeline_offset", "pk")
+
+    def sync_timeline(self, queryset=None):
+        """Пересчитывает timeline_offset; возвращает (изменено, не разобрано)."""
+        queryset = self.all() if queryset is None else queryset
+        rows = queryset.values_list("pk", "date_time_from_zero_event", "zero_event_flag", "timeline_offset",
+                                    "composition__saga__zero_event_abbreviature")
+        changed, updated, unparsed = [], 0, 0
+        for pk, text, zero_event_flag, current, abbreviature in rows.iterator(chunk_size=self.batch_size):
+            offset = event_offset(text, zero_event_flag, abbreviature)
+            if offset is None and text:
+                unparsed += 1
+            if offset != current:
+                changed.append(self.model(pk=pk, timeline_offset=offset))
+            if len(changed) >= self.batch_size:
+                updated += self.bulk_update(changed, ["timeline_offset"])
+                changed = []
+        updated += self.bulk_update(changed, ["timeline_offset"])
+        return updated, unparsed
+
+
+class EpisodeManager(models.Manager):
+    """Порядок чтения эпизодов: позиция — расстояние до начала цепочки previous_episode."""
+
+    use_in_migrations = True
+
+    def in_reading_order(self, composition):
+        return self.filter(composition=composition).order_by("position", "pk")
+
+    def check_link(self, episode):
+        if not episode.previous_episode_id:
+            return
+        if episode.previous_episode_id == episode.pk:
+            raise ValidationError({"previous_episode": "Эпизод не может следовать сам за собой."})
+        siblings = self.filter(composition=episode.composition_id, previous_episode=episode.previous_episode_id)
+        if episode.pk is not None:
+            siblings = siblings.exclude(pk=episode.pk)
+        if siblings.exists():
+            raise ValidationError({"previous_episode": "За этим эпизодом уже следует другой эпизод."})
+        if episode.pk is None:
+            return
+        previous = dict(self.filter(composition=episode.composition_id).values_list("pk", "previous_episode"))
+        node = episode.previous_episode_id
+        while node is not None:
+            if node == episode.pk:
+                raise ValidationError({"previous_episode": "Цепочка эпизодов замыкается в цикл."})
+            node = previous.get(node)
+
+    def renumber(self, composition_id=None):
+        """Пересчитывает position; возвращает число изменённых эпизодов. Сигналов не шлёт."""
+        queryset = self.all() if composition_id is None else self.filter(composition=composition_id)
+        previous, positions = {}, {}
+        for pk, previous_id, position in queryset.values_list("pk", "previous_episode", "position").iterator():
+            previous[pk] = previous_id
+            positions[pk] = position
+
+        numbered = {}
+        for pk in previous:
+            chain = []
+            node = pk
+            while node in previous and node not in numbered and node not in chain:
+                chain.append(node)
+                node = previous[node]
+            start = numbered[node] + 1 if node in numbered else 0
+            for offset, node in enumerate(reversed(chain)):
+                numbered[node] = start + offset
+
+        changed = [self.model(pk=pk, position=position) for pk, position in numbered.items()
+                   if positions[pk] != position]
+        return self.bulk_update(changed, ["position"], batch_size=1000)
+
+
+class JobManager(models.Manager):
+    """Очередь фоновых задач в таблице базы, без внешнего брокера.
+
+    Изменения очереди идут в транзакциях: на SQLite они IMMEDIATE (см.
+    настройки), поэтому два воркера не захватят одну задачу.
+    """
+
+    def enqueue(self, kind, saga=None, delay=0):
+        """Ставит задачу; если такая же (вид, сага) уже ждёт запуска, возвращает её."""
+        saga_id = getattr(saga, "pk", saga)
+        run_after = timezone.now() + timedelta(seconds=delay)
+        with transaction.atomic():
+            job = self.filter(kind=kind, saga=saga_id, status=self.model.QUEUED).first()
+            if job is None:
+                return self.create(kind=kind, saga_id=saga_id, run_after=run_after,
+                                   max_attempts=settings.JOB_MAX_ATTEMPTS)
+            self.filter(pk=job.pk).update(coalesced=F("coalesced") + 1, run_after=min(job.run_after, run_after))
+        job.refresh_from_db()
+        return job
+
+    def claim(self, worker):
+        """Захватывает следующую готовую задачу; та же (вид, сага) не выполняется дважды одновременно."""
+        now = timezone.now()
+        running = self.filter(status=self.model.RUNNING, kind=OuterRef("kind"), saga=OuterRef("saga"))
+        with transaction.atomic():
+            job = (self.filter(status=self.model.QUEUED, run_after__lte=now).exclude(Exists(running))
+                   .order_by("run_after", "pk").first())
+            if job is None:
+                return None
+            self.filter(pk=job.pk).update(status=self.model.RUNNING, started=now, finished=None, worker=worker,
+                                          attempts=F("attempts") + 1)
+        job.refresh_from_db()
+        return job
+
+    def finish(self, job, error=""):
+        """Отмечает завершение; упавшая задача повторяется с удвоением паузы, пока есть попытки."""
+        now = timezone.now()
+        with transaction.atomic():
+            if not error:
+                self.filter(pk=job.pk).update(status=self.model.DONE, finished=now, error="")
+            elif job.attempts >= job.max_attempts:
+                self.filter(pk=job.pk).update(status=self.model.FAILED, finished=now, error=error)
+            elif self.filter(kind=job.kind, saga=job.saga_id, status=self.model.QUEUED).exists():
+                # Уже ждёт свежая такая же задача: повтор ей поглощается.
+                self.filter(pk=job.pk).update(status=self.model.FAILED, finished=now,
+                                              error=f"{error}\nПовтор объединён с ожидающей задачей.")
+            else:
+                delay = settings.JOB_RETRY_DELAY * 2 ** (job.attempts - 1)
+                self.filter(pk=job.pk).update(status=self.model.QUEUED, worker="", error=error,
+                                              run_after=now + timedelta(seconds=delay))
+
+    def requeue_stale(self, timeout):
+        """Возвращает в очередь задачи, чей воркер пропал: запущены больше timeout секунд назад."""
+        stale = self.filter(status=self.model.RUNNING, started__lt=timezone.now() - timedelta(seconds=timeout))
+        count = 0
+        for job in stale:
+            self.finish(job, error="Воркер не завершил задачу вовремя.")
+            count += 1
+        return count
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:01
+
+import cbpi.managers
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def build_closure(apps, schema_editor):
+    apps.get_model('cbpi', 'EventSequenceClosure').objects.rebuild()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cbpi', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventSequenceClosure',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_after', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='cbpi.event', verbose_name='Последующее событие')),
+                ('event_before', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='cbpi.event', verbose_name='Предшествующее событие')),
+            ],
+            options={
+                'verbose_name': 'Порядок событий',
+                'verbose_name_plural': 'Порядок событий',
+                'indexes': [models.Index(fields=['event_after', 'event_before'], name='cbpi_events_event_a_604bbd_idx')],
+                'unique_together': {('event_before', 'event_after')},
+            },
+            managers=[
+                ('objects', cbpi.managers.EventSequenceClosureManager()),
+            ],
+        ),
+        migrations.RunPython(build_closure, migrations.RunPython.noop),
+    ]
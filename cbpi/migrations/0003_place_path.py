@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:02
+
+import cbpi.managers
+from django.db import migrations, models
+
+
+def build_paths(apps, schema_editor):
+    apps.get_model('cbpi', 'Place').objects.rebuild_paths()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cbpi', '0002_eventsequenceclosure'),
+    ]
+
+    operations = [
+        migrations.AlterModelManagers(
+            name='place',
+            managers=[
+                ('objects', cbpi.managers.PlaceManager()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='place',
+            name='path',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=1024, verbose_name='Путь в дереве'),
+        ),
+        migrations.RunPython(build_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:03
+
+import cbpi.managers
+from django.db import migrations, models
+
+
+def number_episodes(apps, schema_editor):
+    apps.get_model('cbpi', 'Episode').objects.renumber()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cbpi', '0003_place_path'),
+    ]
+
+    operations = [
+        migrations.AlterModelManagers(
+            name='episode',
+            managers=[
+                ('objects', cbpi.managers.EpisodeManager()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='episode',
+            name='position',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Позиция в произведении'),
+        ),
+        migrations.AddIndex(
+            model_name='episode',
+            index=models.Index(fields=['composition', 'position'], name='cbpi_episod_composi_9339bf_idx'),
+        ),
+        migrations.RunPython(number_episodes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,56 @@
+from django.db import migrations
+
+
+# Таблицы и триггеры на момент миграции; текущие восстанавливает search.install().
+INDEXES = {
+    'cbpi_event': ('title', 'description'),
+    'cbpi_episode': ('title', 'story_resume'),
+    'cbpi_fact': ('title', 'description'),
+    'cbpi_hero': ('name', 'description'),
+}
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for table, (title, body) in INDEXES.items():
+            fts = f'{table}_fts'
+            old = f"'delete', old.id, old.{title}, old.{body}"
+            new = f'new.id, new.{title}, new.{body}'
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({title}, {body}, '
+                f"content='{table}', content_rowid='id', tokenize='unicode61 remove_diacritics 2')")
+            cursor.execute(
+                f'CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN '
+                f'INSERT INTO {fts}(rowid, {title}, {body}) VALUES ({new}); END')
+            cursor.execute(
+                f'CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN '
+                f'INSERT INTO {fts}({fts}, rowid, {title}, {body}) VALUES ({old}); END')
+            cursor.execute(
+                f'CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {title}, {body} ON {table} BEGIN '
+                f'INSERT INTO {fts}({fts}, rowid, {title}, {body}) VALUES ({old}); '
+                f'INSERT INTO {fts}(rowid, {title}, {body}) VALUES ({new}); END')
+            cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for table in INDEXES:
+            fts = f'{table}_fts'
+            for suffix in ('ai', 'ad', 'au'):
+                cursor.execute(f'DROP TRIGGER IF EXISTS {fts}_{suffix}')
+            cursor.execute(f'DROP TABLE IF EXISTS {fts}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cbpi', '0004_episode_position'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
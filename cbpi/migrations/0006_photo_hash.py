@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cbpi', '0005_fulltext_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='author',
+            name='photo_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, verbose_name='Хеш фото'),
+        ),
+        migrations.AddField(
+            model_name='hero',
+            name='photo_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, verbose_name='Хеш фото'),
+        ),
+    ]
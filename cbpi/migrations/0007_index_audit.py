@@ -0,0 +1,105 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cbpi', '0006_photo_hash'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='affectonvalue',
+            name='value_dimension',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='cbpi.valuedimension', verbose_name='Ценность'),
+        ),
+        migrations.AlterField(
+            model_name='decisionevaluation',
+            name='hero_was_evaluated',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='оцененный_герой', to='cbpi.hero', verbose_name='Оцениваемый герой'),
+        ),
+        migrations.AlterField(
+            model_name='episode',
+            name='composition',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='cbpi.composition', verbose_name='Произведение'),
+        ),
+        migrations.AlterField(
+            model_name='eventsequence',
+            name='event_before',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='событие_до', to='cbpi.event', verbose_name='Предыдущее событие'),
+        ),
+        migrations.AlterField(
+            model_name='eventsequenceclosure',
+            name='event_after',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='cbpi.event', verbose_name='Последующее событие'),
+        ),
+        migrations.AlterField(
+            model_name='eventsequenceclosure',
+            name='event_before',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='cbpi.event', verbose_name='Предшествующее событие'),
+        ),
+        migrations.AlterField(
+            model_name='fact',
+            name='composition',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='cbpi.composition', verbose_name='Произведение'),
+        ),
+        migrations.AlterField(
+            model_name='factrelation',
+            name='based_fact',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='основанный_факт', to='cbpi.fact', verbose_name='Базовый факт'),
+        ),
+        migrations.AlterField(
+            model_name='hero',
+            name='saga',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='cbpi.saga', verbose_name='Сага'),
+        ),
+        migrations.AlterField(
+            model_name='herovalue',
+            name='hero',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='cbpi.hero', verbose_name='Герой'),
+        ),
+        migrations.AlterField(
+            model_name='userstamp',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='cbpi.user', verbose_name='Пользователь'),
+        ),
+        migrations.AddIndex(
+            model_name='decisionevaluation',
+            index=models.Index(fields=['hero_was_evaluated', 'affects_on_vd'], name='cbpi_deceval_hero_vd_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['title'], name='cbpi_event_title_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(condition=models.Q(('zero_event_flag', True)), fields=['composition'], name='cbpi_event_zero_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fact',
+            index=models.Index(fields=['composition', 'fact_type'], name='cbpi_fact_comp_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='hero',
+            index=models.Index(fields=['name'], name='cbpi_hero_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='hero',
+            index=models.Index(fields=['saga', 'name'], name='cbpi_hero_saga_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='herovalue',
+            index=models.Index(fields=['hero', 'value_dimension', 'event_after'], name='cbpi_herovalue_hero_vd_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='saga',
+            index=models.Index(fields=['name'], name='cbpi_saga_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userstamp',
+            index=models.Index(fields=['user', 'datetime'], name='cbpi_userstamp_user_dt_idx'),
+        ),
+    ]
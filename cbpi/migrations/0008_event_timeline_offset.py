@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:15
+
+import cbpi.managers
+from django.db import migrations, models
+
+
+def fill_timeline_offsets(apps, schema_editor):
+    apps.get_model('cbpi', 'Event').objects.sync_timeline()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cbpi', '0007_index_audit'),
+    ]
+
+    operations = [
+        migrations.AlterModelManagers(
+            name='event',
+            managers=[
+                ('objects', cbpi.managers.EventManager()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='timeline_offset',
+            field=models.FloatField(blank=True, editable=False, null=True, verbose_name='Смещение от нуля, лет'),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['timeline_offset'], name='cbpi_event_timeline_idx'),
+        ),
+        migrations.RunPython(fill_timeline_offsets, migrations.RunPython.noop),
+    ]
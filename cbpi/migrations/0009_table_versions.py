@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:17
+
+from django.db import migrations, models
+
+
+# Таблицы и триггеры на момент миграции; текущие восстанавливает versions.install().
+TRACKED = ('cbpi_saga', 'cbpi_composition', 'cbpi_event', 'cbpi_hero', 'cbpi_episode', 'cbpi_fact')
+NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+
+def create_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for table in TRACKED:
+            cursor.execute(
+                f"INSERT OR IGNORE INTO cbpi_tableversion(table_name, version, modified) VALUES ('{table}', 0, {NOW})")
+            for suffix, event in (('ai', 'INSERT'), ('au', 'UPDATE'), ('ad', 'DELETE')):
+                cursor.execute(
+                    f'CREATE TRIGGER IF NOT EXISTS {table}_version_{suffix} AFTER {event} ON {table} BEGIN '
+                    f'UPDATE cbpi_tableversion SET version = version + 1, modified = {NOW} '
+                    f"WHERE table_name = '{table}'; END")
+
+
+def drop_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for table in TRACKED:
+            for suffix in ('ai', 'au', 'ad'):
+                cursor.execute(f'DROP TRIGGER IF EXISTS {table}_version_{suffix}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cbpi', '0008_event_timeline_offset'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TableVersion',
+            fields=[
+                ('table_name', models.CharField(max_length=100, primary_key=True, serialize=False, verbose_name='Таблица')),
+                ('version', models.PositiveBigIntegerField(default=0, verbose_name='Версия')),
+                ('modified', models.DateTimeField(null=True, verbose_name='Изменена')),
+            ],
+            options={
+                'verbose_name': 'Версия таблицы',
+                'verbose_name_plural': 'Версии таблиц',
+            },
+        ),
+        migrations.RunPython(create_triggers, drop_triggers),
+    ]
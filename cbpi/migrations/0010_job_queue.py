@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:26
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cbpi', '0009_table_versions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('value_trajectories', 'Траектории ценностей'), ('event_closure', 'Порядок событий'), ('search_index', 'Поисковый индекс'), ('timeline', 'Шкала времени'), ('episode_order', 'Порядок эпизодов')], max_length=50, verbose_name='Задача')),
+                ('status', models.CharField(choices=[('queued', 'В очереди'), ('running', 'Выполняется'), ('done', 'Готово'), ('failed', 'Ошибка')], default='queued', max_length=10, verbose_name='Статус')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Попыток')),
+                ('max_attempts', models.PositiveSmallIntegerField(default=3, verbose_name='Максимум попыток')),
+                ('coalesced', models.PositiveIntegerField(default=0, verbose_name='Объединено запросов')),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Не раньше')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Создана')),
+                ('started', models.DateTimeField(blank=True, null=True, verbose_name='Запущена')),
+                ('finished', models.DateTimeField(blank=True, null=True, verbose_name='Завершена')),
+                ('worker', models.CharField(blank=True, max_length=100, verbose_name='Воркер')),
+                ('error', models.TextField(blank=True, verbose_name='Ошибка')),
+                ('saga', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='cbpi.saga', verbose_name='Сага')),
+            ],
+            options={
+                'verbose_name': 'Фоновая задача',
+                'verbose_name_plural': 'Фоновые задачи',
+                'indexes': [models.Index(fields=['status', 'run_after'], name='cbpi_job_status_run_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('status', 'queued')), fields=('kind', 'saga'), name='cbpi_job_one_queued')],
+            },
+        ),
+    ]
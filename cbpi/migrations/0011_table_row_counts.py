@@ -0,0 +1,71 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:29
+
+from django.db import migrations, models
+
+
+# Таблицы и триггеры на момент миграции; текущие восстанавливает versions.install().
+LEGACY_TRACKED = ('cbpi_saga', 'cbpi_composition', 'cbpi_event', 'cbpi_hero', 'cbpi_episode', 'cbpi_fact')
+TRACKED = LEGACY_TRACKED + (
+    'cbpi_country', 'cbpi_stampstatus', 'cbpi_roletype', 'cbpi_facttype', 'cbpi_compositiontype',
+    'cbpi_actiontype', 'cbpi_decisiontype', 'cbpi_valuedimension',
+    'cbpi_participation', 'cbpi_userstamp', 'cbpi_herovalue',
+)
+TRIGGERS = {'ai': ('INSERT', ' + 1'), 'au': ('UPDATE', ''), 'ad': ('DELETE', ' - 1')}
+NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+
+def create_legacy_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    # Триггеры 0009 (без row_count) для отката.
+    with schema_editor.connection.cursor() as cursor:
+        for table in LEGACY_TRACKED:
+            for suffix, (event, _) in TRIGGERS.items():
+                cursor.execute(
+                    f'CREATE TRIGGER IF NOT EXISTS {table}_version_{suffix} AFTER {event} ON {table} BEGIN '
+                    f'UPDATE cbpi_tableversion SET version = version + 1, modified = {NOW} '
+                    f"WHERE table_name = '{table}'; END")
+
+
+def drop_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for table in TRACKED:
+            for suffix in TRIGGERS:
+                cursor.execute(f'DROP TRIGGER IF EXISTS {table}_version_{suffix}')
+
+
+def recreate_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for table in TRACKED:
+            cursor.execute(
+                f'INSERT OR IGNORE INTO cbpi_tableversion(table_name, version, modified, row_count) '
+                f"VALUES ('{table}', 0, {NOW}, 0)")
+            cursor.execute(f'UPDATE cbpi_tableversion SET row_count = (SELECT COUNT(*) FROM {table}) '
+                           f"WHERE table_name = '{table}'")
+            for suffix, (event, change) in TRIGGERS.items():
+                cursor.execute(
+                    f'CREATE TRIGGER IF NOT EXISTS {table}_version_{suffix} AFTER {event} ON {table} BEGIN '
+                    f'UPDATE cbpi_tableversion SET version = version + 1, modified = {NOW}, '
+                    f"row_count = row_count{change} WHERE table_name = '{table}'; END")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cbpi', '0010_job_queue'),
+    ]
+
+    operations = [
+        # Триггеры 0009 ссылаются на cbpi_tableversion, которую AddField пересоздаёт.
+        migrations.RunPython(drop_triggers, create_legacy_triggers),
+        migrations.AddField(
+            model_name='tableversion',
+            name='row_count',
+            field=models.BigIntegerField(default=0, verbose_name='Строк'),
+        ),
+        migrations.RunPython(recreate_triggers, drop_triggers),
+    ]
@@ -0,0 +1,85 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:30
+
+import cbpi.models
+from django.db import migrations
+
+
+# (родитель, счётчик, дочерняя таблица, колонка FK) на момент миграции;
+# текущие триггеры восстанавливает counters.install().
+COUNTERS = (
+    ('cbpi_saga', 'composition_count', 'cbpi_composition', 'saga_id'),
+    ('cbpi_composition', 'episode_count', 'cbpi_episode', 'composition_id'),
+    ('cbpi_hero', 'participation_count', 'cbpi_participation', 'hero_id'),
+    ('cbpi_hero', 'action_count', 'cbpi_heroaction', 'hero_id'),
+    ('cbpi_heroaction', 'evaluation_count', 'cbpi_decisionevaluation', 'eval_for_ha_id'),
+)
+
+
+def change(table, counter, column, row, sign):
+    return f'UPDATE {table} SET {counter} = {counter} {sign} 1 WHERE id = {row}.{column};'
+
+
+def create_triggers(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        for table, counter, child, column in COUNTERS:
+            if connection.vendor == 'sqlite':
+                name = f'{child}_{counter}'
+                old = change(table, counter, column, 'old', '-')
+                new = change(table, counter, column, 'new', '+')
+                cursor.execute(
+                    f'CREATE TRIGGER IF NOT EXISTS {name}_ai AFTER INSERT ON {child} '
+                    f"WHEN new.{column} IS NOT NULL BEGIN {new} END")
+                cursor.execute(
+                    f'CREATE TRIGGER IF NOT EXISTS {name}_ad AFTER DELETE ON {child} '
+                    f"WHEN old.{column} IS NOT NULL BEGIN {old} END")
+                cursor.execute(
+                    f'CREATE TRIGGER IF NOT EXISTS {name}_au AFTER UPDATE OF {column} ON {child} '
+                    f"WHEN old.{column} IS NOT new.{column} BEGIN {old} {new} END")
+            cursor.execute(
+                f'UPDATE {table} SET {counter} = (SELECT COUNT(*) FROM {child} WHERE {child}.{column} = {table}.id)')
+
+
+def drop_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for _, counter, child, _ in COUNTERS:
+            for suffix in ('ai', 'ad', 'au'):
+                cursor.execute(f'DROP TRIGGER IF EXISTS {child}_{counter}_{suffix}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cbpi', '0011_table_row_counts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='composition',
+            name='episode_count',
+            field=cbpi.models.CounterField(default=0, editable=False, verbose_name='Эпизодов'),
+        ),
+        migrations.AddField(
+            model_name='hero',
+            name='action_count',
+            field=cbpi.models.CounterField(default=0, editable=False, verbose_name='Действий'),
+        ),
+        migrations.AddField(
+            model_name='hero',
+            name='participation_count',
+            field=cbpi.models.CounterField(default=0, editable=False, verbose_name='Участий'),
+        ),
+        migrations.AddField(
+            model_name='heroaction',
+            name='evaluation_count',
+            field=cbpi.models.CounterField(default=0, editable=False, verbose_name='Оценок'),
+        ),
+        migrations.AddField(
+            model_name='saga',
+            name='composition_count',
+            field=cbpi.models.CounterField(default=0, editable=False, verbose_name='Произведений'),
+        ),
+        migrations.RunPython(create_triggers, drop_triggers),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cbpi', '0012_maintained_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='roletype',
+            name='weight',
+            field=models.FloatField(default=1.0, verbose_name='Вес в сети соучастия'),
+        ),
+    ]
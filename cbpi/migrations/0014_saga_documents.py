@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:36
+
+import django.core.serializers.json
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cbpi', '0013_role_type_weight'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SagaDocument',
+            fields=[
+                ('saga', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='cbpi.saga', verbose_name='Сага')),
+                ('document', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder, verbose_name='Документ')),
+                ('stale', models.BooleanField(default=False, verbose_name='Устарел')),
+                ('built', models.DateTimeField(auto_now=True, verbose_name='Собран')),
+            ],
+            options={
+                'verbose_name': 'Документ саги',
+                'verbose_name_plural': 'Документы саг',
+            },
+        ),
+        migrations.AlterField(
+            model_name='job',
+            name='kind',
+            field=models.CharField(choices=[('value_trajectories', 'Траектории ценностей'), ('event_closure', 'Порядок событий'), ('search_index', 'Поисковый индекс'), ('timeline', 'Шкала времени'), ('episode_order', 'Порядок эпизодов'), ('saga_document', 'Документ саги')], max_length=50, verbose_name='Задача'),
+        ),
+        migrations.CreateModel(
+            name='SagaDocumentDependency',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('table_name', models.CharField(max_length=100, verbose_name='Таблица')),
+                ('row_id', models.BigIntegerField(verbose_name='Id строки')),
+                ('document', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='dependencies', to='cbpi.sagadocument', verbose_name='Документ')),
+            ],
+            options={
+                'verbose_name': 'Зависимость документа саги',
+                'verbose_name_plural': 'Зависимости документов саг',
+                'indexes': [models.Index(fields=['table_name', 'row_id'], name='cbpi_sagadoc_dep_row_idx')],
+                'constraints': [models.UniqueConstraint(fields=('document', 'table_name', 'row_id'), name='cbpi_sagadoc_dep_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:38
+
+from django.db import migrations, models
+
+
+# Таблицы и триггеры на момент миграции; текущие восстанавливает history.install().
+TABLES = ('cbpi_herovalue', 'cbpi_decisionevaluation')
+
+
+def position(row):
+    return (f'CASE WHEN {row}.event_after_id IS NULL THEN -9e999 '
+            f'ELSE (SELECT timeline_offset FROM cbpi_event WHERE id = {row}.event_after_id) END')
+
+
+def create_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for table in TABLES:
+            for suffix, when in (('ai', 'INSERT'), ('au', 'UPDATE OF event_after_id, as_of')):
+                cursor.execute(
+                    f'CREATE TRIGGER IF NOT EXISTS {table}_as_of_{suffix} AFTER {when} ON {table} BEGIN '
+                    f"UPDATE {table} SET as_of = {position('new')} WHERE id = new.id; END")
+            cursor.execute(f'UPDATE {table} SET as_of = {position(table)}')
+        updates = ' '.join(f'UPDATE {table} SET as_of = new.timeline_offset WHERE event_after_id = new.id;'
+                           for table in TABLES)
+        cursor.execute(
+            f'CREATE TRIGGER IF NOT EXISTS cbpi_event_as_of_au AFTER UPDATE OF timeline_offset ON cbpi_event '
+            f'BEGIN {updates} END')
+
+
+def drop_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for table in TABLES:
+            for suffix in ('ai', 'au'):
+                cursor.execute(f'DROP TRIGGER IF EXISTS {table}_as_of_{suffix}')
+        cursor.execute('DROP TRIGGER IF EXISTS cbpi_event_as_of_au')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cbpi', '0014_saga_documents'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='decisionevaluation',
+            name='as_of',
+            field=models.FloatField(editable=False, null=True, verbose_name='Позиция на шкале'),
+        ),
+        migrations.AddField(
+            model_name='herovalue',
+            name='as_of',
+            field=models.FloatField(editable=False, null=True, verbose_name='Позиция на шкале'),
+        ),
+        migrations.AddIndex(
+            model_name='decisionevaluation',
+            index=models.Index(fields=['hero_was_evaluated', 'as_of'], name='cbpi_deceval_hero_asof_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='herovalue',
+            index=models.Index(fields=['hero', 'as_of'], name='cbpi_herovalue_hero_asof_idx'),
+        ),
+        migrations.RunPython(create_triggers, drop_triggers),
+    ]
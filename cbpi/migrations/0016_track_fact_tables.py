@@ -0,0 +1,44 @@
+from django.db import migrations
+
+
+# Таблицы и триггеры на момент миграции; текущие восстанавливает versions.install().
+TRACKED = ('cbpi_factrelation', 'cbpi_affectonvalue')
+TRIGGERS = {'ai': ('INSERT', ' + 1'), 'au': ('UPDATE', ''), 'ad': ('DELETE', ' - 1')}
+NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+
+def install_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    # Версии графа фактов для versions.VersionedCache.
+    with schema_editor.connection.cursor() as cursor:
+        for table in TRACKED:
+            cursor.execute(
+                f'INSERT OR IGNORE INTO cbpi_tableversion(table_name, version, modified, row_count) '
+                f"VALUES ('{table}', 0, {NOW}, (SELECT COUNT(*) FROM {table}))")
+            for suffix, (event, change) in TRIGGERS.items():
+                cursor.execute(
+                    f'CREATE TRIGGER IF NOT EXISTS {table}_version_{suffix} AFTER {event} ON {table} BEGIN '
+                    f'UPDATE cbpi_tableversion SET version = version + 1, modified = {NOW}, '
+                    f"row_count = row_count{change} WHERE table_name = '{table}'; END")
+
+
+def drop_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for table in TRACKED:
+            for suffix in TRIGGERS:
+                cursor.execute(f'DROP TRIGGER IF EXISTS {table}_version_{suffix}')
+            cursor.execute(f"DELETE FROM cbpi_tableversion WHERE table_name = '{table}'")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cbpi', '0015_hero_state_as_of'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_triggers, drop_triggers),
+    ]
@@ -1,5 +1,32 @@
 from django.conf import settings
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction
+from django.utils import timezone
+from django.db.models.functions import Concat, Substr
+
+from .managers import EpisodeManager, EventManager, EventSequenceClosureManager, JobManager, PlaceManager
+from .timeline import event_offset
+
+
+class CounterField(models.PositiveIntegerField):
+    """Число дочерних строк; ведут триггеры базы (см. counters)."""
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault("default", 0)
+        kwargs.setdefault("editable", False)
+        super().__init__(*args, **kwargs)
+
+
+class CountersMixin:
+    """save() существующей строки не пишет счётчики: в памяти они могут быть устаревшими."""
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get("update_fields") is None and not kwargs.get("force_insert"):
+            kwargs["update_fields"] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and not isinstance(field, CounterField)]
+        super().save(*args, **kwargs)
+
 
 class Universe(models.Model):
     name = models.CharField("Название вселенной", max_length=255)
@@ -26,6 +53,9 @@ class GlobalActorList(models.Model):
         verbose_name = "Глобальный актор"
         verbose_name_plural = "Глобальные акторы"
 
+    def __str__(self):
+        return self.nickname
+
 
 class User(models.Model):
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, verbose_name="Пользователь")
@@ -48,18 +78,22 @@ class StampStatus(models.Model):
 
 
 class UserStamp(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name="Пользователь")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False, verbose_name="Пользователь")
     datetime = models.DateTimeField("Дата и время")
     status = models.ForeignKey(StampStatus, on_delete=models.SET_NULL, null=True, verbose_name="Статус")
 
     class Meta:
         verbose_name = "Отметка пользователя"
         verbose_name_plural = "Отметки пользователей"
+        indexes = [
+            models.Index(fields=["user", "datetime"], name="cbpi_userstamp_user_dt_idx"),
+        ]
 
 
 class Author(models.Model):
     name = models.CharField("Имя автора", max_length=255)
     photo_file = models.ImageField("Фото", upload_to='authors/', null=True, blank=True)
+    photo_hash = models.CharField("Хеш фото", max_length=64, blank=True, editable=False)
     date_of_birth = models.DateField("Дата рождения", null=True, blank=True)
     wiki_link = models.URLField("Wiki ссылка", null=True, blank=True)
     country_of_birth = models.ForeignKey(Country, on_delete=models.SET_NULL, null=True, verbose_name="Страна рождения")
@@ -79,7 +113,7 @@ class CompositionType(models.Model):
         verbose_name_plural = "Типы произведений"
 
 
-class Saga(models.Model):
+class Saga(CountersMixin, models.Model):
     name = models.CharField("Название саги", max_length=255)
     universe_of_events = models.ForeignKey(Universe, on_delete=models.SET_NULL, null=True, verbose_name="Вселенная событий")
     zero_event_abbreviature = models.CharField("Аббревиатура нулевого события", max_length=50, null=True, blank=True)
@@ -87,10 +121,14 @@ class Saga(models.Model):
     country_first_published = models.ForeignKey(Country, on_delete=models.SET_NULL, null=True, verbose_name="Страна первой публикации", related_name='sagas')
     author = models.ForeignKey(Author, on_delete=models.SET_NULL, null=True, verbose_name="Автор")
     user_stamp = models.ForeignKey(UserStamp, on_delete=models.SET_NULL, null=True, verbose_name="Отметка пользователя")
+    composition_count = CounterField("Произведений")
 
     class Meta:
         verbose_name = "Сага"
         verbose_name_plural = "Саги"
+        indexes = [
+            models.Index(fields=["name"], name="cbpi_saga_name_idx"),
+        ]
 
 
 class Place(models.Model):
@@ -99,18 +137,63 @@ class Place(models.Model):
     description = models.TextField("Описание", blank=True)
     wiki_link = models.URLField("Wiki ссылка", blank=True)
     real_flag = models.BooleanField("Реальное место?", default=False)
+    path = models.CharField("Путь в дереве", max_length=1024, default="", editable=False, db_index=True)
+
+    objects = PlaceManager()
 
     class Meta:
         verbose_name = "Место"
         verbose_name_plural = "Места"
 
-
-class Composition(models.Model):
+    def __str__(self):
+        return self.name
+
+    @property
+    def depth(self):
+        return self.path.count("/") - 2
+
+    def ancestors(self):
+        ids = self.path.strip("/").split("/")[:-1]
+        return Place.objects.filter(pk__in=ids).order_by("path")
+
+    def descendants(self, include_self=False):
+        queryset = Place.objects.filter(Place.objects.subtree_filter(self.path))
+        return queryset if include_self else queryset.exclude(pk=self.pk)
+
+    def events_within(self):
+        return Event.objects.filter(Place.objects.subtree_filter(self.path, prefix="place__"))
+
+    def clean(self):
+        if self.parent_id and not self._state.adding:
+            parent_path = Place.objects.filter(pk=self.parent_id).values_list("path", flat=True).first() or ""
+            if f"/{self.pk}/" in parent_path:
+                raise ValidationError({"parent": "Место не может быть вложено само в себя."})
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            self.clean()
+            super().save(*args, **kwargs)
+            parent_path = "/"
+            if self.parent_id:
+                parent_path = Place.objects.filter(pk=self.parent_id).values_list("path", flat=True).get()
+            previous_path = Place.objects.filter(pk=self.pk).values_list("path", flat=True).get()
+            path = f"{parent_path}{self.pk}/"
+            if path != previous_path:
+                if previous_path:
+                    Place.objects.filter(Place.objects.subtree_filter(previous_path)).update(
+                        path=Concat(models.Value(path), Substr("path", len(previous_path) + 1)))
+                else:
+                    Place.objects.filter(pk=self.pk).update(path=path)
+            self.path = path
+
+
+class Composition(CountersMixin, models.Model):
     saga = models.ForeignKey(Saga, on_delete=models.CASCADE, verbose_name="Сага")
     title = models.CharField("Название", max_length=255)
     date_published = models.DateField("Дата публикации", null=True, blank=True)
     composition_type = models.ForeignKey(CompositionType, on_delete=models.SET_NULL, null=True, verbose_name="Тип")
     file_source = models.FileField("Файл", upload_to='compositions/', null=True, blank=True)
+    episode_count = CounterField("Эпизодов")
 
     class Meta:
         verbose_name = "Произведение"
@@ -126,42 +209,101 @@ class Event(models.Model):
     composition = models.ForeignKey(Composition, on_delete=models.SET_NULL, null=True, verbose_name="Произведение")
     cm_position = models.CharField("Позиция в произведении", max_length=255, null=True, blank=True)
     user_stamp = models.ForeignKey(UserStamp, on_delete=models.SET_NULL, null=True, verbose_name="Отметка")
+    timeline_offset = models.FloatField("Смещение от нуля, лет", null=True, blank=True, editable=False)
+
+    objects = EventManager()
 
     class Meta:
         verbose_name = "Событие"
         verbose_name_plural = "События"
-
-
-class Hero(models.Model):
+        indexes = [
+            models.Index(fields=["title"], name="cbpi_event_title_idx"),
+            models.Index(fields=["composition"], condition=models.Q(zero_event_flag=True), name="cbpi_event_zero_idx"),
+            models.Index(fields=["timeline_offset"], name="cbpi_event_timeline_idx"),
+        ]
+
+    def __str__(self):
+        return self.title
+
+    def _zero_event_abbreviature(self):
+        if not self.composition_id:
+            return None
+        return Composition.objects.filter(pk=self.composition_id).values_list(
+            "saga__zero_event_abbreviature", flat=True).first()
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None or {"date_time_from_zero_event", "zero_event_flag", "composition"} & set(update_fields):
+            self.timeline_offset = event_offset(
+                self.date_time_from_zero_event, self.zero_event_flag, self._zero_event_abbreviature())
+            if update_fields is not None:
+                kwargs["update_fields"] = {*update_fields, "timeline_offset"}
+        super().save(*args, **kwargs)
+
+
+class Hero(CountersMixin, models.Model):
     name = models.CharField("Имя героя", max_length=255)
     description = models.TextField("Описание", blank=True)
     photo_file = models.ImageField("Фото", upload_to='heroes/', null=True, blank=True)
-    saga = models.ForeignKey(Saga, on_delete=models.SET_NULL, null=True, verbose_name="Сага")
+    photo_hash = models.CharField("Хеш фото", max_length=64, blank=True, editable=False)
+    saga = models.ForeignKey(Saga, on_delete=models.SET_NULL, null=True, db_index=False, verbose_name="Сага")
     birth_event = models.ForeignKey(Event, on_delete=models.SET_NULL, null=True, verbose_name="Событие рождения")
     user_stamp = models.ForeignKey(UserStamp, on_delete=models.SET_NULL, null=True, verbose_name="Отметка")
     gla = models.ForeignKey(GlobalActorList, on_delete=models.SET_NULL, null=True, verbose_name="Глобальный актор")
+    participation_count = CounterField("Участий")
+    action_count = CounterField("Действий")
 
     class Meta:
         verbose_name = "Герой"
         verbose_name_plural = "Герои"
+        indexes = [
+            models.Index(fields=["name"], name="cbpi_hero_name_idx"),
+            models.Index(fields=["saga", "name"], name="cbpi_hero_saga_name_idx"),
+        ]
+
+    def __str__(self):
+        return self.name
 
 
 class Episode(models.Model):
-    composition = models.ForeignKey(Composition, on_delete=models.CASCADE, verbose_name="Произведение")
+    composition = models.ForeignKey(Composition, on_delete=models.CASCADE, db_index=False, verbose_name="Произведение")
     title = models.CharField("Название эпизода", max_length=255)
     story_resume = models.TextField("Краткое описание")
     start_event = models.ForeignKey(Event, on_delete=models.SET_NULL, null=True, verbose_name="Начальное событие")
     previous_episode = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, verbose_name="Предыдущий эпизод")
     user_stamp = models.ForeignKey(UserStamp, on_delete=models.SET_NULL, null=True, verbose_name="Отметка")
+    position = models.PositiveIntegerField("Позиция в произведении", default=0, editable=False)
+
+    objects = EpisodeManager()
 
     class Meta:
         verbose_name = "Эпизод"
         verbose_name_plural = "Эпизоды"
+        indexes = [models.Index(fields=["composition", "position"])]
+
+    def __str__(self):
+        return self.title
+
+    def clean(self):
+        Episode.objects.check_link(self)
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            previous_composition_id = None
+            if not self._state.adding:
+                previous_composition_id = Episode.objects.filter(pk=self.pk).values_list("composition", flat=True).first()
+            self.clean()
+            super().save(*args, **kwargs)
+            Episode.objects.renumber(self.composition_id)
+            if previous_composition_id not in (None, self.composition_id):
+                Episode.objects.renumber(previous_composition_id)
+            self.position = Episode.objects.filter(pk=self.pk).values_list("position", flat=True).get()
 
 
 class RoleType(models.Model):
     name = models.CharField("Название роли", max_length=255)
     description = models.TextField("Описание", blank=True)
+    weight = models.FloatField("Вес в сети соучастия", default=1.0)
 
     class Meta:
         verbose_name = "Тип роли"
@@ -200,7 +342,7 @@ class FactType(models.Model):
 
 
 class Fact(models.Model):
-    composition = models.ForeignKey(Composition, on_delete=models.CASCADE, verbose_name="Произведение")
+    composition = models.ForeignKey(Composition, on_delete=models.CASCADE, db_index=False, verbose_name="Произведение")
     title = models.CharField("Заголовок", max_length=255)
     description = models.TextField("Описание", blank=True)
     fact_type = models.ForeignKey(FactType, on_delete=models.SET_NULL, null=True, verbose_name="Тип факта")
@@ -211,10 +353,16 @@ class Fact(models.Model):
     class Meta:
         verbose_name = "Факт"
         verbose_name_plural = "Факты"
+        indexes = [
+            models.Index(fields=["composition", "fact_type"], name="cbpi_fact_comp_type_idx"),
+        ]
+
+    def __str__(self):
+        return self.title
 
 
 class AffectOnValue(models.Model):
-    value_dimension = models.ForeignKey(ValueDimension, on_delete=models.CASCADE, verbose_name="Ценность")
+    value_dimension = models.ForeignKey(ValueDimension, on_delete=models.CASCADE, db_index=False, verbose_name="Ценность")
     fact_type = models.ForeignKey(FactType, on_delete=models.CASCADE, verbose_name="Тип факта")
     weight = models.FloatField("Вес воздействия")
 
@@ -225,14 +373,20 @@ class AffectOnValue(models.Model):
 
 
 class HeroValue(models.Model):
-    hero = models.ForeignKey('Hero', on_delete=models.CASCADE, verbose_name="Герой")
+    hero = models.ForeignKey('Hero', on_delete=models.CASCADE, db_index=False, verbose_name="Герой")
     value_dimension = models.ForeignKey('ValueDimension', on_delete=models.CASCADE, verbose_name="Ценность")
     weight = models.FloatField("Вес")
     event_after = models.ForeignKey('Event', on_delete=models.SET_NULL, null=True, blank=True, verbose_name="После события")
+    # timeline_offset события (без события — -inf); ведут триггеры (см. history).
+    as_of = models.FloatField("Позиция на шкале", null=True, editable=False)
 
     class Meta:
         verbose_name = "Убеждение героя"
         verbose_name_plural = "Убеждения героев"
+        indexes = [
+            models.Index(fields=["hero", "value_dimension", "event_after"], name="cbpi_herovalue_hero_vd_idx"),
+            models.Index(fields=["hero", "as_of"], name="cbpi_herovalue_hero_asof_idx"),
+        ]
 
 
 class DecisionType(models.Model):
@@ -265,12 +419,13 @@ class ActionType(models.Model):
         verbose_name_plural = "Типы действий"
 
 
-class HeroAction(models.Model):
+class HeroAction(CountersMixin, models.Model):
     hero = models.ForeignKey('Hero', on_delete=models.CASCADE, verbose_name="Герой")
     action_type = models.ForeignKey(ActionType, on_delete=models.SET_NULL, null=True, verbose_name="Тип действия")
     based_on_decision = models.ForeignKey(Decision, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="Основано на решении")
     cause_event = models.ForeignKey('Event', on_delete=models.SET_NULL, null=True, blank=True, verbose_name="Причинное событие")
     in_role = models.ForeignKey('Participation', on_delete=models.SET_NULL, null=True, blank=True, verbose_name="Роль в эпизоде")
+    evaluation_count = CounterField("Оценок")
 
     class Meta:
         verbose_name = "Действие героя"
@@ -278,20 +433,25 @@ class HeroAction(models.Model):
 
 
 class DecisionEvaluation(models.Model):
-    hero_was_evaluated = models.ForeignKey('Hero', on_delete=models.CASCADE, related_name='оцененный_герой', verbose_name="Оцениваемый герой")
+    hero_was_evaluated = models.ForeignKey('Hero', on_delete=models.CASCADE, related_name='оцененный_герой', db_index=False, verbose_name="Оцениваемый герой")
     eval_for_ha = models.ForeignKey(HeroAction, on_delete=models.CASCADE, verbose_name="Оцениваемое действие")
     gla_evaluator = models.ForeignKey('GlobalActorList', on_delete=models.SET_NULL, null=True, verbose_name="Оценивающий актор")
     event_after = models.ForeignKey('Event', on_delete=models.SET_NULL, null=True, verbose_name="После события")
     affects_on_vd = models.ForeignKey(ValueDimension, on_delete=models.SET_NULL, null=True, verbose_name="Затрагиваемая ценность")
     weight = models.FloatField("Влияние от -1 до 1")
+    as_of = models.FloatField("Позиция на шкале", null=True, editable=False)
 
     class Meta:
         verbose_name = "Оценка действия"
         verbose_name_plural = "Оценки действий"
+        indexes = [
+            models.Index(fields=["hero_was_evaluated", "affects_on_vd"], name="cbpi_deceval_hero_vd_idx"),
+            models.Index(fields=["hero_was_evaluated", "as_of"], name="cbpi_deceval_hero_asof_idx"),
+        ]
 
 
 class EventSequence(models.Model):
-    event_before = models.ForeignKey('Event', on_delete=models.CASCADE, related_name='событие_до', verbose_name="Предыдущее событие")
+    event_before = models.ForeignKey('Event', on_delete=models.CASCADE, related_name='событие_до', db_index=False, verbose_name="Предыдущее событие")
     event_after = models.ForeignKey('Event', on_delete=models.CASCADE, related_name='событие_после', verbose_name="Следующее событие")
     straight = models.BooleanField("Сразу после?", default=False)
 
@@ -300,9 +460,38 @@ class EventSequence(models.Model):
         verbose_name_plural = "Последовательности событий"
         unique_together = ("event_before", "event_after")
 
+    def clean(self):
+        if self._state.adding and self.event_before_id and self.event_after_id:
+            EventSequenceClosure.objects.check_edge(self.event_before_id, self.event_after_id)
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            previous = None
+            if not self._state.adding:
+                previous = EventSequence.objects.filter(pk=self.pk).values_list("event_before", "event_after").first()
+            super().save(*args, **kwargs)
+            if previous != (self.event_before_id, self.event_after_id):
+                if previous is not None:
+                    EventSequenceClosure.objects.remove_edge(*previous)
+                EventSequenceClosure.objects.check_edge(self.event_before_id, self.event_after_id)
+                EventSequenceClosure.objects.add_edge(self.event_before_id, self.event_after_id)
+
+
+class EventSequenceClosure(models.Model):
+    event_before = models.ForeignKey('Event', on_delete=models.CASCADE, related_name='+', db_index=False, verbose_name="Предшествующее событие")
+    event_after = models.ForeignKey('Event', on_delete=models.CASCADE, related_name='+', db_index=False, verbose_name="Последующее событие")
+
+    objects = EventSequenceClosureManager()
+
+    class Meta:
+        verbose_name = "Порядок событий"
+        verbose_name_plural = "Порядок событий"
+        unique_together = ("event_before", "event_after")
+        indexes = [models.Index(fields=["event_after", "event_before"])]
+
 
 class FactRelation(models.Model):
-    based_fact = models.ForeignKey(Fact, on_delete=models.CASCADE, related_name='основанный_факт', verbose_name="Базовый факт")
+    based_fact = models.ForeignKey(Fact, on_delete=models.CASCADE, related_name='основанный_факт', db_index=False, verbose_name="Базовый факт")
     followed_fact = models.ForeignKey(Fact, on_delete=models.CASCADE, related_name='следующий_факт', verbose_name="Следующий факт")
     group_id = models.CharField("ID группы", max_length=100, blank=True)
     event_relation = models.ForeignKey(Event, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="Связанное событие")
@@ -311,3 +500,91 @@ class FactRelation(models.Model):
         verbose_name = "Связь фактов"
         verbose_name_plural = "Связи фактов"
         unique_together = ("based_fact", "followed_fact")
+
+
+class TableVersion(models.Model):
+    """Счётчики изменений и строк таблицы; ведут триггеры базы (см. versions)."""
+
+    table_name = models.CharField("Таблица", max_length=100, primary_key=True)
+    version = models.PositiveBigIntegerField("Версия", default=0)
+    modified = models.DateTimeField("Изменена", null=True)
+    row_count = models.BigIntegerField("Строк", default=0)
+
+    class Meta:
+        verbose_name = "Версия таблицы"
+        verbose_name_plural = "Версии таблиц"
+
+    def __str__(self):
+        return f"{self.table_name} v{self.version}"
+
+
+class Job(models.Model):
+    """Фоновая задача пересчёта; выполняет команда run_jobs (см. jobs)."""
+
+    QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+    STATUSES = [(QUEUED, "В очереди"), (RUNNING, "Выполняется"), (DONE, "Готово"), (FAILED, "Ошибка")]
+    KINDS = [
+        ("value_trajectories", "Траектории ценностей"),
+        ("event_closure", "Порядок событий"),
+        ("search_index", "Поисковый индекс"),
+        ("timeline", "Шкала времени"),
+        ("episode_order", "Порядок эпизодов"),
+        ("saga_document", "Документ саги"),
+    ]
+
+    kind = models.CharField("Задача", max_length=50, choices=KINDS)
+    saga = models.ForeignKey(Saga, on_delete=models.CASCADE, null=True, blank=True, verbose_name="Сага")
+    status = models.CharField("Статус", max_length=10, choices=STATUSES, default=QUEUED)
+    attempts = models.PositiveSmallIntegerField("Попыток", default=0)
+    max_attempts = models.PositiveSmallIntegerField("Максимум попыток", default=3)
+    coalesced = models.PositiveIntegerField("Объединено запросов", default=0)
+    run_after = models.DateTimeField("Не раньше", default=timezone.now)
+    created = models.DateTimeField("Создана", auto_now_add=True)
+    started = models.DateTimeField("Запущена", null=True, blank=True)
+    finished = models.DateTimeField("Завершена", null=True, blank=True)
+    worker = models.CharField("Воркер", max_length=100, blank=True)
+    error = models.TextField("Ошибка", blank=True)
+
+    objects = JobManager()
+
+    class Meta:
+        verbose_name = "Фоновая задача"
+        verbose_name_plural = "Фоновые задачи"
+        indexes = [models.Index(fields=["status", "run_after"], name="cbpi_job_status_run_idx")]
+        constraints = [
+            models.UniqueConstraint(fields=["kind", "saga"], condition=models.Q(status="queued"),
+                                    name="cbpi_job_one_queued"),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} #{self.pk}"
+
+
+class SagaDocument(models.Model):
+    """Денормализованный документ саги: читается одним запросом (см. documents)."""
+
+    saga = models.OneToOneField(Saga, on_delete=models.CASCADE, primary_key=True, verbose_name="Сага")
+    document = models.JSONField("Документ", encoder=DjangoJSONEncoder)
+    stale = models.BooleanField("Устарел", default=False)
+    built = models.DateTimeField("Собран", auto_now=True)
+
+    class Meta:
+        verbose_name = "Документ саги"
+        verbose_name_plural = "Документы саг"
+
+
+class SagaDocumentDependency(models.Model):
+    """Строка, из которой собран документ саги: её изменение делает документ устаревшим."""
+
+    document = models.ForeignKey(SagaDocument, on_delete=models.CASCADE, related_name="dependencies", db_index=False,
+                                 verbose_name="Документ")
+    table_name = models.CharField("Таблица", max_length=100)
+    row_id = models.BigIntegerField("Id строки")
+
+    class Meta:
+        verbose_name = "Зависимость документа саги"
+        verbose_name_plural = "Зависимости документов саг"
+        indexes = [models.Index(fields=["table_name", "row_id"], name="cbpi_sagadoc_dep_row_idx")]
+        constraints = [
+            models.UniqueConstraint(fields=["document", "table_name", "row_id"], name="cbpi_sagadoc_dep_unique"),
+        ]
@@ -0,0 +1,175 @@
+"""Сеть соучастия героев саги: кто с кем появляется в эпизодах.
+
+Participation саги читается одним запросом в разреженную матрицу
+инцидентности A герой × эпизод (COO: строки, столбцы, веса; вес — RoleType.weight).
+Соучастие C = A·Aᵀ считается без плотных матриц: пары героев порождаются
+внутри каждого эпизода, одинаковые пары суммируются. Центральности — суммы
+строк C и собственный вектор C (степенной метод на разреженном C·x).
+scipy в зависимостях нет, поэтому всё сделано на NumPy.
+
+Сеть кешируется на сагу в памяти процесса. Сигналы Participation правят
+матрицу кеша на месте (см. signals), а C и центральности пересчитываются из
+неё без запросов к базе; изменения Episode, RoleType и Composition (перенос в
+другую сагу) сбрасывают кеш целиком. Bulk-операции и записи других процессов
+видны по версиям Participation, Episode, RoleType и Composition
+(versions.VersionedCache) и сбрасывают сети всех саг; свои записи, уже
+внесённые на месте, кеш принимает (accept) и не перестраивает.
+"""
+import numpy as np
+
+from . import refcache
+from .models import Composition, Episode, Participation, RoleType
+from .routers import analytics_reads
+from .versions import VersionedCache
+
+_networks = VersionedCache(Participation, Episode, RoleType, Composition)
+
+
+def _role_weight(role_type_id):
+    role_type = refcache.get(RoleType, role_type_id) if role_type_id is not None else None
+    return 1.0 if role_type is None else role_type.weight
+
+
+class CoOccurrence:
+    """Разреженная симметричная матрица соучастия без диагонали.
+
+    hero_ids — id героев по номерам строк; rows, cols, weights — ненулевые
+    элементы (обе половины), weights[k] = Σ по эпизодам весов ролей rows[k] × cols[k].
+    """
+
+    def __init__(self, hero_ids, rows, cols, weights):
+        self.hero_ids = hero_ids
+        self.rows = rows
+        self.cols = cols
+        self.weights = weights
+
+    def pairs(self):
+        """(герой, герой, вес) для каждой пары один раз, по убыванию веса."""
+        upper = self.rows < self.cols
+        order = np.argsort(-self.weights[upper], kind="stable")
+        return [(int(a), int(b), float(w)) for a, b, w in zip(
+            self.hero_ids[self.rows[upper][order]], self.hero_ids[self.cols[upper][order]],
+            self.weights[upper][order])]
+
+    def partners(self, hero_id, limit=10):
+        """Самые частые соучастники героя: [(id героя, вес)]."""
+        position = np.searchsorted(self.hero_ids, hero_id)
+        if position == len(self.hero_ids) or self.hero_ids[position] != hero_id:
+            return []
+        mine = self.rows == position
+        order = np.argsort(-self.weights[mine], kind="stable")[:limit]
+        return [(int(h), float(w)) for h, w in zip(self.hero_ids[self.cols[mine][order]], self.weights[mine][order])]
+
+    def matvec(self, vector):
+        return np.bincount(self.rows, weights=self.weights * vector[self.cols], minlength=len(self.hero_ids))
+
+    def degree(self):
+        """Взвешенная степень: {id героя: сумма весов соучастия}."""
+        return dict(zip(self.hero_ids.tolist(), self.matvec(np.ones(len(self.hero_ids))).tolist()))
+
+    def eigenvector(self, max_iter=100, tol=1e-9):
+        """Центральность по собственному вектору, нормированная на максимум 1."""
+        if not len(self.hero_ids):
+            return {}
+        vector = np.full(len(self.hero_ids), 1.0 / len(self.hero_ids))
+        for _ in range(max_iter):
+            # +vector: сдвиг спектра, чтобы итерации сходились и на двудольных сетях.
+            following = self.matvec(vector) + vector
+            following /= np.linalg.norm(following)
+            converged = np.abs(following - vector).max() < tol
+            vector = following
+            if converged:
+                break
+        return dict(zip(self.hero_ids.tolist(), (vector / vector.max()).tolist()))
+
+
+class HeroNetwork:
+    """Инцидентность герой × эпизод саги: по элементу на каждое Participation."""
+
+    def __init__(self, participations, heroes, episodes, compositions, weights):
+        self.participations = np.asarray(participations, dtype=np.int64)
+        self.heroes = np.asarray(heroes, dtype=np.int64)
+        self.episodes = np.asarray(episodes, dtype=np.int64)
+        self.compositions = np.asarray(compositions, dtype=np.int64)
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self._products = {}
+
+    @classmethod
+    @analytics_reads()
+    def load(cls, saga):
+        rows = list(Participation.objects.filter(episode__composition__saga=saga).values_list(
+            "pk", "hero", "episode", "episode__composition", "role_type"))
+        columns = [list(column) for column in zip(*rows)] if rows else [[]] * 5
+        return cls(*columns[:4], [_role_weight(role_type) for role_type in columns[4]])
+
+    def add(self, pk, hero, episode, composition, weight):
+        self.remove(pk)
+        self.participations = np.append(self.participations, pk)
+        self.heroes = np.append(self.heroes, hero)
+        self.episodes = np.append(self.episodes, episode)
+        self.compositions = np.append(self.compositions, composition)
+        self.weights = np.append(self.weights, weight)
+        self._products.clear()
+
+    def remove(self, pk):
+        keep = self.participations != pk
+        if not keep.all():
+            for name in ("participations", "heroes", "episodes", "compositions", "weights"):
+                setattr(self, name, getattr(self, name)[keep])
+            self._products.clear()
+
+    def cooccurrence(self, composition=None):
+        """Соучастие по всей саге или по одному произведению."""
+        key = getattr(composition, "pk", composition)
+        if key not in self._products:
+            selected = slice(None) if key is None else self.compositions == key
+            self._products[key] = self._multiply(self.heroes[selected], self.episodes[selected],
+                                                 self.weights[selected])
+        return self._products[key]
+
+    @staticmethod
+    def _multiply(heroes, episodes, weights):
+        hero_ids, h = np.unique(heroes, return_inverse=True)
+        order = np.argsort(episodes, kind="stable")
+        h, episodes, weights = h[order], episodes[order], weights[order]
+        # Группы одного эпизода: каждый элемент группы в паре с каждым.
+        starts = np.flatnonzero(np.r_[True, episodes[1:] != episodes[:-1]]) if len(episodes) else np.array([], int)
+        sizes = np.diff(np.r_[starts, len(episodes)])
+        size_of, start_of = np.repeat(sizes, sizes), np.repeat(starts, sizes)
+        left = np.repeat(np.arange(len(episodes)), size_of)
+        right = np.repeat(start_of, size_of) + np.arange(len(left)) - np.repeat(np.cumsum(size_of) - size_of, size_of)
+        rows, cols, products = h[left], h[right], weights[left] * weights[right]
+        off_diagonal = rows != cols
+        keys, inverse = np.unique(rows[off_diagonal] * len(hero_ids) + cols[off_diagonal], return_inverse=True)
+        rows, cols = np.divmod(keys, max(len(hero_ids), 1))
+        return CoOccurrence(hero_ids, rows, cols, np.bincount(inverse, weights=products[off_diagonal]))
+
+
+def hero_network(saga):
+    key = getattr(saga, "pk", saga)
+    return _networks.get(key, lambda: HeroNetwork.load(key))
+
+
+def invalidate_networks():
+    _networks.clear()
+
+
+def participation_saved(pk, hero_id, episode_id, role_type_id):
+    """Переносит сохранённое Participation в кешированные сети без их перестройки."""
+    with _networks.lock:
+        networks = _networks.loaded()
+        if not networks:
+            return
+        for network in networks.values():
+            network.remove(pk)
+        placement = Episode.objects.filter(pk=episode_id).values_list("composition", "composition__saga").first()
+        if placement is not None and placement[1] in networks:
+            networks[placement[1]].add(pk, hero_id, episode_id, placement[0], _role_weight(role_type_id))
+        _networks.accept()
+
+
+def participation_deleted(pk):
+    with _networks.lock:
+        for network in _networks.loaded().values():
+            network.remove(pk)
+        _networks.accept()
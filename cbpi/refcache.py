@@ -0,0 +1,110 @@
+"""Кеш справочников в памяти процесса.
+
+Справочники малы и нужны почти в каждом запросе, поэтому таблица целиком
+держится в словаре id → объект. В своём процессе кеш сбрасывают сигналы
+post_save/post_delete (см. signals). Изменения из других процессов видны по
+версии таблицы (versions): она сверяется одним запросом не чаще раза в
+REFERENCE_CACHE_CHECK_INTERVAL секунд. Без версий (не SQLite) кеш живёт до
+сброса сигналом. Объекты кеша общие для всего процесса — их нельзя изменять;
+сверка и загрузка идут под блокировкой (ASGI и потоки аналитики).
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.forms import ModelChoiceField
+from django.forms.models import ModelChoiceIterator
+
+from . import versions
+from .models import (ActionType, CompositionType, Country, DecisionType, FactType, RoleType, StampStatus, TableVersion,
+                     ValueDimension)
+
+REFERENCE_MODELS = (Country, StampStatus, RoleType, FactType, CompositionType, ActionType, DecisionType, ValueDimension)
+
+# модель → (версия таблицы, {pk: объект})
+_tables = {}
+_checked = 0.0
+_lock = threading.RLock()
+
+
+def _check_versions():
+    global _checked
+    if time.monotonic() - _checked < settings.REFERENCE_CACHE_CHECK_INTERVAL:
+        return
+    _checked = time.monotonic()
+    loaded = {model._meta.db_table: model for model, (version, _) in list(_tables.items()) if version is not None}
+    if not loaded:
+        return
+    current = dict(TableVersion.objects.filter(table_name__in=loaded).values_list("table_name", "version"))
+    for table, model in loaded.items():
+        if model in _tables and current.get(table, 0) != _tables[model][0]:
+            _tables.pop(model, None)
+
+
+def objects(model):
+    """{pk: объект} всего справочника в порядке pk."""
+    with _lock:
+        _check_versions()
+        if model not in _tables:
+            if model not in REFERENCE_MODELS:
+                raise ValueError(f"{model.__name__} не справочник")
+            # Версию читаем до строк: если таблица изменится между запросами,
+            # следующая сверка заметит расхождение и перечитает её.
+            table_version = versions.version(model)
+            _tables[model] = (table_version and table_version[0],
+                              {obj.pk: obj for obj in model.objects.order_by("pk")})
+        return _tables[model][1]
+
+
+def get(model, pk):
+    return objects(model).get(pk)
+
+
+def attach(instances, *fields):
+    """Подставляет объекты справочников в FK экземпляров, чтобы обращение к ним не делало запросов."""
+    fields = [instances[0]._meta.get_field(name) for name in fields] if instances else []
+    for field in fields:
+        table = objects(field.related_model)
+        for instance in instances:
+            field.set_cached_value(instance, table.get(getattr(instance, field.attname)))
+
+
+def invalidate(model=None):
+    with _lock:
+        if model is None:
+            _tables.clear()
+        else:
+            _tables.pop(model, None)
+
+
+class ReferenceChoiceIterator(ModelChoiceIterator):
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ("", self.field.empty_label)
+        for obj in objects(self.queryset.model).values():
+            yield self.choice(obj)
+
+    def __len__(self):
+        return len(objects(self.queryset.model)) + (self.field.empty_label is not None)
+
+
+class ReferenceChoiceField(ModelChoiceField):
+    """Выбор из справочника без запросов: и список, и проверка значения идут по кешу."""
+
+    iterator = ReferenceChoiceIterator
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        if isinstance(value, self.queryset.model):
+            value = value.pk
+        try:
+            obj = get(self.queryset.model, int(value))
+        except (TypeError, ValueError):
+            obj = None
+        if obj is None:
+            raise ValidationError(self.error_messages["invalid_choice"], code="invalid_choice",
+                                  params={"value": value})
+        return obj
+
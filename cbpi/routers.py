@@ -0,0 +1,39 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import DEFAULT_DB_ALIAS, connections
+
+ANALYTICS_DATABASE = "analytics"
+
+_analytics = ContextVar("analytics_reads", default=False)
+
+
+@contextmanager
+def analytics_reads():
+    """Чтения внутри блока идут через read-only соединение ANALYTICS_DATABASE.
+
+    Запись туда невозможна, а транзакции писателей соединение не блокирует
+    (WAL). Внутри открытой транзакции чтения остаются на основном соединении,
+    иначе в них не попали бы её же незакоммиченные изменения.
+    """
+    token = _analytics.set(True)
+    try:
+        yield
+    finally:
+        _analytics.reset(token)
+
+
+class AnalyticsRouter:
+    def db_for_read(self, model, **hints):
+        if _analytics.get() and not connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return ANALYTICS_DATABASE
+        return None
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != ANALYTICS_DATABASE
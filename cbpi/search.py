@@ -0,0 +1,119 @@
+"""Полнотекстовый поиск на SQLite FTS5.
+
+Для каждой модели из INDEXES есть таблица <db_table>_fts с внешним
+содержимым (content=<db_table>), которую синхронизируют триггеры базы —
+индекс остаётся верным и при bulk_create/update. Таблицы создаёт миграция
+0005_fulltext_search, а после каждого migrate install() восстанавливает
+триггеры: SQLite теряет их, когда Django пересоздаёт таблицу при
+изменении схемы. На других СУБД поиск откатывается к icontains.
+"""
+import re
+
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import Episode, Event, Fact, Hero
+
+# Модель → (заголовок, текст). Заголовок весит больше при ранжировании.
+INDEXES = {
+    Event: ("title", "description"),
+    Episode: ("title", "story_resume"),
+    Fact: ("title", "description"),
+    Hero: ("name", "description"),
+}
+TITLE_WEIGHT = 10.0
+
+
+def available():
+    return connection.vendor == "sqlite"
+
+
+def fts_table(model):
+    return f"{model._meta.db_table}_fts"
+
+
+def fts_query(text):
+    """Запрос пользователя → выражение MATCH: все слова, по префиксу."""
+    return " ".join(f'"{word}"*' for word in re.findall(r"\w+", text))
+
+
+def matching(model, text, prefix=""):
+    """Условие Q(pk__in=...) для объектов модели, найденных по тексту.
+
+    prefix — путь к модели от фильтруемого queryset, например "hero__".
+    """
+    if not available():
+        title, body = INDEXES[model]
+        condition = Q()
+        for word in text.split():
+            condition &= Q(**{f"{prefix}{title}__icontains": word}) | Q(**{f"{prefix}{body}__icontains": word})
+        return condition
+    query = fts_query(text)
+    if not query:
+        return Q(**{f"{prefix}pk__in": []})
+    table = fts_table(model)
+    return Q(**{f"{prefix}pk__in": RawSQL(f"SELECT rowid FROM {table} WHERE {table} MATCH %s", (query,))})
+
+
+def search(text, models=None, limit=20):
+    """Ранжированные результаты: список (модель, объект, ранг); меньший ранг — лучше."""
+    query = fts_query(text)
+    if not query:
+        return []
+    results = []
+    for model in models or INDEXES:
+        if available():
+            table = fts_table(model)
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"SELECT rowid, bm25({table}, %s, 1.0) AS score FROM {table} "
+                    f"WHERE {table} MATCH %s ORDER BY score LIMIT %s",
+                    (TITLE_WEIGHT, query, limit),
+                )
+                ranks = dict(cursor.fetchall())
+        else:
+            ranks = {pk: 0.0 for pk in model.objects.filter(matching(model, text)).values_list("pk", flat=True)[:limit]}
+        objects = model.objects.in_bulk(ranks)
+        results.extend((model, objects[pk], rank) for pk, rank in ranks.items() if pk in objects)
+    results.sort(key=lambda result: result[2])
+    return results[:limit]
+
+
+def install(connection=connection, rebuild=False):
+    if connection.vendor != "sqlite":
+        return
+    tables = connection.introspection.table_names()
+    with connection.cursor() as cursor:
+        for model, (title, body) in INDEXES.items():
+            table, fts = model._meta.db_table, fts_table(model)
+            if table not in tables:
+                continue
+            old = f"'delete', old.id, old.{title}, old.{body}"
+            new = f"new.id, new.{title}, new.{body}"
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({title}, {body}, "
+                f"content='{table}', content_rowid='id', tokenize='unicode61 remove_diacritics 2')")
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+                f"INSERT INTO {fts}(rowid, {title}, {body}) VALUES ({new}); END")
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+                f"INSERT INTO {fts}({fts}, rowid, {title}, {body}) VALUES ({old}); END")
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {title}, {body} ON {table} BEGIN "
+                f"INSERT INTO {fts}({fts}, rowid, {title}, {body}) VALUES ({old}); "
+                f"INSERT INTO {fts}(rowid, {title}, {body}) VALUES ({new}); END")
+            if rebuild:
+                cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def uninstall(connection=connection):
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        for model in INDEXES:
+            fts = fts_table(model)
+            for suffix in ("ai", "ad", "au"):
+                cursor.execute(f"DROP TRIGGER IF EXISTS {fts}_{suffix}")
+            cursor.execute(f"DROP TABLE IF EXISTS {fts}")
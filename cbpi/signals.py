@@ -0,0 +1,172 @@
+from django.db import connections, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import Value
+from django.db.models.functions import Concat, Substr
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import counters, documents, history, network, refcache, search, similarity, thumbnails, versions
+from .causality import invalidate_fact_graphs
+from .models import (AffectOnValue, Author, Composition, Episode, Event, EventSequence, EventSequenceClosure, Fact,
+                     FactRelation, Hero, HeroValue, Job, Participation, Place, RoleType, Saga, ValueDimension)
+
+# Поле, от которого зависят timeline_offset событий саги: аббревиатура нулевого
+# события и сага произведения (перенос меняет аббревиатуру его событий).
+TIMELINE_BASIS = {Saga: "zero_event_abbreviature", Composition: "saga_id"}
+
+
+@receiver(pre_delete, sender=Event)
+def delete_event_sequences(sender, instance, **kwargs):
+    # Рёбра удаляются до каскада, пока замыкание через событие ещё известно.
+    EventSequence.objects.filter(event_before=instance).delete()
+    EventSequence.objects.filter(event_after=instance).delete()
+
+
+@receiver(post_delete, sender=EventSequence)
+def update_closure_on_sequence_delete(sender, instance, **kwargs):
+    EventSequenceClosure.objects.remove_edge(instance.event_before_id, instance.event_after_id)
+
+
+@receiver(pre_delete, sender=Place)
+def detach_place_subtree(sender, instance, **kwargs):
+    # Дочерние места становятся корнями (parent обнуляется каскадом).
+    Place.objects.filter(Place.objects.subtree_filter(instance.path)).exclude(pk=instance.pk).update(
+        path=Concat(Value("/"), Substr("path", len(instance.path) + 1)))
+
+
+def _deleting_episodes(origin):
+    # Эпизоды удаляются каскадом только вместе с произведением: чинить его цепочку незачем.
+    return origin is None or isinstance(origin, Episode) or getattr(origin, "model", None) is Episode
+
+
+@receiver(pre_delete, sender=Episode)
+def relink_episode_chain(sender, instance, origin=None, **kwargs):
+    # Иначе SET_NULL сделает следующий эпизод вторым началом цепочки.
+    if _deleting_episodes(origin):
+        Episode.objects.filter(previous_episode=instance).update(previous_episode=instance.previous_episode_id)
+
+
+@receiver(post_delete, sender=Episode)
+def renumber_episodes_on_delete(sender, instance, origin=None, **kwargs):
+    if _deleting_episodes(origin):
+        Episode.objects.renumber(instance.composition_id)
+
+
+@receiver([post_save, post_delete], sender=FactRelation)
+@receiver([post_save, post_delete], sender=Fact)
+@receiver([post_save, post_delete], sender=AffectOnValue)
+def reset_fact_graphs(sender, **kwargs):
+    # Сбрасываем сразу и ещё раз после коммита: граф мог быть построен
+    # другим потоком по данным до коммита.
+    invalidate_fact_graphs()
+    transaction.on_commit(invalidate_fact_graphs)
+
+
+@receiver(post_save, sender=Participation)
+def update_hero_networks(sender, instance, **kwargs):
+    # Правим сеть после коммита: откат не должен попасть в кеш.
+    values = (instance.pk, instance.hero_id, instance.episode_id, instance.role_type_id)
+    transaction.on_commit(lambda: network.participation_saved(*values))
+
+
+@receiver(post_delete, sender=Participation)
+def remove_from_hero_networks(sender, instance, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: network.participation_deleted(pk))
+
+
+@receiver([post_save, post_delete], sender=Episode)
+@receiver([post_save, post_delete], sender=RoleType)
+@receiver([post_save, post_delete], sender=Composition)
+def reset_hero_networks(sender, **kwargs):
+    network.invalidate_networks()
+    transaction.on_commit(network.invalidate_networks)
+
+
+@receiver([post_save, post_delete], sender=HeroValue)
+def refresh_value_index(sender, instance, **kwargs):
+    hero_id = instance.hero_id
+    transaction.on_commit(lambda: similarity.refresh_hero(hero_id))
+
+
+@receiver([post_save, post_delete], sender=Hero)
+def refresh_value_index_hero(sender, instance, **kwargs):
+    # Сага героя — фильтр поиска, удалённый герой уходит из индекса.
+    hero_id = instance.pk
+    transaction.on_commit(lambda: similarity.refresh_hero(hero_id))
+
+
+@receiver([post_save, post_delete], sender=ValueDimension)
+@receiver([post_save, post_delete], sender=Saga)
+def reset_value_index(sender, **kwargs):
+    similarity.invalidate_index()
+    transaction.on_commit(similarity.invalidate_index)
+
+
+@receiver([post_save, post_delete])
+def mark_saga_documents(sender, instance, **kwargs):
+    if sender in documents.TRACKED:
+        documents.row_changed(instance)
+
+
+@receiver([post_save, post_delete])
+def reset_reference_cache(sender, **kwargs):
+    if sender in refcache.REFERENCE_MODELS:
+        refcache.invalidate(sender)
+        transaction.on_commit(lambda: refcache.invalidate(sender))
+
+
+def _schema_is_current(connection):
+    executor = MigrationExecutor(connection)
+    return not executor.migration_plan(executor.loader.graph.leaf_nodes())
+
+
+@receiver(post_migrate)
+def restore_triggers(sender, using, **kwargs):
+    # После отката к старой миграции текущие триггеры сослались бы на ещё не созданные колонки.
+    if sender.name == "cbpi" and _schema_is_current(connections[using]):
+        search.install(connections[using])
+        versions.install(connections[using])
+        counters.install(connections[using])
+        history.install(connections[using])
+
+
+@receiver(pre_save, sender=Saga)
+@receiver(pre_save, sender=Composition)
+def remember_timeline_basis(sender, instance, **kwargs):
+    field = TIMELINE_BASIS[sender]
+    update_fields = kwargs.get("update_fields")
+    if instance._state.adding or (update_fields is not None and field.removesuffix("_id") not in update_fields):
+        return
+    instance._timeline_basis = sender.objects.filter(pk=instance.pk).values_list(field, flat=True).first()
+
+
+@receiver(post_save, sender=Saga)
+@receiver(post_save, sender=Composition)
+def enqueue_timeline(sender, instance, **kwargs):
+    # Смещения пересчитывает задача timeline: у саги могут быть тысячи событий.
+    if not hasattr(instance, "_timeline_basis"):
+        return
+    previous = instance._timeline_basis
+    del instance._timeline_basis
+    if previous != getattr(instance, TIMELINE_BASIS[sender]):
+        saga_id = instance.pk if sender is Saga else instance.saga_id
+        transaction.on_commit(lambda: Job.objects.enqueue("timeline", saga_id))
+
+
+@receiver(pre_save, sender=Author)
+@receiver(pre_save, sender=Hero)
+def hash_photo(sender, instance, **kwargs):
+    photo = instance.photo_file
+    if not photo:
+        instance.photo_hash = ""
+    elif not photo._committed:
+        instance.photo_hash = thumbnails.file_hash(photo)
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=Hero)
+def schedule_thumbnails(sender, instance, **kwargs):
+    if instance.photo_hash:
+        photo, photo_hash = instance.photo_file, instance.photo_hash
+        transaction.on_commit(lambda: thumbnails.schedule(photo, photo_hash))
@@ -0,0 +1,159 @@
+"""Поиск героев с похожими ценностями.
+
+Индекс держит в памяти процесса последний вектор ценностей каждого героя —
+строку float32 по всем ValueDimension (нет записи — 0) — и заранее
+нормированные строки для косинусной меры. Запрос — одно умножение матрицы на
+вектор и argpartition, без обращений к базе. Последней считается запись с
+наибольшим timeline_offset события (без события — начало саги), при равенстве —
+с большим id, как в analytics.value_trajectories.
+
+Сигналы HeroValue и Hero пересчитывают на месте строку одного героя (см.
+signals), изменения ValueDimension и Saga сбрасывают индекс целиком. Записи
+других процессов и bulk-операции видны по версиям HeroValue, Hero, Saga и
+ValueDimension (versions.VersionedCache). Событий среди них нет: новый
+timeline_offset триггер history переписывает в as_of записей HeroValue этого
+события, и версия HeroValue растёт сама; задача timeline ещё и сбрасывает индекс.
+"""
+import numpy as np
+
+from . import refcache
+from .models import Hero, HeroValue, Saga, ValueDimension
+from .routers import analytics_reads
+from .versions import VersionedCache
+
+METRICS = ("cosine", "euclidean")
+
+_index = VersionedCache(HeroValue, Hero, Saga, ValueDimension)
+
+
+def _latest(hero, dimension, weight, offset, pk, hero_ids, dimension_ids):
+    """Матрица герой × ценность из последних записей HeroValue."""
+    vectors = np.zeros((len(hero_ids), len(dimension_ids)), dtype=np.float32)
+    if not len(hero):
+        return vectors
+    h = np.searchsorted(hero_ids, hero)
+    d = np.searchsorted(dimension_ids, dimension).clip(max=max(len(dimension_ids) - 1, 0))
+    known = dimension_ids[d] == np.asarray(dimension) if len(dimension_ids) else np.zeros(len(d), dtype=bool)
+    offset = np.array([-np.inf if value is None else value for value in offset])
+    order = np.lexsort((np.asarray(pk), offset, d, h))
+    h, d, known = h[order], d[order], known[order]
+    last = np.ones(len(order), dtype=bool)
+    last[:-1] = (h[1:] != h[:-1]) | (d[1:] != d[:-1])
+    last &= known
+    vectors[h[last], d[last]] = np.asarray(weight, dtype=np.float32)[order][last]
+    return vectors
+
+
+def _rows(heroes):
+    return list(HeroValue.objects.filter(hero__in=heroes).values_list(
+        "hero", "value_dimension", "weight", "event_after__timeline_offset", "pk"))
+
+
+class ValueIndex:
+    def __init__(self, hero_ids, sagas, universes, dimension_ids, vectors):
+        self.hero_ids = hero_ids
+        self.sagas = sagas
+        self.universes = universes
+        self.dimension_ids = dimension_ids
+        self.vectors = vectors
+        self._normalize()
+
+    @classmethod
+    @analytics_reads()
+    def load(cls):
+        heroes = Hero.objects.filter(pk__in=HeroValue.objects.values("hero")).order_by("pk")
+        columns = list(zip(*heroes.values_list("pk", "saga", "saga__universe_of_events"))) or [[]] * 3
+        hero_ids, sagas, universes = (
+            np.array([-1 if value is None else value for value in column], dtype=np.int64) for column in columns)
+        dimension_ids = np.fromiter(refcache.objects(ValueDimension), dtype=np.int64)
+        columns = list(zip(*_rows(heroes))) or [[]] * 5
+        return cls(hero_ids, sagas, universes, dimension_ids, _latest(*columns, hero_ids, dimension_ids))
+
+    def _normalize(self):
+        norms = np.linalg.norm(self.vectors, axis=1, keepdims=True)
+        self.unit = np.divide(self.vectors, norms, out=np.zeros_like(self.vectors), where=norms > 0)
+
+    def _position(self, hero_id):
+        position = int(np.searchsorted(self.hero_ids, hero_id))
+        if position < len(self.hero_ids) and self.hero_ids[position] == hero_id:
+            return position
+        return None
+
+    def vector(self, hero_id):
+        """{id ценности: вес} героя или None, если героя нет в индексе."""
+        position = self._position(hero_id)
+        if position is None:
+            return None
+        return dict(zip(self.dimension_ids.tolist(), self.vectors[position].tolist()))
+
+    def similar(self, hero_id, k=10, metric="cosine", saga=None, universe=None):
+        """k ближайших героев: [(id, сходство)] для cosine, [(id, расстояние)] для euclidean."""
+        if metric not in METRICS:
+            raise ValueError(f"неизвестная мера {metric!r}")
+        position = self._position(hero_id)
+        if position is None:
+            return []
+        candidates = self.hero_ids != hero_id
+        if saga is not None:
+            candidates &= self.sagas == int(saga)
+        if universe is not None:
+            candidates &= self.universes == int(universe)
+        candidates = np.flatnonzero(candidates)
+        if metric == "cosine":
+            scores = -(self.unit[candidates] @ self.unit[position])
+        else:
+            scores = np.linalg.norm(self.vectors[candidates] - self.vectors[position], axis=1)
+        k = min(k, len(candidates))
+        if not k:
+            return []
+        best = np.argpartition(scores, k - 1)[:k]
+        best = best[np.lexsort((self.hero_ids[candidates[best]], scores[best]))]
+        signed = -scores[best] if metric == "cosine" else scores[best]
+        return [(int(h), float(s)) for h, s in zip(self.hero_ids[candidates[best]], signed)]
+
+    def remove(self, hero_id):
+        position = self._position(hero_id)
+        if position is not None:
+            for name in ("hero_ids", "sagas", "universes", "vectors", "unit"):
+                setattr(self, name, np.delete(getattr(self, name), position, axis=0))
+
+    def update(self, hero_id, saga, universe, vector):
+        """Заменяет (или добавляет) строку героя; vector — по dimension_ids."""
+        position = self._position(hero_id)
+        if position is None:
+            position = int(np.searchsorted(self.hero_ids, hero_id))
+            self.hero_ids = np.insert(self.hero_ids, position, hero_id)
+            self.sagas = np.insert(self.sagas, position, -1 if saga is None else saga)
+            self.universes = np.insert(self.universes, position, -1 if universe is None else universe)
+            self.vectors = np.insert(self.vectors, position, vector, axis=0)
+            self.unit = np.insert(self.unit, position, 0, axis=0)
+        else:
+            self.sagas[position] = -1 if saga is None else saga
+            self.universes[position] = -1 if universe is None else universe
+            self.vectors[position] = vector
+        norm = np.linalg.norm(vector)
+        self.unit[position] = vector / norm if norm > 0 else 0
+
+
+def value_index():
+    return _index.get(None, ValueIndex.load)
+
+
+def invalidate_index():
+    _index.clear()
+
+
+def refresh_hero(hero_id):
+    """Пересчитывает строку героя в загруженном индексе двумя запросами."""
+    with _index.lock:
+        index = _index.loaded().get(None)
+        if index is None:
+            return
+        hero = Hero.objects.filter(pk=hero_id).values_list("saga", "saga__universe_of_events").first()
+        rows = _rows([hero_id]) if hero is not None else []
+        if not rows:
+            index.remove(hero_id)
+        else:
+            vectors = _latest(*zip(*rows), np.array([hero_id]), index.dimension_ids)
+            index.update(hero_id, *hero, vectors[0])
+        _index.accept()
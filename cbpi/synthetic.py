@@ -0,0 +1,273 @@
+"""Синтетические вселенные для нагрузочных замеров.
+
+Генератор строит вселенную заданного масштаба (SCALE): дерево мест глубины
+place_depth, саги с произведениями, события на шкале саги, цепочки эпизодов,
+ациклические графы EventSequence и FactRelation внутри произведения, героев с
+неравномерной популярностью (несколько героев появляются почти везде), их
+участие, ценности и оценки поступков. Случайность задаётся seed: один и тот же
+seed даёт те же данные.
+
+Строки пишутся bulk_create по сагам, каждая сага — своя транзакция. Сигналы
+при этом не шлются, поэтому производное заполняется сразу: пути мест,
+позиции эпизодов, timeline_offset и замыкание EventSequence (внутри
+произведения — все пары событий, то есть events² / 2 строк на произведение).
+Счётчики, версии таблиц, as_of и полнотекстовый индекс ведут триггеры базы;
+на других СУБД счётчики и версии пересчитываются в конце.
+"""
+import datetime
+from collections import Counter
+
+import numpy as np
+from django.db import connection, transaction
+
+from . import causality, counters, network, refcache, similarity, versions
+from .models import (ActionType, AffectOnValue, Author, Composition, CompositionType, DecisionEvaluation, Episode,
+                     Event, EventSequence, EventSequenceClosure, Fact, FactRelation, FactType, Hero, HeroAction,
+                     HeroValue, Participation, Place, RoleType, Saga, Universe, ValueDimension)
+from .timeline import event_offset
+
+# Параметр → (значение по умолчанию, описание). Числа — на сагу, произведение или героя.
+SCALE = {
+    "sagas": (2, "Саг во вселенной"),
+    "compositions": (5, "Произведений в саге"),
+    "events": (200, "Событий в произведении"),
+    "episodes": (50, "Эпизодов в цепочке произведения"),
+    "heroes": (100, "Героев в саге"),
+    "cast": (5, "Наибольшее число героев в эпизоде"),
+    "place_depth": (5, "Глубина дерева мест"),
+    "place_fanout": (3, "Дочерних мест у каждого места"),
+    "sequence_density": (2, "Дополнительных рёбер EventSequence на событие"),
+    "facts": (50, "Фактов в произведении"),
+    "fact_density": (2, "Рёбер FactRelation на факт"),
+    "values": (10, "Записей HeroValue на героя"),
+    "evaluations": (10, "Оценок DecisionEvaluation на героя"),
+    "dimensions": (8, "Ценностей (ValueDimension)"),
+}
+ABBREVIATURE = "НС"
+# Рёбра графов ведут вперёд не дальше чем на WINDOW позиций: графы ацикличны.
+WINDOW = 10
+ROLES = (("Главная роль", 1.0, 0.2), ("Второстепенная роль", 0.5, 0.3), ("Эпизодическая роль", 0.25, 0.5))
+WORDS = ("битва", "совет", "дорога", "замок", "море", "пророчество", "предательство", "союз", "буря", "изгнание",
+         "клятва", "город", "лес", "король", "восстание", "странник")
+
+
+class UniverseGenerator:
+    def __init__(self, seed=0, batch_size=5000, on_progress=None, **scale):
+        unknown = set(scale) - set(SCALE)
+        if unknown:
+            raise TypeError(f"неизвестные параметры масштаба: {', '.join(sorted(unknown))}")
+        self.scale = {name: scale.get(name, default) for name, (default, _) in SCALE.items()}
+        self.seed = seed
+        self.batch_size = batch_size
+        self.on_progress = on_progress
+        self.rng = np.random.default_rng(seed)
+        self.created = Counter()
+        self.sagas_done = 0
+
+    def run(self):
+        with transaction.atomic():
+            self._references()
+            self._places()
+        for number in range(self.scale["sagas"]):
+            with transaction.atomic():
+                self._saga(number)
+            self.sagas_done += 1
+            if self.on_progress:
+                self.on_progress(self)
+        if connection.vendor != "sqlite":
+            counters.repair()
+        versions.recount()
+        # Bulk-операции не шлют сигналов: кеши процесса сбрасываются вручную.
+        refcache.invalidate()
+        causality.invalidate_fact_graphs()
+        network.invalidate_networks()
+        similarity.invalidate_index()
+        return self.universe
+
+    def _create(self, model, instances):
+        model.objects.bulk_create(instances, batch_size=self.batch_size)
+        self.created[model.__name__] += len(instances)
+        return np.array([instance.pk for instance in instances], dtype=np.int64)
+
+    def _text(self, words=8):
+        return " ".join(self.rng.choice(WORDS, words))
+
+    def _forward_edges(self, size, density, minimum):
+        """Пары (i, j), minimum <= j - i < minimum + WINDOW, без повторов."""
+        before = np.repeat(np.arange(size), density)
+        after = before + minimum + self.rng.integers(0, WINDOW, len(before))
+        keys = np.unique(before[after < size] * size + after[after < size])
+        return np.divmod(keys, max(size, 1))
+
+    def _references(self):
+        self.universe = Universe.objects.create(name=f"Синтетическая вселенная (seed {self.seed})")
+        self.author = Author.objects.create(name=f"Синтетический автор (seed {self.seed})")
+        self.composition_type = CompositionType.objects.create(title="Синтетическое произведение")
+        self.action_type = ActionType.objects.create(title="Синтетическое действие")
+        self.role_types = self._create(RoleType, [RoleType(name=name, weight=weight) for name, weight, _ in ROLES])
+        self.role_share = np.array([share for _, _, share in ROLES])
+        self.dimension_ids = self._create(ValueDimension, [
+            ValueDimension(title=f"Ценность {number + 1}") for number in range(self.scale["dimensions"])])
+        fact_types = [FactType(title=f"Тип факта {number + 1}", is_numerical=not number % 2,
+                               measure="" if number % 2 else "ед.") for number in range(4)]
+        self.fact_type_ids = self._create(FactType, fact_types)
+        self.numerical = {fact_type.pk: fact_type.is_numerical for fact_type in fact_types}
+        if len(self.dimension_ids):
+            self._create(AffectOnValue, [
+                AffectOnValue(fact_type_id=fact_type, value_dimension_id=dimension,
+                              weight=round(float(self.rng.uniform(-1, 1)), 3))
+                for fact_type in self.fact_type_ids.tolist()
+                for dimension in self.rng.choice(self.dimension_ids, min(2, len(self.dimension_ids)),
+                                                 replace=False).tolist()])
+
+    def _places(self):
+        root = Place.objects.create(name=f"Мир (seed {self.seed})")
+        self.created["Place"] += 1
+        level = {root.pk: root.path}
+        for depth in range(1, self.scale["place_depth"] + 1):
+            places = [Place(name=f"Место {depth}.{number + 1}", parent_id=parent, description=self._text(4))
+                      for number, parent in enumerate(np.repeat(list(level), self.scale["place_fanout"]).tolist())]
+            self._create(Place, places)
+            for place in places:
+                place.path = f"{level[place.parent_id]}{place.pk}/"
+            Place.objects.bulk_update(places, ["path"], batch_size=self.batch_size)
+            level = {place.pk: place.path for place in places}
+        # События происходят в листьях дерева.
+        self.leaves = np.array(list(level), dtype=np.int64)
+
+    def _saga(self, number):
+        scale = self.scale
+        saga = Saga.objects.create(
+            name=f"Синтетическая сага {number + 1}", universe_of_events=self.universe, author=self.author,
+            zero_event_abbreviature=ABBREVIATURE, date_first_published=datetime.date(1950 + number % 70, 1, 1))
+        compositions = [Composition(saga=saga, title=f"Том {index + 1}", composition_type=self.composition_type,
+                                    date_published=datetime.date(1950 + number % 70 + index // 12, index % 12 + 1, 1))
+                        for index in range(scale["compositions"])]
+        self._create(Composition, compositions)
+        events, episodes = [], []
+        for index, composition in enumerate(compositions):
+            events.append(self._events(composition, index))
+            episodes.append(self._episodes(composition, events[-1]))
+            self._facts(composition, events[-1])
+        empty = np.array([], dtype=np.int64)
+        self._heroes(saga, number, np.concatenate(events) if events else empty,
+                     np.concatenate(episodes) if episodes else empty)
+
+    def _events(self, composition, index):
+        size = self.scale["events"]
+        # Нулевое событие саги — середина первого произведения, остальные идут по году.
+        offsets = index * size + np.arange(size) - size // 2
+        events = []
+        for position, offset in enumerate(offsets.tolist()):
+            zero = offset == 0
+            text = "0" if zero else f"{-offset} до {ABBREVIATURE}" if offset < 0 else f"{offset} {ABBREVIATURE}"
+            events.append(Event(
+                title=f"Событие {index + 1}.{position + 1}", description=self._text(), zero_event_flag=zero,
+                date_time_from_zero_event=text, composition=composition, cm_position=f"гл. {position // 10 + 1}",
+                place_id=int(self.rng.choice(self.leaves)) if len(self.leaves) else None,
+                timeline_offset=event_offset(text, zero, ABBREVIATURE)))
+        event_ids = self._create(Event, events)
+        ids = event_ids.tolist()
+
+        before, after = self._forward_edges(size, self.scale["sequence_density"], 2)
+        chain = np.arange(size - 1)
+        self._create(EventSequence, [
+            EventSequence(event_before_id=ids[a], event_after_id=ids[b], straight=straight)
+            for edges, straight in (((chain, chain + 1), True), ((before, after), False))
+            for a, b in zip(*(column.tolist() for column in edges))])
+        # Рёбра ведут только вперёд, поэтому достижимость считается одним проходом с конца.
+        successors = [[] for _ in range(size)]
+        for a, b in zip(np.r_[chain, before].tolist(), np.r_[chain + 1, after].tolist()):
+            successors[a].append(b)
+        reach = [set() for _ in range(size)]
+        for node in reversed(range(size)):
+            for successor in successors[node]:
+                reach[node].add(successor)
+                reach[node] |= reach[successor]
+        self._create(EventSequenceClosure, [
+            EventSequenceClosure(event_before_id=ids[node], event_after_id=ids[later])
+            for node in range(size) for later in sorted(reach[node])])
+        return event_ids
+
+    def _episodes(self, composition, event_ids):
+        size = self.scale["episodes"]
+        starts = event_ids[np.linspace(0, len(event_ids) - 1, size).astype(int)] if len(event_ids) else [None] * size
+        episodes = [Episode(composition=composition, title=f"Эпизод {composition.title}.{position + 1}",
+                            story_resume=self._text(12), start_event_id=start, position=position)
+                    for position, start in enumerate(np.asarray(starts).tolist())]
+        self._create(Episode, episodes)
+        for previous, episode in zip(episodes, episodes[1:]):
+            episode.previous_episode_id = previous.pk
+        Episode.objects.bulk_update(episodes[1:], ["previous_episode"], batch_size=self.batch_size)
+        return np.array([episode.pk for episode in episodes], dtype=np.int64)
+
+    def _facts(self, composition, event_ids):
+        size = self.scale["facts"]
+        types = self.rng.choice(self.fact_type_ids, size).tolist()
+        results = self.rng.choice(event_ids, size).tolist() if len(event_ids) else [None] * size
+        facts = [Fact(composition=composition, title=f"Факт {composition.title}.{position + 1}",
+                      description=self._text(), fact_type_id=fact_type, result_of_event_id=result,
+                      numeric_value=round(float(self.rng.uniform(-10, 10)), 2) if self.numerical[fact_type] else None)
+                 for position, (fact_type, result) in enumerate(zip(types, results))]
+        fact_ids = self._create(Fact, facts).tolist()
+        before, after = self._forward_edges(size, self.scale["fact_density"], 1)
+        linked = self.rng.random(len(before)) < 0.3
+        self._create(FactRelation, [
+            FactRelation(based_fact_id=fact_ids[a], followed_fact_id=fact_ids[b],
+                         event_relation_id=int(self.rng.choice(event_ids)) if link and len(event_ids) else None)
+            for a, b, link in zip(before.tolist(), after.tolist(), linked.tolist())])
+
+    def _heroes(self, saga, number, saga_events, episode_ids):
+        scale, rng = self.scale, self.rng
+        size = scale["heroes"]
+        if not size:
+            return
+
+        def events(count):
+            if not len(saga_events):
+                return [None] * count
+            return rng.choice(saga_events, count).tolist()
+
+        births = events(size)
+        hero_ids = self._create(Hero, [
+            Hero(name=f"Герой {number + 1}.{index + 1}", description=self._text(), saga=saga, birth_event_id=birth)
+            for index, birth in enumerate(births)])
+
+        # Популярность по закону Ципфа: первые герои есть почти в каждом эпизоде.
+        popularity = 1 / np.arange(1, size + 1)
+        popularity /= popularity.sum()
+        participations = []
+        for episode in episode_ids.tolist() if scale["cast"] else ():
+            cast = rng.choice(hero_ids, min(int(rng.integers(1, scale["cast"] + 1)), size), replace=False,
+                              p=popularity)
+            roles = rng.choice(self.role_types, len(cast), p=self.role_share)
+            participations.extend(Participation(hero_id=hero, episode_id=episode, role_type_id=role)
+                                  for hero, role in zip(cast.tolist(), roles.tolist()))
+        self._create(Participation, participations)
+
+        if scale["values"] and len(self.dimension_ids):
+            count = size * scale["values"]
+            timeless = rng.random(count) < 0.1
+            self._create(HeroValue, [
+                HeroValue(hero_id=hero, value_dimension_id=dimension, weight=round(weight, 3),
+                          event_after_id=None if none else event)
+                for hero, dimension, weight, event, none in zip(
+                    np.repeat(hero_ids, scale["values"]).tolist(), rng.choice(self.dimension_ids, count).tolist(),
+                    rng.uniform(-1, 1, count).tolist(), events(count), timeless.tolist())])
+
+        if scale["evaluations"]:
+            per_hero = max(1, scale["evaluations"] // 2)
+            action_ids = self._create(HeroAction, [
+                HeroAction(hero_id=hero, action_type=self.action_type, cause_event_id=event)
+                for hero, event in zip(np.repeat(hero_ids, per_hero).tolist(), events(size * per_hero))])
+            count = size * scale["evaluations"]
+            heroes = np.repeat(np.arange(size), scale["evaluations"])
+            actions = action_ids.reshape(size, per_hero)[heroes, rng.integers(0, per_hero, count)]
+            dimensions = (rng.choice(self.dimension_ids, count).tolist() if len(self.dimension_ids)
+                          else [None] * count)
+            self._create(DecisionEvaluation, [
+                DecisionEvaluation(hero_was_evaluated_id=hero, eval_for_ha_id=action, event_after_id=event,
+                                   affects_on_vd_id=dimension, weight=round(weight, 3))
+                for hero, action, event, dimension, weight in zip(
+                    hero_ids[heroes].tolist(), actions.tolist(), events(count), dimensions,
+                    rng.uniform(-1, 1, count).tolist())])
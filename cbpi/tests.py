@@ -1,3 +1,1563 @@
-from django.test import TestCase
+import datetime
+import gzip
+import json
+import tempfile
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock, skipUnless
+from unittest.mock import ANY
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connections
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+import numpy as np
+from numpy.testing import assert_allclose
+from PIL import Image
+
+from . import (api, benchmarks, counters, documents, exporter, history, jobs, network, refcache, similarity,
+               thumbnails, versions)
+from .analytics import value_trajectories
+from .causality import fact_graph, invalidate_fact_graphs
+from .exporter import EXPORTS, SagaExporter
+from .importer import SagaImporter, read_jsonl
+from .routers import analytics_reads
+from .search import search
+from .timeline import parse_offset
+from .models import *
+
+
+def make_universe(rows=3):
+    """Небольшой связанный набор данных: по `rows` записей каждой модели."""
+    universe = Universe.objects.create(name="Вселенная")
+    country = Country.objects.create(name="Страна")
+    auth_user = get_user_model().objects.create_user(username="reader")
+    user = User.objects.create(user=auth_user, native_language="ru", country=country)
+    status = StampStatus.objects.create(name="Статус")
+    stamp = UserStamp.objects.create(user=user, datetime=timezone.now(), status=status)
+    gla = GlobalActorList.objects.create(
+        nickname="actor", date_of_registration=datetime.date(2020, 1, 1), registered_by_user=user)
+    author = Author.objects.create(name="Автор", country_of_birth=country, gla=gla)
+    composition_type = CompositionType.objects.create(title="Роман")
+    saga = Saga.objects.create(
+        name="Сага", universe_of_events=universe, country_first_published=country,
+        author=author, user_stamp=stamp)
+    role_type = RoleType.objects.create(name="Главная роль")
+    value_dimension = ValueDimension.objects.create(title="Честь", user_stamp=stamp)
+    fact_type = FactType.objects.create(title="Потери", is_numerical=True)
+    AffectOnValue.objects.create(value_dimension=value_dimension, fact_type=fact_type, weight=0.5)
+    decision_type = DecisionType.objects.create(title="Выбор", user_stamp=stamp)
+    action_type = ActionType.objects.create(title="Поступок", user_stamp=stamp)
+
+    parent, previous_event, previous_episode, previous_fact = None, None, None, None
+    for i in range(rows):
+        place = Place.objects.create(name=f"Место {i}", parent=parent)
+        composition = Composition.objects.create(
+            saga=saga, title=f"Книга {i}", composition_type=composition_type)
+        event = Event.objects.create(
+            title=f"Событие {i}", place=place, composition=composition, user_stamp=stamp)
+        if previous_event is not None:
+            EventSequence.objects.create(event_before=previous_event, event_after=event)
+        hero = Hero.objects.create(
+            name=f"Герой {i}", saga=saga, birth_event=event, user_stamp=stamp, gla=gla)
+        episode = Episode.objects.create(
+            composition=composition, title=f"Эпизод {i}", story_resume="...",
+            start_event=event, previous_episode=previous_episode, user_stamp=stamp)
+        participation = Participation.objects.create(hero=hero, episode=episode, role_type=role_type)
+        HeroValue.objects.create(hero=hero, value_dimension=value_dimension, weight=0.1, event_after=event)
+        decision = Decision.objects.create(decision_type=decision_type, hero=hero, event_after=event)
+        action = HeroAction.objects.create(
+            hero=hero, action_type=action_type, based_on_decision=decision,
+            cause_event=event, in_role=participation)
+        DecisionEvaluation.objects.create(
+            hero_was_evaluated=hero, eval_for_ha=action, gla_evaluator=gla,
+            event_after=event, affects_on_vd=value_dimension, weight=0.2)
+        fact = Fact.objects.create(
+            composition=composition, title=f"Факт {i}", fact_type=fact_type,
+            numeric_value=i, result_of_event=event)
+        if previous_fact is not None:
+            FactRelation.objects.create(based_fact=previous_fact, followed_fact=fact, event_relation=event)
+        parent, previous_event, previous_episode, previous_fact = place, event, episode, fact
+    return saga
+
+
+@override_settings(REFERENCE_CACHE_CHECK_INTERVAL=3600)
+class ChangelistQueriesTest(TestCase):
+    # Число запросов на страницу списка не должно зависеть от числа строк:
+    # сессия, пользователь, count(*) с фильтрами и без, сама выборка и
+    # по одному запросу на каждый FK-фильтр в боковой панели, кроме фильтров
+    # по справочникам — они берутся из кеша.
+    expected_queries = {
+        Universe: 5,
+        Country: 5,
+        GlobalActorList: 5,
+        User: 5,
+        StampStatus: 5,
+        UserStamp: 4,
+        Author: 5,
+        CompositionType: 5,
+        Saga: 6,
+        Place: 5,
+        Composition: 5,
+        Event: 5,
+        Hero: 6,
+        Episode: 6,
+        RoleType: 5,
+        Participation: 4,
+        ValueDimension: 5,
+        FactType: 5,
+        Fact: 5,
+        AffectOnValue: 5,
+        HeroValue: 4,
+        DecisionType: 5,
+        Decision: 5,
+        ActionType: 5,
+        HeroAction: 5,
+        DecisionEvaluation: 5,
+        EventSequence: 5,
+        FactRelation: 5,
+        Job: 5,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        make_universe(rows=10)
+        cls.superuser = get_user_model().objects.create_superuser("admin", "admin@example.com", "admin")
+
+    def setUp(self):
+        self.client.force_login(self.superuser)
+        for model in refcache.REFERENCE_MODELS:
+            refcache.objects(model)
+
+    def test_every_changelist_is_covered(self):
+        registered = {model for model in admin.site._registry if model._meta.app_label == "cbpi"}
+        self.assertEqual(registered, set(self.expected_queries))
+
+    def test_changelist_query_count(self):
+        for model, queries in self.expected_queries.items():
+            url = reverse(f"admin:cbpi_{model._meta.model_name}_changelist")
+            with self.subTest(model=model.__name__), self.assertNumQueries(queries):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+
+
+class EstimatedCountTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.saga = make_universe(rows=3)
+        cls.superuser = get_user_model().objects.create_superuser("admin", "admin@example.com", "admin")
+
+    def test_row_count_follows_writes(self):
+        self.assertEqual(versions.row_count(Event), 3)
+        Event.objects.filter(title="Событие 1").delete()
+        composition = Composition.objects.first()
+        Event.objects.bulk_create([Event(title=f"Новое {i}", composition=composition) for i in range(5)])
+        self.assertEqual(versions.row_count(Event), Event.objects.count())
+        self.assertIsNone(versions.row_count(Author))
+
+    def test_unfiltered_changelist_skips_count(self):
+        self.client.force_login(self.superuser)
+        with CaptureQueriesContext(connections["default"]) as queries:
+            response = self.client.get(reverse("admin:cbpi_event_changelist"))
+        self.assertEqual(response.context["cl"].result_count, 3)
+        self.assertFalse([q["sql"] for q in queries if "COUNT(*)" in q["sql"]])
+
+    @override_settings(ADMIN_COUNT_LIMIT=2)
+    def test_filtered_count_is_capped(self):
+        self.client.force_login(self.superuser)
+        response = self.client.get(reverse("admin:cbpi_event_changelist"), {"zero_event_flag__exact": "0"})
+        self.assertEqual(response.context["cl"].result_count, 2)
+
+
+class CountersTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.saga = make_universe(rows=3)
+
+    def counts(self, model, field):
+        return list(model.objects.order_by("pk").values_list(field, flat=True))
+
+    def test_counters_follow_child_rows(self):
+        self.saga.refresh_from_db()
+        self.assertEqual(self.saga.composition_count, 3)
+        self.assertEqual(self.counts(Hero, "participation_count"), [1, 1, 1])
+        self.assertEqual(self.counts(HeroAction, "evaluation_count"), [1, 1, 1])
+
+        first, second, _ = Composition.objects.order_by("pk")
+        Episode.objects.filter(composition=first).update(composition=second)
+        self.assertEqual(self.counts(Composition, "episode_count"), [0, 2, 1])
+        Participation.objects.bulk_create(
+            [Participation(hero=Hero.objects.first(), episode=Episode.objects.first()) for _ in range(2)])
+        self.assertEqual(self.counts(Hero, "participation_count"), [3, 1, 1])
+        HeroAction.objects.filter(hero=Hero.objects.last()).delete()
+        self.assertEqual(self.counts(Hero, "action_count"), [1, 1, 0])
+
+    def test_stale_instance_does_not_overwrite_counter(self):
+        hero = Hero.objects.first()
+        Participation.objects.create(hero=hero, episode=Episode.objects.first())
+        hero.name = "Переименован"
+        hero.save()
+        hero.refresh_from_db()
+        self.assertEqual((hero.name, hero.participation_count), ("Переименован", 2))
+
+    def test_repair_command(self):
+        Saga.objects.update(composition_count=42)
+        Hero.objects.update(action_count=0)
+        out = StringIO()
+        call_command("repair_counters", stdout=out)
+        self.assertIn("Saga.composition_count: исправлено строк 1", out.getvalue())
+        self.assertIn("Исправлено всего: 4", out.getvalue())
+        self.assertEqual(self.counts(Saga, "composition_count"), [3])
+        self.assertFalse(any(counters.repair().values()))
+
+
+@override_settings(REFERENCE_CACHE_CHECK_INTERVAL=3600)
+class ReferenceCacheTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        make_universe(rows=3)
+        cls.superuser = get_user_model().objects.create_superuser("admin", "admin@example.com", "admin")
+
+    def setUp(self):
+        refcache.invalidate()
+
+    def test_lookups_after_warmup_are_free(self):
+        role_type = RoleType.objects.get()
+        refcache.get(RoleType, role_type.pk)
+        participations = list(Participation.objects.all())
+        with self.assertNumQueries(0):
+            self.assertEqual(refcache.get(RoleType, role_type.pk).name, "Главная роль")
+            refcache.attach(participations, "role_type")
+            self.assertEqual({p.role_type.name for p in participations}, {"Главная роль"})
+
+    def test_signals_invalidate(self):
+        refcache.objects(RoleType)
+        role_type = RoleType.objects.create(name="Эпизодическая роль")
+        self.assertEqual(refcache.get(RoleType, role_type.pk), role_type)
+        role_type.delete()
+        self.assertIsNone(refcache.get(RoleType, role_type.pk))
+
+    def test_other_process_changes_seen_by_version(self):
+        refcache.objects(Country)
+        # Как будто страну переименовал другой процесс: сигналов нет, версия растёт триггером.
+        Country.objects.update(name="Другая страна")
+        self.assertEqual(refcache.get(Country, Country.objects.get().pk).name, "Страна")
+        with override_settings(REFERENCE_CACHE_CHECK_INTERVAL=0):
+            self.assertEqual(refcache.get(Country, Country.objects.get().pk).name, "Другая страна")
+
+    def test_inline_choices_come_from_cache(self):
+        self.client.force_login(self.superuser)
+        url = reverse("admin:cbpi_episode_change", args=[Episode.objects.first().pk])
+        self.client.get(url)
+        with CaptureQueriesContext(connections["default"]) as queries:
+            response = self.client.get(url)
+        self.assertContains(response, f'<option value="{RoleType.objects.get().pk}" selected>')
+        self.assertFalse([q["sql"] for q in queries if 'FROM "cbpi_roletype"' in q["sql"]])
+
+
+class AutocompleteTest(TestCase):
+    autocomplete_models = (
+        Event, Hero, Episode, Participation, Decision, HeroAction, Fact, UserStamp, GlobalActorList,
+    )
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.saga = make_universe(rows=5)
+        cls.superuser = get_user_model().objects.create_superuser("admin", "admin@example.com", "admin")
+
+    def setUp(self):
+        self.client.force_login(self.superuser)
+
+    def test_large_tables_are_searchable(self):
+        for model in self.autocomplete_models:
+            with self.subTest(model=model.__name__):
+                self.assertTrue(admin.site._registry[model].search_fields)
+
+    def test_hero_change_form_does_not_render_event_choices(self):
+        hero = Hero.objects.first()
+        response = self.client.get(reverse("admin:cbpi_hero_change", args=(hero.pk,)))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "admin-autocomplete")
+        self.assertNotContains(response, '<option value="%s">' % Event.objects.last().pk)
+
+    def test_autocomplete_endpoint(self):
+        response = self.client.get(reverse("admin:autocomplete"), {
+            "term": "Событие 3",
+            "app_label": "cbpi",
+            "model_name": "hero",
+            "field_name": "birth_event",
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r["text"] for r in response.json()["results"]], ["Событие 3"])
+
+
+class EventSequenceClosureTest(TestCase):
+    def setUp(self):
+        self.a, self.b, self.c, self.d, self.e = (Event.objects.create(title=t) for t in "abcde")
+        self.link(self.a, self.b)
+        self.link(self.a, self.c)
+        self.link(self.b, self.d)
+        self.link(self.c, self.d)
+        self.link(self.d, self.e)
+
+    def link(self, before, after):
+        return EventSequence.objects.create(event_before=before, event_after=after)
+
+    def pairs(self):
+        return set(EventSequenceClosure.objects.values_list("event_before__title", "event_after__title"))
+
+    def assertClosureConsistent(self):
+        pairs = self.pairs()
+        EventSequenceClosure.objects.rebuild()
+        self.assertEqual(pairs, self.pairs())
+
+    def test_rebuild_skips_legacy_cycles(self):
+        # Старая база без проверки циклов: e→b замыкает b→d→e, f→b входит в цикл извне.
+        f = Event.objects.create(title="f")
+        EventSequence.objects.bulk_create([EventSequence(event_before=self.e, event_after=self.b),
+                                           EventSequence(event_before=f, event_after=self.b),
+                                           EventSequence(event_before=f, event_after=f)])
+        skipped = EventSequenceClosure.objects.rebuild()
+        self.assertEqual(skipped, sorted([(self.b.pk, self.d.pk), (self.d.pk, self.e.pk), (self.e.pk, self.b.pk),
+                                          (f.pk, f.pk)]))
+        self.assertEqual(self.pairs(), {("a", "b"), ("a", "c"), ("a", "d"), ("c", "d"), ("f", "b")})
+
+    def test_add_edge(self):
+        self.assertEqual(self.pairs(), {
+            ("a", "b"), ("a", "c"), ("a", "d"), ("a", "e"),
+            ("b", "d"), ("b", "e"), ("c", "d"), ("c", "e"), ("d", "e"),
+        })
+        self.assertTrue(EventSequenceClosure.objects.is_before(self.a, self.e))
+        self.assertFalse(EventSequenceClosure.objects.is_before(self.b, self.c))
+        self.assertEqual(
+            set(EventSequenceClosure.objects.events_between(self.a, self.e).values_list("title", flat=True)),
+            {"b", "c", "d"},
+        )
+
+    def test_cycle_is_rejected(self):
+        with self.assertRaises(ValidationError):
+            self.link(self.e, self.a)
+        with self.assertRaises(ValidationError):
+            self.link(self.c, self.c)
+        with self.assertRaises(ValidationError):
+            EventSequence(event_before=self.d, event_after=self.b).full_clean()
+        self.assertFalse(EventSequence.objects.filter(event_before=self.e).exists())
+
+    def test_add_edges_batch(self):
+        f, g, h = (Event.objects.create(title=t) for t in "fgh")
+        # e→f и f→g дают путь a…g только вместе; g→f и h→a замыкают цикл с пачкой и с замыканием.
+        edges = [(self.e.pk, f.pk), (f.pk, g.pk), (g.pk, f.pk), (g.pk, h.pk), (h.pk, self.a.pk), (h.pk, h.pk)]
+        with self.assertNumQueries(3):
+            rejected = EventSequenceClosure.objects.add_edges(edges)
+        self.assertEqual(rejected, {2, 4, 5})
+        EventSequence.objects.bulk_create([EventSequence(event_before_id=a, event_after_id=b)
+                                           for number, (a, b) in enumerate(edges) if number not in rejected])
+        self.assertIn(("a", "h"), self.pairs())
+        self.assertClosureConsistent()
+
+    def test_remove_edge_keeps_alternative_path(self):
+        EventSequence.objects.get(event_before=self.b, event_after=self.d).delete()
+        self.assertIn(("a", "e"), self.pairs())
+        self.assertNotIn(("b", "d"), self.pairs())
+        self.assertClosureConsistent()
+        EventSequence.objects.get(event_before=self.c, event_after=self.d).delete()
+        self.assertNotIn(("a", "e"), self.pairs())
+        self.assertClosureConsistent()
+
+    def test_move_edge(self):
+        sequence = EventSequence.objects.get(event_before=self.d, event_after=self.e)
+        sequence.event_before = self.b
+        sequence.save()
+        self.assertNotIn(("d", "e"), self.pairs())
+        self.assertClosureConsistent()
+
+    def test_delete_event(self):
+        self.d.delete()
+        self.assertEqual(self.pairs(), {("a", "b"), ("a", "c")})
+
+
+class PlaceTreeTest(TestCase):
+    def setUp(self):
+        self.world = Place.objects.create(name="Мир")
+        self.land = Place.objects.create(name="Земля", parent=self.world)
+        self.city = Place.objects.create(name="Город", parent=self.land)
+        self.sea = Place.objects.create(name="Море", parent=self.world)
+        self.event = Event.objects.create(title="В городе", place=self.city)
+        Event.objects.create(title="В море", place=self.sea)
+
+    def names(self, queryset):
+        return [place.name for place in queryset]
+
+    def test_paths(self):
+        self.assertEqual(self.city.path, f"/{self.world.pk}/{self.land.pk}/{self.city.pk}/")
+        self.assertEqual(self.city.depth, 2)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.names(self.city.ancestors()), ["Мир", "Земля"])
+        with self.assertNumQueries(1):
+            self.assertEqual(set(self.names(self.world.descendants())), {"Земля", "Город", "Море"})
+        with self.assertNumQueries(1):
+            self.assertEqual([e.title for e in self.land.events_within()], ["В городе"])
+
+    def test_move_updates_subtree(self):
+        self.land.parent = self.sea
+        self.land.save()
+        self.city.refresh_from_db()
+        self.assertEqual(self.names(self.city.ancestors()), ["Мир", "Море", "Земля"])
+        self.assertEqual(self.sea.events_within().count(), 2)
+
+    def test_move_into_own_subtree_is_rejected(self):
+        self.land.parent = self.city
+        with self.assertRaises(ValidationError):
+            self.land.save()
+
+    def test_delete_makes_children_roots(self):
+        self.land.delete()
+        self.city.refresh_from_db()
+        self.assertIsNone(self.city.parent)
+        self.assertEqual(self.city.path, f"/{self.city.pk}/")
+        self.assertEqual(self.names(self.world.descendants()), ["Море"])
+
+    def test_rebuild_paths(self):
+        Place.objects.update(path="")
+        Place.objects.rebuild_paths()
+        self.city.refresh_from_db()
+        self.assertEqual(self.city.path, f"/{self.world.pk}/{self.land.pk}/{self.city.pk}/")
+
+    def test_event_admin_subtree_filter(self):
+        self.client.force_login(get_user_model().objects.create_superuser("admin", "admin@example.com", "admin"))
+        response = self.client.get(reverse("admin:cbpi_event_changelist"), {"place_tree": self.land.pk})
+        self.assertEqual([e.title for e in response.context["cl"].result_list], ["В городе"])
+
+
+class EpisodeOrderTest(TestCase):
+    def setUp(self):
+        saga = Saga.objects.create(name="Сага")
+        self.composition = Composition.objects.create(saga=saga, title="Книга")
+        self.first = self.episode("Первый")
+        self.second = self.episode("Второй", self.first)
+        self.third = self.episode("Третий", self.second)
+
+    def episode(self, title, previous=None):
+        return Episode.objects.create(
+            composition=self.composition, title=title, story_resume="...", previous_episode=previous)
+
+    def titles(self):
+        return [e.title for e in Episode.objects.in_reading_order(self.composition)]
+
+    def test_positions(self):
+        self.assertEqual([self.first.position, self.second.position, self.third.position], [0, 1, 2])
+        with self.assertNumQueries(1):
+            self.assertEqual(self.titles(), ["Первый", "Второй", "Третий"])
+
+    def test_relink(self):
+        self.third.previous_episode = None
+        self.third.save()
+        self.first.previous_episode = self.third
+        self.first.save()
+        self.assertEqual(self.titles(), ["Третий", "Первый", "Второй"])
+
+    def test_delete_renumbers_chain(self):
+        self.first.delete()
+        self.assertEqual(list(Episode.objects.in_reading_order(self.composition).values_list("position", flat=True)), [0, 1])
+
+    def test_delete_middle_keeps_chain(self):
+        fourth = self.episode("Четвёртый", self.third)
+        Episode.objects.get(pk=self.second.pk).delete()
+        self.assertEqual(self.titles(), ["Первый", "Третий", "Четвёртый"])
+        self.assertEqual(Episode.objects.get(pk=self.third.pk).previous_episode_id, self.first.pk)
+        self.assertEqual(Episode.objects.get(pk=fourth.pk).position, 2)
+
+    def test_composition_delete_skips_chain_repair(self):
+        def delete_queries(episodes):
+            self.composition = Composition.objects.create(saga=self.composition.saga, title=f"Книга {episodes}")
+            previous = None
+            for number in range(episodes):
+                previous = self.episode(str(number), previous)
+            with CaptureQueriesContext(connections["default"]) as queries:
+                self.composition.delete()
+            return len(queries)
+
+        # Перенумерация и перевязка цепочки на каждый эпизод давали квадратичный рост.
+        self.assertLessEqual(delete_queries(25) - delete_queries(5), 20)
+
+    def test_fork_is_rejected(self):
+        with self.assertRaises(ValidationError):
+            self.episode("Развилка", self.first)
+
+    def test_cycle_is_rejected(self):
+        self.first.previous_episode = self.third
+        with self.assertRaises(ValidationError):
+            self.first.save()
+
+    def test_renumber_repairs_positions(self):
+        Episode.objects.update(position=0)
+        Episode.objects.renumber()
+        self.assertEqual(self.titles(), ["Первый", "Второй", "Третий"])
+
+
+class TimelineTest(TestCase):
+    def setUp(self):
+        self.universe = Universe.objects.create(name="Вселенная")
+        saga = Saga.objects.create(name="Сага", universe_of_events=self.universe, zero_event_abbreviature="ПЯ")
+        self.composition = Composition.objects.create(saga=saga, title="Книга")
+
+    def event(self, date, **kwargs):
+        return Event.objects.create(title=date or "Ноль", date_time_from_zero_event=date,
+                                    composition=self.composition, **kwargs)
+
+    def test_parse_offset(self):
+        cases = {"-200": -200, "+50": 50, "−12.5": -12.5, "200 до ПЯ": -200, "50 ПЯ": 50,
+                 "12 лет 6 месяцев": 12.5, "3 г. до": -3, "0": 0, "в правление короля": None, "ПЯ": None}
+        for text, offset in cases.items():
+            with self.subTest(text=text):
+                self.assertEqual(parse_offset(text, "ПЯ"), offset)
+
+    def test_offset_synced_on_save(self):
+        event = self.event("200 до ПЯ")
+        self.assertEqual(event.timeline_offset, -200)
+        event.date_time_from_zero_event = "50 ПЯ"
+        event.save(update_fields=["date_time_from_zero_event"])
+        event.refresh_from_db()
+        self.assertEqual(event.timeline_offset, 50)
+        self.assertEqual(self.event(None, zero_event_flag=True).timeline_offset, 0)
+
+    def test_abbreviature_change_enqueues_timeline(self):
+        saga = self.composition.saga
+        event = self.event("50 ПЯ")
+        with self.captureOnCommitCallbacks(execute=True):
+            saga.name = "Сага 2"
+            saga.save()
+        self.assertFalse(Job.objects.exists())
+        with self.captureOnCommitCallbacks(execute=True):
+            saga.zero_event_abbreviature = "ЭЯ"
+            saga.save()
+        self.assertEqual(list(Job.objects.values_list("kind", "saga")), [("timeline", saga.pk)])
+        call_command("run_jobs", workers=0, once=True, stdout=StringIO())
+        event.refresh_from_db()
+        self.assertIsNone(event.timeline_offset)
+
+    def test_composition_moved_enqueues_timeline(self):
+        other = Saga.objects.create(name="Другая", zero_event_abbreviature="ЭЯ")
+        event = self.event("50 ЭЯ")
+        self.assertIsNone(event.timeline_offset)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.composition.saga = other
+            self.composition.save()
+        call_command("run_jobs", workers=0, once=True, stdout=StringIO())
+        event.refresh_from_db()
+        self.assertEqual(event.timeline_offset, 50)
+
+    def test_between_is_index_range(self):
+        for date in ("-300", "200 до ПЯ", "10 ПЯ", "50 ПЯ", "100"):
+            self.event(date)
+        other = Universe.objects.create(name="Другая")
+        Event.objects.create(title="Чужое", date_time_from_zero_event="0", composition=Composition.objects.create(
+            saga=Saga.objects.create(name="Другая сага", universe_of_events=other), title="Другая книга"))
+        events = Event.objects.between(-200, 50, universe=self.universe)
+        self.assertEqual([e.title for e in events], ["200 до ПЯ", "10 ПЯ", "50 ПЯ"])
+        self.assertIn("cbpi_event_timeline_idx", Event.objects.between(-200, 50).explain())
+
+    def test_unparsed_date_is_kept_off_timeline(self):
+        user = get_user_model().objects.create_superuser("admin", "admin@example.com", "admin")
+        profile = User.objects.create(user=user, native_language="ru", country=Country.objects.create(name="Страна"))
+        event = Event(title="?", date_time_from_zero_event="в правление короля", composition=self.composition,
+                      place=Place.objects.create(name="Город"),
+                      user_stamp=UserStamp.objects.create(user=profile, datetime=timezone.now()))
+        event.full_clean()
+        event.save()
+        self.assertIsNone(event.timeline_offset)
+        self.client.force_login(user)
+        response = self.client.post(reverse("admin:cbpi_event_change", args=[event.pk]), {
+            "title": "Коронация", "date_time_from_zero_event": event.date_time_from_zero_event,
+            "composition": self.composition.pk, "place": event.place_id, "user_stamp": event.user_stamp_id},
+            follow=True)
+        self.assertEqual(Event.objects.get(pk=event.pk).title, "Коронация")
+        self.assertIn("не разобрана", " ".join(str(m) for m in response.context["messages"]))
+
+    def test_sync_command(self):
+        self.event("-5")
+        Event.objects.update(timeline_offset=None)
+        Event.objects.create(title="?", date_time_from_zero_event="давным-давно")
+        out, err = StringIO(), StringIO()
+        call_command("sync_timeline", stdout=out, stderr=err)
+        self.assertIn("Обновлено событий: 1", out.getvalue())
+        self.assertIn("Не разобрано дат: 1", err.getvalue())
+        self.assertEqual(Event.objects.get(title="-5").timeline_offset, -5)
+
+
+class ValueTrajectoriesTest(TestCase):
+    def setUp(self):
+        self.saga = Saga.objects.create(name="Сага")
+        composition = Composition.objects.create(saga=self.saga, title="Книга")
+        self.events = [Event.objects.create(title=f"e{i}", composition=composition) for i in range(4)]
+        for before, after in zip(self.events, self.events[1:]):
+            EventSequence.objects.create(event_before=before, event_after=after)
+        self.honor = ValueDimension.objects.create(title="Честь")
+        self.hero = Hero.objects.create(name="Герой", saga=self.saga)
+        self.other = Hero.objects.create(name="Другой", saga=self.saga)
+        HeroValue.objects.create(hero=self.hero, value_dimension=self.honor, weight=0.5)
+        HeroValue.objects.create(hero=self.hero, value_dimension=self.honor, weight=0.8, event_after=self.events[2])
+        action = HeroAction.objects.create(hero=self.hero)
+        DecisionEvaluation.objects.create(
+            hero_was_evaluated=self.hero, eval_for_ha=action, event_after=self.events[1],
+            affects_on_vd=self.honor, weight=-0.25)
+        losses = FactType.objects.create(title="Потери", is_numerical=True)
+        AffectOnValue.objects.create(value_dimension=self.honor, fact_type=losses, weight=0.1)
+        Fact.objects.create(
+            composition=composition, title="Битва", fact_type=losses, numeric_value=3,
+            result_of_event=self.events[3])
+
+    def test_trajectories(self):
+        result = value_trajectories(self.saga)
+        self.assertEqual(list(result.event_ids), [e.pk for e in self.events])
+        self.assertEqual(result.score.shape, (2, 1, 4))
+        assert_allclose(result.hero(self.hero.pk)[0], [0.5, 0.25, 0.55, 0.55], rtol=1e-6)
+        assert_allclose(result.hero(self.other.pk)[0], [0, 0, 0, 0])
+        with self.assertRaises(KeyError):
+            result.hero(0)
+        assert_allclose(result.facts[0], [0, 0, 0, 0.3], rtol=1e-6)
+
+
+@override_settings(ANALYTICS_CACHE_CHECK_INTERVAL=3600)
+class FactGraphTest(TestCase):
+    def setUp(self):
+        invalidate_fact_graphs()
+        self.saga = Saga.objects.create(name="Сага")
+        composition = Composition.objects.create(saga=self.saga, title="Книга")
+        self.event = Event.objects.create(title="Битва", composition=composition)
+        losses = FactType.objects.create(title="Потери", is_numerical=True)
+        self.honor = ValueDimension.objects.create(title="Честь")
+        AffectOnValue.objects.create(value_dimension=self.honor, fact_type=losses, weight=0.5)
+        self.a, self.b, self.c = (
+            Fact.objects.create(composition=composition, title=t, fact_type=losses, numeric_value=2)
+            for t in "abc")
+        FactRelation.objects.create(based_fact=self.a, followed_fact=self.b, event_relation=self.event)
+        FactRelation.objects.create(based_fact=self.b, followed_fact=self.c)
+
+    def test_traversal(self):
+        graph = fact_graph(saga=self.saga)
+        self.assertEqual(graph.downstream(self.a.pk), {self.b.pk: 1, self.c.pk: 2})
+        self.assertEqual(graph.upstream(self.c.pk), {self.b.pk: 1, self.a.pk: 2})
+        self.assertEqual(graph.downstream_events(self.a.pk), {self.event.pk})
+        self.assertEqual(graph.propagate(self.a.pk, decay=0.5), {self.honor.pk: 1 + 0.5 + 0.25})
+        self.assertIsNone(graph.find_cycle())
+
+    def test_cached_until_relations_change(self):
+        graph = fact_graph(saga=self.saga)
+        with self.assertNumQueries(0):
+            self.assertIs(fact_graph(saga=self.saga), graph)
+        FactRelation.objects.create(based_fact=self.c, followed_fact=self.a)
+        graph = fact_graph(saga=self.saga)
+        self.assertEqual(sorted(graph.find_cycle()), sorted([self.a.pk, self.b.pk, self.c.pk]))
+
+    def test_sees_writes_from_other_processes(self):
+        graph = fact_graph(saga=self.saga)
+        # update() не шлёт сигналов — так выглядит запись из другого процесса.
+        FactRelation.objects.filter(based_fact=self.b).update(based_fact=self.a)
+        self.assertIs(fact_graph(saga=self.saga), graph)
+        with override_settings(ANALYTICS_CACHE_CHECK_INTERVAL=0):
+            graph = fact_graph(saga=self.saga)
+        self.assertEqual(graph.downstream(self.a.pk), {self.b.pk: 1, self.c.pk: 1})
+
+    @override_settings(ANALYTICS_CACHE_SIZE=1)
+    def test_cache_size_bound(self):
+        graph = fact_graph(saga=self.saga)
+        fact_graph(saga=Saga.objects.create(name="Другая"))
+        self.assertIsNot(fact_graph(saga=self.saga), graph)
+
+
+@override_settings(ANALYTICS_CACHE_CHECK_INTERVAL=3600)
+class HeroNetworkTest(TestCase):
+    def setUp(self):
+        network.invalidate_networks()
+        refcache.invalidate()
+        self.saga = Saga.objects.create(name="Сага")
+        self.books = [Composition.objects.create(saga=self.saga, title=f"Книга {i}") for i in range(2)]
+        self.episodes = [Episode.objects.create(composition=book, title=f"Эпизод {i}", story_resume="...")
+                         for i, book in enumerate(self.books * 2)]
+        self.heroes = [Hero.objects.create(name=f"Герой {i}", saga=self.saga) for i in range(4)]
+        self.main = RoleType.objects.create(name="Главная", weight=2.0)
+        cast = [(0, 0, self.main), (1, 0, None), (2, 0, None), (0, 1, self.main), (1, 1, None),
+                (0, 2, None), (3, 2, None), (3, 3, None)]
+        for hero, episode, role in cast:
+            Participation.objects.create(hero=self.heroes[hero], episode=self.episodes[episode], role_type=role)
+
+    def dense(self, composition=None):
+        """A·Aᵀ без диагонали, посчитанное плотно — эталон для разреженного."""
+        rows = Participation.objects.filter(episode__composition__saga=self.saga)
+        if composition is not None:
+            rows = rows.filter(episode__composition=composition)
+        hero_ids = sorted({hero.pk for hero in self.heroes})
+        episode_ids = [episode.pk for episode in self.episodes]
+        incidence = np.zeros((len(hero_ids), len(episode_ids)))
+        for hero, episode, weight in rows.values_list("hero", "episode", "role_type__weight"):
+            incidence[hero_ids.index(hero), episode_ids.index(episode)] += weight or 1.0
+        product = incidence @ incidence.T
+        np.fill_diagonal(product, 0)
+        return {(hero_ids[a], hero_ids[b]): product[a, b] for a, b in zip(*np.nonzero(product)) if a < b}
+
+    def test_cooccurrence_matches_dense_product(self):
+        graph = network.hero_network(self.saga)
+        for composition in (None, self.books[0], self.books[1].pk):
+            with self.subTest(composition=composition):
+                pairs = graph.cooccurrence(composition).pairs()
+                self.assertEqual({(a, b): w for a, b, w in pairs}, self.dense(composition))
+        first, second, third, fourth = (hero.pk for hero in self.heroes)
+        self.assertEqual(graph.cooccurrence().partners(first), [(second, 4.0), (third, 2.0), (fourth, 1.0)])
+        degree = graph.cooccurrence().degree()
+        self.assertEqual(degree[first], 7.0)
+        centrality = graph.cooccurrence().eigenvector()
+        self.assertEqual(max(centrality, key=centrality.get), first)
+        self.assertLess(centrality[fourth], centrality[third])
+
+    def test_participation_changes_update_cached_network(self):
+        graph = network.hero_network(self.saga)
+        graph.cooccurrence()
+        with self.captureOnCommitCallbacks(execute=True):
+            added = Participation.objects.create(hero=self.heroes[3], episode=self.episodes[1])
+        expected = self.dense()
+        with self.assertNumQueries(0):
+            self.assertIs(network.hero_network(self.saga), graph)
+            self.assertEqual({(a, b): w for a, b, w in graph.cooccurrence().pairs()}, expected)
+        with self.captureOnCommitCallbacks(execute=True):
+            added.delete()
+            Participation.objects.filter(hero=self.heroes[2]).get().delete()
+        self.assertEqual({(a, b): w for a, b, w in graph.cooccurrence().pairs()}, self.dense())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.main.weight = 3.0
+            self.main.save()
+        self.assertIsNot(network.hero_network(self.saga), graph)
+
+    @override_settings(ANALYTICS_CACHE_CHECK_INTERVAL=0)
+    def test_own_writes_keep_network(self):
+        graph = network.hero_network(self.saga)
+        other_saga = Saga.objects.create(name="Другая")
+        other = network.hero_network(other_saga)
+        with self.captureOnCommitCallbacks(execute=True):
+            added = Participation.objects.create(hero=self.heroes[3], episode=self.episodes[1])
+        with self.assertNumQueries(1):
+            self.assertIs(network.hero_network(self.saga), graph)
+        self.assertEqual({(a, b): w for a, b, w in graph.cooccurrence().pairs()}, self.dense())
+        with self.captureOnCommitCallbacks(execute=True):
+            added.delete()
+        self.assertIs(network.hero_network(self.saga), graph)
+        self.assertIs(network.hero_network(other_saga), other)
+
+    def test_composition_moved_to_other_saga(self):
+        graph = network.hero_network(self.saga)
+        other = Saga.objects.create(name="Другая")
+        network.hero_network(other)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.books[1].saga = other
+            self.books[1].save()
+        self.assertIsNot(network.hero_network(self.saga), graph)
+        pairs = network.hero_network(self.saga).cooccurrence().pairs()
+        self.assertEqual({(a, b): w for a, b, w in pairs}, self.dense())
+        self.assertEqual(network.hero_network(other).cooccurrence().pairs(),
+                         [(self.heroes[0].pk, self.heroes[1].pk, 2.0)])
+
+    def test_sees_bulk_writes(self):
+        graph = network.hero_network(self.saga)
+        Participation.objects.filter(hero=self.heroes[3]).delete()
+        self.assertIs(network.hero_network(self.saga), graph)
+        with override_settings(ANALYTICS_CACHE_CHECK_INTERVAL=0):
+            self.assertEqual({(a, b): w for a, b, w in network.hero_network(self.saga).cooccurrence().pairs()},
+                             self.dense())
+
+    @override_settings(ANALYTICS_CACHE_SIZE=1)
+    def test_cache_size_bound(self):
+        graph = network.hero_network(self.saga)
+        network.hero_network(Saga.objects.create(name="Другая"))
+        self.assertIsNot(network.hero_network(self.saga), graph)
+
+
+@override_settings(ANALYTICS_CACHE_CHECK_INTERVAL=3600)
+class ValueIndexTest(TestCase):
+    def setUp(self):
+        similarity.invalidate_index()
+        refcache.invalidate()
+        self.honor, self.power = (ValueDimension.objects.create(title=t) for t in ("Честь", "Власть"))
+        self.sagas = [Saga.objects.create(name=f"Сага {i}", universe_of_events=Universe.objects.create(name=f"Мир {i}"))
+                      for i in range(2)]
+        composition = Composition.objects.create(saga=self.sagas[0], title="Книга")
+        self.early, self.late = (Event.objects.create(title=t, composition=composition, date_time_from_zero_event=d)
+                                 for t, d in (("Раньше", "-10"), ("Позже", "5")))
+        vectors = {"Первый": (1, 0), "Второй": (2, 0.2), "Третий": (0, 1), "Чужой": (1, 0.5)}
+        self.heroes = {}
+        for name, (honor, power) in vectors.items():
+            saga = self.sagas[name == "Чужой"]
+            hero = self.heroes[name] = Hero.objects.create(name=name, saga=saga)
+            HeroValue.objects.create(hero=hero, value_dimension=self.honor, weight=honor, event_after=self.late)
+            HeroValue.objects.create(hero=hero, value_dimension=self.power, weight=power)
+        # Более ранняя запись не перекрывает позднюю, даже с большим id.
+        HeroValue.objects.create(hero=self.heroes["Третий"], value_dimension=self.honor, weight=9, event_after=self.early)
+
+    def ids(self, *names):
+        return [self.heroes[name].pk for name in names]
+
+    def test_similar_heroes(self):
+        index = similarity.value_index()
+        first = self.heroes["Первый"].pk
+        self.assertEqual(index.vector(self.heroes["Третий"].pk), {self.honor.pk: 0.0, self.power.pk: 1.0})
+        results = index.similar(first, k=2)
+        self.assertEqual([hero for hero, _ in results], self.ids("Второй", "Чужой"))
+        assert_allclose([score for _, score in results], [2 / np.sqrt(4.04), 1 / np.sqrt(1.25)], rtol=1e-6)
+        self.assertEqual([hero for hero, _ in index.similar(first, k=1, metric="euclidean")], self.ids("Чужой"))
+        self.assertEqual([hero for hero, _ in index.similar(first, universe=self.sagas[0].universe_of_events_id)],
+                         self.ids("Второй", "Третий"))
+        self.assertEqual(index.similar(first, saga=self.sagas[1].pk), [(self.heroes["Чужой"].pk, ANY)])
+        with self.assertRaises(ValueError):
+            index.similar(first, metric="manhattan")
+
+    def test_index_follows_hero_values(self):
+        index = similarity.value_index()
+        third = self.heroes["Третий"]
+        with self.captureOnCommitCallbacks(execute=True):
+            HeroValue.objects.create(hero=third, value_dimension=self.honor, weight=1, event_after=self.late)
+            power = HeroValue.objects.get(hero=third, value_dimension=self.power)
+            power.weight = 0
+            power.save()
+        with self.assertNumQueries(0):
+            self.assertIs(similarity.value_index(), index)
+            self.assertEqual(index.similar(self.heroes["Первый"].pk, k=1), [(third.pk, 1.0)])
+        with self.captureOnCommitCallbacks(execute=True):
+            Hero.objects.get(pk=third.pk).delete()
+        self.assertIsNone(index.vector(third.pk))
+
+    @override_settings(ANALYTICS_CACHE_CHECK_INTERVAL=0)
+    def test_own_writes_keep_index(self):
+        index = similarity.value_index()
+        third = self.heroes["Третий"]
+        with self.captureOnCommitCallbacks(execute=True):
+            HeroValue.objects.create(hero=third, value_dimension=self.honor, weight=1, event_after=self.late)
+        Event.objects.create(title="Стороннее", composition=self.early.composition)
+        with self.assertNumQueries(1):
+            self.assertIs(similarity.value_index(), index)
+        self.assertEqual(index.vector(third.pk), {self.honor.pk: 1.0, self.power.pk: 1.0})
+
+    def test_sees_offsets_and_universe_changes(self):
+        index = similarity.value_index()
+        third = self.heroes["Третий"].pk
+        # Как после задачи timeline: bulk-пересчёт без сигналов.
+        Event.objects.filter(pk=self.early.pk).update(timeline_offset=100)
+        self.assertIs(similarity.value_index(), index)
+        with override_settings(ANALYTICS_CACHE_CHECK_INTERVAL=0):
+            index = similarity.value_index()
+        self.assertEqual(index.vector(third), {self.honor.pk: 9.0, self.power.pk: 1.0})
+        universe = self.sagas[0].universe_of_events_id
+        with self.captureOnCommitCallbacks(execute=True):
+            self.sagas[1].universe_of_events_id = universe
+            self.sagas[1].save()
+        first = self.heroes["Первый"].pk
+        self.assertEqual([hero for hero, _ in similarity.value_index().similar(first, universe=universe)],
+                         self.ids("Второй", "Третий", "Чужой"))
+
+    def test_api(self):
+        first = self.heroes["Первый"].pk
+        response = self.client.get(reverse("cbpi:hero-similar", args=[first]), {"k": 1, "metric": "euclidean"})
+        self.assertEqual(response.json(), {"hero": first, "results": [{"id": self.heroes["Чужой"].pk, "score": 0.5}]})
+        self.assertEqual(self.client.get(reverse("cbpi:hero-similar", args=[first]), {"metric": "x"}).status_code, 400)
+        self.assertEqual(self.client.get(reverse("cbpi:hero-similar", args=[0])).status_code, 404)
+
+
+class SagaDocumentTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.saga = make_universe(rows=2)
+        cls.other = Saga.objects.create(name="Другая сага")
+        cls.other_book = Composition.objects.create(saga=cls.other, title="Чужая книга")
+
+    def setUp(self):
+        refcache.invalidate()
+        for saga in (self.saga, self.other):
+            documents.refresh(saga.pk)
+
+    def stale(self):
+        return set(SagaDocument.objects.filter(stale=True).values_list("pk", flat=True))
+
+    def test_document_is_read_in_one_query(self):
+        with self.assertNumQueries(1):
+            document = documents.saga_document(self.saga.pk)
+        self.assertEqual([c["title"] for c in document["compositions"]], ["Книга 0", "Книга 1"])
+        self.assertEqual(document["compositions"][1]["episodes"][0]["cast"],
+                         [{"hero": Hero.objects.get(name="Герой 1").pk, "name": "Герой 1", "role": "Главная роль"}])
+        self.assertEqual([hero["name"] for hero in document["heroes"]], ["Герой 0", "Герой 1"])
+        response = self.client.get(reverse("cbpi:saga-document", args=[self.saga.pk]))
+        self.assertEqual(response.json()["name"], self.saga.name)
+        self.assertEqual(self.client.get(reverse("cbpi:saga-document", args=[0])).status_code, 404)
+
+    def test_only_dependent_documents_go_stale(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Episode.objects.create(composition=self.other_book, title="Новый эпизод", story_resume="...")
+        self.assertEqual(self.stale(), {self.other.pk})
+        self.assertEqual(list(Job.objects.values_list("kind", "saga")), [("saga_document", self.other.pk)])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            hero = Hero.objects.get(name="Герой 0")
+            hero.name = "Переименован"
+            hero.save()
+        self.assertEqual(self.stale(), {self.saga.pk, self.other.pk})
+        call_command("run_jobs", workers=0, once=True, stdout=StringIO())
+        self.assertEqual(self.stale(), set())
+        with self.assertNumQueries(1):
+            document = documents.saga_document(self.saga.pk)
+        self.assertIn("Переименован", [hero["name"] for hero in document["heroes"]])
+
+    def test_stale_document_rebuilds_on_read(self):
+        Participation.objects.filter(hero__name="Герой 0").get().delete()
+        self.assertEqual(documents.saga_document(self.saga.pk)["compositions"][0]["episodes"][0]["cast"], [])
+        other = self.other.pk
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other.delete()
+        self.assertFalse(SagaDocument.objects.filter(pk=other).exists())
+        self.assertFalse(Job.objects.exists())
+
+
+class HeroStateTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.saga = Saga.objects.create(name="Сага")
+        book = Composition.objects.create(saga=cls.saga, title="Книга")
+        cls.events = {date: Event.objects.create(title=f"Событие {date}", composition=book, date_time_from_zero_event=date)
+                      for date in ("-15", "-10", "0", "5")}
+        cls.honor, cls.power = (ValueDimension.objects.create(title=t) for t in ("Честь", "Власть"))
+        cls.hero, cls.idle = (Hero.objects.create(name=n, saga=cls.saga) for n in ("Герой", "Без записей"))
+        action = HeroAction.objects.create(hero=cls.hero)
+        for dimension, weight, date in ((cls.honor, 0.5, None), (cls.honor, 1, "-10"), (cls.honor, 2, "5"),
+                                        (cls.power, 3, "0")):
+            HeroValue.objects.create(hero=cls.hero, value_dimension=dimension, weight=weight,
+                                     event_after=cls.events.get(date))
+        for weight, date in ((0.2, "-10"), (0.3, "5")):
+            DecisionEvaluation.objects.create(hero_was_evaluated=cls.hero, eval_for_ha=action, weight=weight,
+                                              affects_on_vd=cls.honor, event_after=cls.events[date])
+
+    def test_state_at_event(self):
+        with self.assertNumQueries(1):
+            state = history.state_at(self.hero, self.events["0"])
+        self.assertEqual(state.values, {self.honor.pk: 1, self.power.pk: 3})
+        self.assertEqual(state.totals, {self.honor.pk: 0.2})
+        self.assertEqual(history.state_at(self.hero, self.events["-15"]).values, {self.honor.pk: 0.5})
+        self.assertEqual(history.state_at(self.hero, self.events["5"]).totals, {self.honor.pk: 0.5})
+
+    def test_positions_follow_timeline(self):
+        late = self.events["5"]
+        Event.objects.filter(pk=late.pk).update(date_time_from_zero_event="-20")
+        Event.objects.sync_timeline(Event.objects.filter(pk=late.pk))
+        self.assertEqual(history.state_at(self.hero, self.events["-15"]).values, {self.honor.pk: 2})
+        HeroValue.objects.filter(weight=2).update(event_after=None)
+        self.assertEqual(HeroValue.objects.get(weight=2).as_of, float("-inf"))
+
+    def test_event_off_timeline(self):
+        undated = Event.objects.create(title="Без даты", composition=self.events["0"].composition)
+        self.assertIsNone(undated.timeline_offset)
+        action = HeroAction.objects.get()
+        HeroValue.objects.create(hero=self.hero, value_dimension=self.honor, weight=7, event_after=undated)
+        DecisionEvaluation.objects.create(hero_was_evaluated=self.hero, eval_for_ha=action, weight=0.4,
+                                          affects_on_vd=self.honor, event_after=undated)
+        # Записи события вне шкалы видны на нём поверх записей «с начала»...
+        state = history.state_at(self.hero, undated)
+        self.assertEqual(state.values, {self.honor.pk: 7})
+        self.assertEqual(state.totals, {self.honor.pk: 0.4})
+        # ...и не видны на событиях шкалы.
+        state = history.state_at(self.hero, self.events["5"])
+        self.assertEqual(state.values, {self.honor.pk: 2, self.power.pk: 3})
+        self.assertEqual(state.totals, {self.honor.pk: 0.5})
+
+    def test_batch_and_api(self):
+        states = history.states_at(self.events["0"], Hero.objects.filter(saga=self.saga))
+        self.assertEqual(set(states), {self.hero.pk, self.idle.pk})
+        self.assertEqual((states[self.idle.pk].values, states[self.idle.pk].evaluations), ({}, []))
+
+        response = self.client.get(reverse("cbpi:hero-state", args=[self.hero.pk]), {"event": self.events["5"].pk})
+        self.assertEqual(response.json()["values"], {str(self.honor.pk): 2, str(self.power.pk): 3})
+        self.assertEqual(len(response.json()["evaluations"]), 2)
+        self.assertEqual(self.client.get(reverse("cbpi:hero-state", args=[self.hero.pk])).status_code, 400)
+        response = self.client.get(reverse("cbpi:event-states", args=[self.events["-10"].pk]))
+        self.assertEqual([state["hero"] for state in response.json()["results"]], [self.hero.pk, self.idle.pk])
+        response = self.client.get(reverse("cbpi:event-states", args=[self.events["-10"].pk]), {"heroes": self.idle.pk})
+        self.assertEqual(response.json()["results"], [{"hero": self.idle.pk, "values": {}, "evaluations": [], "totals": {}}])
+
+
+class ImportSagaTest(TestCase):
+    records = [
+        {"model": "composition", "title": "Книга", "composition_type": "Роман"},
+        {"model": "event", "composition": "Книга", "title": "Начало", "place": "Город"},
+        {"model": "event", "composition": "Книга", "title": "Конец", "place": "Город"},
+        {"model": "event_sequence", "event_before": ["Книга", "Начало"], "event_after": ["Книга", "Конец"]},
+        {"model": "event_sequence", "event_before": "Книга|Конец", "event_after": "Книга|Начало"},
+        {"model": "hero", "name": "Герой", "birth_event": ["Книга", "Начало"]},
+        {"model": "episode", "composition": "Книга", "title": "Второй", "story_resume": "...",
+         "previous_episode": "Первый"},
+        {"model": "episode", "composition": "Книга", "title": "Первый", "story_resume": "...", "start_event": "Начало"},
+        {"model": "participation", "hero": "Герой", "episode": "Книга|Первый", "role_type": "Главная"},
+        {"model": "participation", "hero": "Никто", "episode": "Книга|Первый"},
+        {"model": "event", "title": "Без произведения", "zero_event_flag": "не знаю"},
+    ]
+
+    def test_import_jsonl(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "saga.jsonl"
+            path.write_text("\n".join(json.dumps(r, ensure_ascii=False) for r in self.records), encoding="utf-8")
+            out, err = StringIO(), StringIO()
+            call_command("import_saga", "Сага", str(path), chunk_size=3, stdout=out, stderr=err)
+
+        saga = Saga.objects.get(name="Сага")
+        self.assertEqual(Composition.objects.get(saga=saga).composition_type.title, "Роман")
+        self.assertEqual(Event.objects.filter(composition__saga=saga).count(), 2)
+        self.assertEqual(Place.objects.get().events_within().count(), 2)
+        self.assertTrue(EventSequenceClosure.objects.is_before(
+            Event.objects.get(title="Начало"), Event.objects.get(title="Конец")))
+        self.assertEqual(Hero.objects.get(saga=saga).birth_event.title, "Начало")
+        self.assertEqual([e.title for e in Episode.objects.in_reading_order(Composition.objects.get())],
+                         ["Первый", "Второй"])
+        self.assertEqual(Participation.objects.get().role_type.name, "Главная")
+        errors = err.getvalue().splitlines()
+        self.assertEqual(sorted(int(line.split(":")[1]) for line in errors), [5, 10, 11])
+        self.assertIn("ошибок: 3", out.getvalue())
+
+    def test_malformed_json_line(self):
+        lines = ['{"model": "composition", "title": "Книга"}', '{"model": "composition", "title": ', "[1, 2]",
+                 '{"model": "composition", "title": "Вторая"}']
+        errors = []
+        importer = SagaImporter(Saga.objects.create(name="Сага"),
+                                on_error=lambda number, message: errors.append((number, message)))
+        importer.run(read_jsonl(lines)).finish()
+        self.assertEqual(importer.created["composition"], 2)
+        self.assertEqual([number for number, _ in errors], [2, 3])
+        self.assertIn("неверный JSON", errors[0][1])
+
+    def test_previous_episode_from_later_chunk(self):
+        records = [
+            {"model": "composition", "title": "Книга"},
+            {"model": "episode", "composition": "Книга", "title": "Третий", "story_resume": "...",
+             "previous_episode": "Второй"},
+            {"model": "episode", "composition": "Книга", "title": "Второй", "story_resume": "...",
+             "previous_episode": "Первый"},
+            {"model": "episode", "composition": "Книга", "title": "Первый", "story_resume": "..."},
+            {"model": "episode", "composition": "Книга", "title": "Сирота", "story_resume": "...",
+             "previous_episode": "Нет такого"},
+        ]
+        saga = Saga.objects.create(name="Сага")
+        errors = []
+        importer = SagaImporter(saga, chunk_size=1, on_error=lambda number, message: errors.append(number))
+        with mock.patch.object(Episode.objects, "renumber", wraps=Episode.objects.renumber) as renumber:
+            importer.run(read_jsonl(json.dumps(r, ensure_ascii=False) for r in records)).finish()
+        self.assertEqual(renumber.call_count, 1)
+        self.assertEqual([e.title for e in Episode.objects.in_reading_order(Composition.objects.get())],
+                         ["Первый", "Сирота", "Второй", "Третий"])
+        self.assertEqual(errors, [5])
+
+
+class ExportSagaTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.saga = make_universe(rows=3)
+        other = Saga.objects.create(name="Другая сага")
+        Hero.objects.create(name="Чужой герой", saga=other)
+        Event.objects.create(title="Чужое событие", composition=Composition.objects.create(saga=other, title="Чужая книга"))
+
+    def records(self, data):
+        return [json.loads(line) for line in data.decode().splitlines()]
+
+    def test_dependency_order_and_scope(self):
+        exporter = SagaExporter(self.saga, chunk_size=2)
+        with self.assertNumQueries(len(EXPORTS)):
+            records = self.records(b"".join(exporter.chunks()))
+        models = [record["model"] for record in records]
+        self.assertEqual(list(dict.fromkeys(models)), [name for name, *_ in EXPORTS])
+        self.assertEqual(exporter.exported["event"], 3)
+        self.assertEqual(exporter.exported["event_sequence"], 2)
+        seen = {(record["model"], record["id"]) for record in records}
+        for record in records:
+            if record["model"] == "episode" and record["previous_episode"]:
+                self.assertIn(("episode", record["previous_episode"]), seen)
+            seen.add((record["model"], record["id"]))
+
+    def test_command_writes_gzip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "saga.jsonl.gz"
+            err = StringIO()
+            call_command("export_saga", str(self.saga.pk), str(path), stderr=err)
+            records = self.records(gzip.decompress(path.read_bytes()))
+        self.assertEqual(records[0]["model"], "saga")
+        self.assertEqual(records[0]["author"], self.saga.author_id)
+        self.assertIn("hero: 3", err.getvalue())
+
+    def test_streaming_response(self):
+        url = reverse("cbpi:saga-export", args=[self.saga.pk])
+        response = self.client.get(url, {"compression": "gzip"})
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "application/gzip")
+        records = self.records(gzip.decompress(b"".join(response.streaming_content)))
+        self.assertEqual(sum(record["model"] == "hero" for record in records), 3)
+        self.assertEqual(self.client.get(url, {"compression": "rar"}).status_code, 400)
+
+    @skipUnless(exporter.zstandard, "нет пакета zstandard")
+    def test_zstd(self):
+        response = self.client.get(reverse("cbpi:saga-export", args=[self.saga.pk]), {"compression": "zstd"})
+        self.assertEqual(response["Content-Type"], "application/zstd")
+        data = exporter.zstandard.ZstdDecompressor().decompressobj().decompress(b"".join(response.streaming_content))
+        self.assertEqual(self.records(data), self.records(b"".join(SagaExporter(self.saga).chunks())))
+
+    def test_zstd_response(self):
+        # Проводка формата без самого пакета: сжатие подменяется на zlib.
+        zstandard = mock.Mock()
+        zstandard.ZstdCompressor.return_value.compressobj.side_effect = zlib.compressobj
+        with mock.patch.object(exporter, "zstandard", zstandard):
+            response = self.client.get(reverse("cbpi:saga-export", args=[self.saga.pk]), {"compression": "zstd"})
+            data = zlib.decompress(b"".join(response.streaming_content))
+        self.assertEqual(response["Content-Type"], "application/zstd")
+        self.assertEqual(response["Content-Disposition"], f'attachment; filename="saga-{self.saga.pk}.jsonl.zst"')
+        self.assertEqual(self.records(data), self.records(b"".join(SagaExporter(self.saga).chunks())))
+
+    def test_zstd_without_package(self):
+        with mock.patch.object(exporter, "zstandard", None):
+            response = self.client.get(reverse("cbpi:saga-export", args=[self.saga.pk]), {"compression": "zstd"})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(JOB_MAX_ATTEMPTS=2, JOB_RETRY_DELAY=0)
+class JobQueueTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.saga = make_universe(rows=2)
+
+    def run_jobs(self):
+        out, err = StringIO(), StringIO()
+        call_command("run_jobs", workers=0, once=True, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_every_kind_has_a_job(self):
+        self.assertEqual({kind for kind, _ in Job.KINDS}, set(jobs.JOBS))
+
+    def test_duplicates_coalesce(self):
+        first = Job.objects.enqueue("timeline", self.saga)
+        second = Job.objects.enqueue("timeline", self.saga.pk)
+        self.assertEqual((first.pk, second.coalesced), (second.pk, 1))
+        self.assertNotEqual(Job.objects.enqueue("timeline").pk, first.pk)
+
+    def test_worker_runs_queued_jobs(self):
+        Event.objects.filter(title="Событие 1").update(date_time_from_zero_event="-5")
+        Job.objects.enqueue("timeline", self.saga)
+        Job.objects.enqueue("episode_order", self.saga)
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            Job.objects.enqueue("value_trajectories", self.saga)
+            out, _ = self.run_jobs()
+            saved = np.load(jobs.trajectories_path(self.saga.pk))
+            self.assertEqual(sorted(saved["hero_ids"]), sorted(self.saga.hero_set.values_list("pk", flat=True)))
+        self.assertIn("Выполнено задач: 3, с ошибкой: 0", out)
+        self.assertEqual(Event.objects.get(title="Событие 1").timeline_offset, -5)
+        self.assertFalse(Job.objects.exclude(status=Job.DONE).exists())
+
+    def test_trajectories_file_is_read_while_fresh(self):
+        hero = self.saga.hero_set.order_by("pk").first()
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            self.assertIsNone(jobs.load_trajectories(self.saga.pk))
+            jobs.recompute_trajectories(self.saga.pk)
+            saved = jobs.load_trajectories(self.saga.pk)
+            assert_allclose(saved.hero(hero.pk), value_trajectories(self.saga).hero(hero.pk))
+            DecisionEvaluation.objects.update(weight=0.5)
+            self.assertIsNone(jobs.load_trajectories(self.saga.pk))
+
+    def test_failed_job_is_retried_then_fails(self):
+        job = Job.objects.enqueue("timeline", self.saga)
+        with mock.patch.dict(jobs.JOBS, {"timeline": mock.Mock(side_effect=RuntimeError("сбой"))}):
+            out, err = self.run_jobs()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+        self.assertIn("RuntimeError: сбой", job.error)
+        self.assertIn("с ошибкой: 2", out)
+
+    def test_stale_running_job_is_requeued(self):
+        job = Job.objects.enqueue("timeline", self.saga)
+        Job.objects.claim("пропавший воркер")
+        Job.objects.filter(pk=job.pk).update(started=timezone.now() - datetime.timedelta(days=1))
+        self.assertEqual(Job.objects.requeue_stale(timeout=60), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+
+    def test_renumbering_job_marks_saga_document(self):
+        documents.refresh(self.saga.pk)
+        Episode.objects.filter(composition__saga=self.saga).update(position=99)
+        Job.objects.enqueue("episode_order", self.saga)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.run_jobs()
+        self.assertTrue(SagaDocument.objects.get(pk=self.saga.pk).stale)
+        self.assertTrue(Job.objects.filter(kind="saga_document", saga=self.saga, status=Job.QUEUED).exists())
+        positions = [episode["position"] for composition in documents.saga_document(self.saga.pk)["compositions"]
+                     for episode in composition["episodes"]]
+        self.assertNotIn(99, positions)
+
+    def test_broken_pool_requeues_jobs(self):
+        class Pool:
+            """Первый пул сломан, следующие выполняют задачи в этом процессе."""
+            created = 0
+
+            def __init__(self, **kwargs):
+                self.broken = not Pool.created
+                Pool.created += 1
+
+            def submit(self, fn, *args):
+                future = Future()
+                if self.broken:
+                    future.set_exception(BrokenProcessPool("процесс убит"))
+                else:
+                    future.set_result(fn(*args))
+                return future
+
+            def shutdown(self, **kwargs):
+                pass
+
+        Job.objects.enqueue("timeline", self.saga)
+        Job.objects.enqueue("episode_order", self.saga)
+        out, err = StringIO(), StringIO()
+        with mock.patch("cbpi.management.commands.run_jobs.ProcessPoolExecutor", Pool):
+            call_command("run_jobs", workers=2, once=True, stdout=out, stderr=err)
+        self.assertEqual(Pool.created, 2)
+        self.assertIn("пул пересоздан", err.getvalue())
+        self.assertIn("Выполнено задач: 2, с ошибкой: 2", out.getvalue())
+        self.assertEqual(list(Job.objects.values_list("status", "attempts")), [(Job.DONE, 2)] * 2)
+
+    def test_saga_admin_action_enqueues(self):
+        self.client.force_login(get_user_model().objects.create_superuser("admin", "admin@example.com", "admin"))
+        self.client.post(reverse("admin:cbpi_saga_changelist"),
+                         {"action": "recompute", "_selected_action": [self.saga.pk]})
+        self.assertEqual(set(Job.objects.values_list("kind", flat=True)),
+                         {"value_trajectories", "timeline", "episode_order"})
+        self.client.post(reverse("admin:cbpi_saga_changelist"),
+                         {"action": "rebuild_indexes", "_selected_action": [self.saga.pk]})
+        self.assertEqual(set(Job.objects.filter(saga=None).values_list("kind", flat=True)),
+                         {"event_closure", "search_index"})
+
+
+class FullTextSearchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.saga = make_universe(rows=3)
+        Event.objects.filter(title="Событие 1").update(description="Осада крепости у моря")
+        Event.objects.bulk_create([Event(title="Морская битва", description="Флот у крепости")])
+        cls.superuser = get_user_model().objects.create_superuser("admin", "admin@example.com", "admin")
+
+    def test_ranked_search(self):
+        results = search("крепост")
+        self.assertEqual([str(obj) for _, obj, _ in results], ["Морская битва", "Событие 1"])
+        self.assertEqual(search("морск битв")[0][1].title, "Морская битва")
+        self.assertEqual(search("   "), [])
+
+    def test_index_follows_updates_and_deletes(self):
+        Hero.objects.filter(name="Герой 2").update(name="Странник")
+        self.assertEqual([str(obj) for _, obj, _ in search("странник")], ["Странник"])
+        Hero.objects.get(name="Странник").delete()
+        self.assertEqual(search("странник"), [])
+
+    def test_admin_search(self):
+        self.client.force_login(self.superuser)
+        response = self.client.get(reverse("admin:cbpi_event_changelist"), {"q": "осада"})
+        self.assertEqual([e.title for e in response.context["cl"].result_list], ["Событие 1"])
+        response = self.client.get(reverse("admin:cbpi_participation_changelist"), {"q": "эпизод 2"})
+        self.assertEqual([p.episode.title for p in response.context["cl"].result_list], ["Эпизод 2"])
+
+    def test_search_api(self):
+        response = self.client.get(reverse("cbpi:search"), {"q": "герой 1"})
+        self.assertEqual(response.json()["results"], [
+            {"type": "hero", "id": Hero.objects.get(name="Герой 1").pk, "title": "Герой 1", "rank": ANY},
+        ])
+        for limit in ("0", "-5"):
+            response = self.client.get(reverse("cbpi:search"), {"q": "герой 1", "limit": limit})
+            self.assertEqual(len(response.json()["results"]), 1)
+
+
+async def read_body(response):
+    if not response.streaming:
+        return response.content
+    return b"".join([chunk async for chunk in response.streaming_content])
+
+
+class ReadOnlyApiTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.saga = make_universe(rows=5)
+
+    async def get(self, url, **params):
+        response = await self.async_client.get(url, params)
+        body = await read_body(response)
+        return response, (json.loads(body) if response.status_code == 200 else None)
+
+    async def list(self, resource, **params):
+        return await self.get(reverse("cbpi:resource-list", args=[resource]), **params)
+
+    async def test_keyset_pages(self):
+        titles, params = [], {"limit": 2, "fields": "title"}
+        while True:
+            response, body = await self.list("events", **params)
+            titles += [row["title"] for row in body["results"]]
+            self.assertEqual({tuple(row) for row in body["results"]}, {("id", "title")})
+            if body["next"] is None:
+                break
+            params["cursor"] = body["next"].rsplit("cursor=", 1)[1]
+        self.assertEqual(titles, [f"Событие {i}" for i in range(5)])
+
+    def test_page_is_one_range_query(self):
+        cursor = api.encode_cursor(Event.objects.order_by("pk")[1].pk)
+        with CaptureQueriesContext(connections["default"]) as queries:
+            async_to_sync(self.list)("events", cursor=cursor, limit=2)
+        self.assertIn('"cbpi_event"."id" >', queries[-1]["sql"])
+        self.assertNotIn("OFFSET", queries[-1]["sql"])
+
+    async def test_filters_and_errors(self):
+        composition = await Composition.objects.aget(title="Книга 1")
+        _, body = await self.list("events", composition=composition.pk)
+        self.assertEqual([row["title"] for row in body["results"]], ["Событие 1"])
+        self.assertEqual((await self.list("events", fields="nope"))[0].status_code, 400)
+        self.assertEqual((await self.list("events", cursor="???"))[0].status_code, 400)
+        self.assertEqual((await self.list("unknown"))[0].status_code, 404)
+
+    def test_conditional_get(self):
+        get = async_to_sync(self.async_client.get)
+        response, _ = async_to_sync(self.list)("heroes")
+        self.assertTrue(response.has_header("Last-Modified"))
+        url = reverse("cbpi:resource-list", args=["heroes"])
+        with self.assertNumQueries(1):
+            cached = get(url, headers={"if-none-match": response["ETag"]})
+        self.assertEqual(cached.status_code, 304)
+        Hero.objects.filter(name="Герой 0").update(description="Изменён")
+        self.assertEqual(get(url, headers={"if-none-match": response["ETag"]}).status_code, 200)
+
+    def test_timeline_etag_follows_saga(self):
+        get = async_to_sync(self.async_client.get)
+        Event.objects.update(timeline_offset=0)
+        params = {"universe": self.saga.universe_of_events_id}
+        response = get(reverse("cbpi:timeline"), params)
+        self.assertEqual(len(json.loads(async_to_sync(read_body)(response))["results"]), 5)
+        # Фильтр по вселенной идёт через сагу: её перенос должен сбросить ETag.
+        Saga.objects.filter(pk=self.saga.pk).update(universe_of_events=Universe.objects.create(name="Другая"))
+        moved = get(reverse("cbpi:timeline"), params, headers={"if-none-match": response["ETag"]})
+        self.assertEqual(moved.status_code, 200)
+        self.assertEqual(json.loads(async_to_sync(read_body)(moved))["results"], [])
+
+    async def test_detail(self):
+        hero = await Hero.objects.aget(name="Герой 2")
+        url = reverse("cbpi:resource-detail", args=["heroes", hero.pk])
+        response, body = await self.get(url, fields="name,saga")
+        self.assertEqual(body, {"id": hero.pk, "name": "Герой 2", "saga": self.saga.pk})
+        cached = await self.async_client.get(url, {"fields": "name,saga"}, headers={"if-none-match": response["ETag"]})
+        self.assertEqual(cached.status_code, 304)
+
+    async def test_timeline(self):
+        for number, date in enumerate(("-300", "-100", "0", "-100", "20")):
+            await Event.objects.filter(title=f"Событие {number}").aupdate(timeline_offset=float(date))
+        titles, params = [], {"start": -150, "end": 10, "limit": 1}
+        while True:
+            response, body = await self.get(reverse("cbpi:timeline"), **params)
+            titles += [row["title"] for row in body["results"]]
+            if body["next"] is None:
+                break
+            params["cursor"] = body["next"].rsplit("cursor=", 1)[1]
+        self.assertEqual(titles, ["Событие 1", "Событие 3", "Событие 2"])
+        self.assertEqual((await self.get(reverse("cbpi:timeline"), start="вчера"))[0].status_code, 400)
+
+
+class AsyncApiThreadsTest(TransactionTestCase):
+    # Расчёт идёт в отдельном потоке со своим соединением: данные должны быть закоммичены.
+    databases = {"default", "analytics"}
+
+    def test_trajectory(self):
+        saga = make_universe(rows=2)
+        hero = Hero.objects.get(name="Герой 1")
+        response = self.client.get(reverse("cbpi:hero-trajectory", args=[hero.pk]))
+        body = response.json()
+        self.assertEqual(body["events"], list(Event.objects.filter(composition__saga=saga).order_by("pk").values_list("pk", flat=True)))
+        assert_allclose(body["score"], [[0.0, 0.3]])
+        self.assertEqual(self.client.get(reverse("cbpi:hero-trajectory", args=[0])).status_code, 404)
+
+    def test_benchmark_command(self):
+        make_universe(rows=2)
+        out = StringIO()
+        call_command("benchmark_api", "/api/heroes/", "/api/timeline/", requests=6, concurrency=3, stdout=out)
+        self.assertRegex(out.getvalue(), r"WSGI: 6 запросов .* ошибок: 0")
+        self.assertRegex(out.getvalue(), r"ASGI: 6 запросов .* ошибок: 0")
+
+
+def image_upload(name, color="red", size=(400, 300)):
+    buffer = BytesIO()
+    Image.new("RGB", size, color).save(buffer, "PNG")
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type="image/png")
+
+
+class ThumbnailTest(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.media_root = Path(media.name)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name, THUMBNAIL_WORKERS=0))
+
+    def test_thumbnails_on_upload(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            hero = Hero.objects.create(name="Герой", photo_file=image_upload("hero.png"))
+        self.assertEqual(len(hero.photo_hash), 64)
+        with Image.open(self.media_root / thumbnails.relative_path(hero.photo_hash, "medium")) as image:
+            self.assertEqual((image.format, image.size), ("WEBP", (256, 192)))
+        self.assertTrue(thumbnails.url(hero.photo_file, hero.photo_hash).endswith("_small.webp"))
+
+        # Та же картинка у автора — миниатюры общие, повторно не создаются.
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            author = Author.objects.create(name="Автор", photo_file=image_upload("author.png"))
+        self.assertEqual(author.photo_hash, hero.photo_hash)
+        self.assertIsNone(callbacks[0]())
+
+    def test_failed_pool_job_is_logged(self):
+        hero = Hero.objects.create(name="Герой", photo_file=SimpleUploadedFile("hero.png", b"not an image"))
+        with (self.assertLogs("cbpi.thumbnails", "ERROR") as logs, override_settings(THUMBNAIL_WORKERS=1),
+              ThreadPoolExecutor(1) as pool, mock.patch.object(thumbnails, "executor", return_value=pool)):
+            thumbnails.schedule(hero.photo_file, hero.photo_hash)
+        self.assertIn("UnidentifiedImageError", logs.output[0])
+
+    def test_backfill_command(self):
+        hero = Hero.objects.create(name="Герой", photo_file=image_upload("hero.png", color="blue"))
+        Hero.objects.update(photo_hash="")
+        out = StringIO()
+        call_command("make_thumbnails", workers=1, stdout=out)
+        hero.refresh_from_db()
+        self.assertTrue((self.media_root / thumbnails.relative_path(hero.photo_hash, "small")).exists())
+        self.assertIn("создано миниатюр: 2", out.getvalue())
+
+
+class DatabaseProfileTest(SimpleTestCase):
+    def test_pragmas(self):
+        with tempfile.TemporaryDirectory() as directory:
+            settings_dict = {**connections.settings["default"], "NAME": str(Path(directory) / "db.sqlite3")}
+            wrapper = connections["default"].__class__(settings_dict, alias="profile")
+            try:
+                with wrapper.cursor() as cursor:
+                    pragmas = {}
+                    for name in ("journal_mode", "synchronous", "busy_timeout", "cache_size"):
+                        cursor.execute(f"PRAGMA {name}")
+                        pragmas[name] = cursor.fetchone()[0]
+            finally:
+                wrapper.close()
+        self.assertEqual(pragmas, {"journal_mode": "wal", "synchronous": 1, "busy_timeout": 5000, "cache_size": -65536})
+
+    def test_analytics_reads_use_read_only_connection(self):
+        self.assertEqual(Hero.objects.all().db, "default")
+        with analytics_reads():
+            self.assertEqual(Hero.objects.all().db, "analytics")
+
+
+class AnalyticsRoutingInTransactionTest(TestCase):
+    def test_reads_stay_on_default_inside_transaction(self):
+        with analytics_reads():
+            self.assertEqual(Hero.objects.all().db, "default")
+
+
+class IndexUsageTest(TestCase):
+    """Горячие запросы идут по индексу, а не полным просмотром таблицы."""
+
+    def assertUsesIndex(self, queryset, index):
+        plan = queryset.explain()
+        self.assertRegex(plan, rf"USING (COVERING )?INDEX {index}\b", plan)
+
+    def test_hot_lookups(self):
+        day = timezone.now()
+        cases = [
+            (Saga.objects.filter(name="Сага"), "cbpi_saga_name_idx"),
+            (Hero.objects.filter(name="Герой"), "cbpi_hero_name_idx"),
+            (Hero.objects.filter(saga=1).order_by("name"), "cbpi_hero_saga_name_idx"),
+            (Event.objects.filter(title="Событие"), "cbpi_event_title_idx"),
+            (Event.objects.filter(zero_event_flag=True, composition=1), "cbpi_event_zero_idx"),
+            (HeroValue.objects.filter(hero=1, value_dimension=1).order_by("event_after"), "cbpi_herovalue_hero_vd_idx"),
+            # Подходит любой из индексов, начинающихся с героя.
+            (HeroValue.objects.filter(hero=1), "cbpi_herovalue_hero_(vd|asof)_idx"),
+            (HeroValue.objects.filter(hero=1, as_of__lte=0), "cbpi_herovalue_hero_asof_idx"),
+            (DecisionEvaluation.objects.filter(hero_was_evaluated=1, as_of__lte=0), "cbpi_deceval_hero_asof_idx"),
+            (DecisionEvaluation.objects.filter(hero_was_evaluated=1, affects_on_vd=1), "cbpi_deceval_hero_vd_idx"),
+            (Fact.objects.filter(composition=1, fact_type=1), "cbpi_fact_comp_type_idx"),
+            (Fact.objects.filter(composition=1), "cbpi_fact_comp_type_idx"),
+            (UserStamp.objects.filter(user=1, datetime__gte=day).order_by("datetime"), "cbpi_userstamp_user_dt_idx"),
+        ]
+        for queryset, index in cases:
+            with self.subTest(index=index, query=str(queryset.query)):
+                self.assertUsesIndex(queryset, index)
+
+
+class SyntheticUniverseTest(TestCase):
+    SCALE = dict(sagas=1, compositions=2, events=12, episodes=4, heroes=6, facts=5, values=3, evaluations=2,
+                 place_depth=3, place_fanout=2)
+
+    def test_generated_data_is_consistent(self):
+        call_command("generate_universe", seed=7, stdout=StringIO(), **self.SCALE)
+        saga = Saga.objects.get()
+        self.assertEqual(Event.objects.filter(composition__saga=saga).count(), 24)
+        self.assertEqual(Episode.objects.filter(composition__saga=saga).count(), 8)
+        self.assertEqual(Place.objects.count(), 1 + 2 + 4 + 8)
+        self.assertEqual(Event.objects.get(zero_event_flag=True).timeline_offset, 0)
+        self.assertFalse(HeroValue.objects.filter(event_after__isnull=False, as_of__isnull=True).exists())
+
+        # Производное, заполненное генератором, совпадает с тем, что строят менеджеры.
+        paths = dict(Place.objects.values_list("pk", "path"))
+        Place.objects.rebuild_paths()
+        self.assertEqual(dict(Place.objects.values_list("pk", "path")), paths)
+        positions = dict(Episode.objects.values_list("pk", "position"))
+        Episode.objects.renumber()
+        self.assertEqual(dict(Episode.objects.values_list("pk", "position")), positions)
+        closure = set(EventSequenceClosure.objects.values_list("event_before", "event_after"))
+        EventSequenceClosure.objects.rebuild()
+        self.assertEqual(set(EventSequenceClosure.objects.values_list("event_before", "event_after")), closure)
+        self.assertEqual(Event.objects.sync_timeline(), (0, 0))
+        self.assertFalse(any(counters.repair().values()))
+        self.assertIsNone(fact_graph(saga=saga).find_cycle())
+
+    def test_seed_repeats_data(self):
+        for _ in range(2):
+            call_command("generate_universe", seed=3, stdout=StringIO(), **self.SCALE)
+        first, second = Saga.objects.order_by("pk")
+        weights = [list(HeroValue.objects.filter(hero__saga=saga).order_by("pk").values_list("weight", flat=True))
+                   for saga in (first, second)]
+        self.assertEqual(weights[0], weights[1])
+
+
+class BenchmarkTest(TransactionTestCase):
+    # hero-trajectory считает в отдельном потоке: данные должны быть закоммичены.
+    databases = {"default", "analytics"}
+
+    def setUp(self):
+        call_command("generate_universe", stdout=StringIO(), **SyntheticUniverseTest.SCALE)
+        get_user_model().objects.create_superuser(username="admin", password="secret")
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def run_benchmarks(self, **options):
+        output = Path(self.directory.name, "result.json")
+        call_command("run_benchmarks", repeat=1, output=str(output), host="testserver",
+                     stdout=StringIO(), stderr=StringIO(), **options)
+        return json.loads(output.read_text(encoding="utf-8"))
+
+    def test_writes_results(self):
+        report = self.run_benchmarks(label="test")
+        self.assertEqual(report["label"], "test")
+        self.assertEqual(report["rows"]["Event"], Event.objects.count())
+        self.assertEqual({row["group"] for row in report["results"]}, set(benchmarks.GROUPS))
+        for row in report["results"]:
+            with self.subTest(name=row["name"]):
+                self.assertEqual(row["status"], "ok")
+                self.assertIn("median_ms", row)
+
+    def test_baseline_regressions(self):
+        baseline = Path(self.directory.name, "baseline.json")
+        report = self.run_benchmarks(group=["api"])
+        baseline.write_text(json.dumps(report), encoding="utf-8")
+        self.run_benchmarks(group=["api"], baseline=str(baseline), threshold=100, slack=1000)
+
+        report["results"][0]["queries"] -= 1
+        baseline.write_text(json.dumps(report), encoding="utf-8")
+        with self.assertRaisesMessage(CommandError, "Регрессий: 1"):
+            self.run_benchmarks(group=["api"], baseline=str(baseline), threshold=100, slack=1000)
@@ -0,0 +1,95 @@
+"""Миниатюры фотографий (Author.photo_file, Hero.photo_file).
+
+Производные файлы лежат в MEDIA_ROOT/thumbnails/<ab>/<sha256>_<размер>.webp:
+ключ — хеш содержимого оригинала (photo_hash), поэтому одинаковые загрузки
+делят миниатюры, а готовые не пересчитываются. Хеш считается при сохранении,
+само масштабирование уходит в пул процессов после коммита.
+
+Модуль не импортирует модели: make_thumbnails выполняется в дочерних процессах.
+"""
+import hashlib
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def file_hash(photo):
+    digest = hashlib.sha256()
+    for chunk in photo.chunks():
+        digest.update(chunk)
+    photo.seek(0)
+    return digest.hexdigest()
+
+
+def relative_path(photo_hash, size):
+    return f"thumbnails/{photo_hash[:2]}/{photo_hash}_{size}.webp"
+
+
+def missing_sizes(photo_hash, media_root, sizes):
+    return {name: edge for name, edge in sizes.items()
+            if not os.path.exists(os.path.join(media_root, relative_path(photo_hash, name)))}
+
+
+def make_thumbnails(source, photo_hash, media_root, sizes, quality=80):
+    """Создаёт недостающие миниатюры; возвращает число созданных файлов."""
+    missing = missing_sizes(photo_hash, media_root, sizes)
+    if not missing:
+        return 0
+    with Image.open(source) as original:
+        image = ImageOps.exif_transpose(original)
+        image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+        for name, edge in missing.items():
+            target = os.path.join(media_root, relative_path(photo_hash, name))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            thumbnail = image.copy()
+            thumbnail.thumbnail((edge, edge), Image.LANCZOS)
+            # Пишем во временный файл: параллельный воркер не увидит недописанную миниатюру.
+            temporary = f"{target}.{os.getpid()}.tmp"
+            thumbnail.save(temporary, "WEBP", quality=quality)
+            os.replace(temporary, target)
+    return len(missing)
+
+
+def executor(workers=None):
+    global _executor
+    if _executor is None:
+        # spawn, а не fork: дочерний процесс не должен унаследовать соединение SQLite и потоки сервера.
+        _executor = ProcessPoolExecutor(max_workers=workers or settings.THUMBNAIL_WORKERS,
+                                        mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+def schedule(photo, photo_hash):
+    """Ставит недостающие миниатюры в очередь пула; при THUMBNAIL_WORKERS = 0 — делает сразу."""
+    media_root = str(settings.MEDIA_ROOT)
+    if not missing_sizes(photo_hash, media_root, settings.THUMBNAIL_SIZES):
+        return None
+    args = (photo.path, photo_hash, media_root, settings.THUMBNAIL_SIZES, settings.THUMBNAIL_QUALITY)
+    if settings.THUMBNAIL_WORKERS:
+        future = executor().submit(make_thumbnails, *args)
+        # Результат пула никто не ждёт: без колбэка ошибка пропала бы молча.
+        future.add_done_callback(lambda done: _log_failure(done, photo.path))
+        return future
+    return make_thumbnails(*args)
+
+
+def _log_failure(future, path):
+    if not future.cancelled() and future.exception() is not None:
+        logger.error("Миниатюры %s не созданы", path, exc_info=future.exception())
+
+
+def url(photo, photo_hash, size="small"):
+    """URL миниатюры, пока её нет — URL оригинала."""
+    if not photo:
+        return ""
+    if photo_hash and os.path.exists(os.path.join(settings.MEDIA_ROOT, relative_path(photo_hash, size))):
+        return f"{settings.MEDIA_URL}{relative_path(photo_hash, size)}"
+    return photo.url
@@ -0,0 +1,62 @@
+"""Разбор Event.date_time_from_zero_event в числовую координату на шкале саги.
+
+Строка задаётся относительно нулевого события саги (Saga.zero_event_abbreviature)
+и переводится в смещение в годах: отрицательное — до нулевого события.
+Понимаются записи вида
+
+    "-200", "+50", "−12.5", "200 до ПЯ", "50 ПЯ", "после ПЯ 3 года",
+    "12 лет 3 месяца", "5 дней до", "0".
+
+Единицы: годы (по умолчанию), месяцы, недели, дни, часы. Модуль не
+импортирует модели: им пользуются модель, менеджер, импорт и миграция.
+"""
+import re
+
+# Единица → сколько её в году.
+UNITS = {
+    **dict.fromkeys(("", "г", "гг", "год", "года", "лет", "y", "year", "years"), 1),
+    **dict.fromkeys(("мес", "месяц", "месяца", "месяцев", "m", "month", "months"), 12),
+    **dict.fromkeys(("нед", "неделя", "недели", "недель", "w", "week", "weeks"), 365.25 / 7),
+    **dict.fromkeys(("д", "дн", "день", "дня", "дней", "d", "day", "days"), 365.25),
+    **dict.fromkeys(("ч", "час", "часа", "часов", "h", "hour", "hours"), 365.25 * 24),
+}
+BEFORE = {"до", "before", "bze"}
+AFTER = {"после", "от", "after", "ze"}
+
+_MINUS = str.maketrans({"−": "-", "–": "-", "—": "-"})
+_PART = re.compile(r"(\d+(?:[.,]\d+)?)\s*([^\W\d_]*)\.?")
+
+
+def parse_offset(text, abbreviature=None):
+    """Смещение в годах или None, если строку не удалось разобрать."""
+    if not text:
+        return None
+    text = text.translate(_MINUS).lower().strip()
+    if abbreviature:
+        text = re.sub(rf"(?<!\w){re.escape(abbreviature.lower())}(?!\w)", " ", text).strip()
+    sign = 1
+    if text[:1] in ("+", "-"):
+        sign = -1 if text[0] == "-" else 1
+        text = text[1:]
+    words = text.split()
+    if BEFORE & set(words):
+        sign = -sign
+    text = " ".join(word for word in words if word not in BEFORE | AFTER)
+
+    years, position, found = 0.0, 0, False
+    for match in _PART.finditer(text):
+        number, unit = match.groups()
+        if text[position:match.start()].strip(" ,") or unit not in UNITS:
+            return None
+        years += float(number.replace(",", ".")) / UNITS[unit]
+        position, found = match.end(), True
+    if not found or text[position:].strip(" ,"):
+        return None
+    return sign * years
+
+
+def event_offset(text, zero_event_flag=False, abbreviature=None):
+    """Координата события: нулевое событие без даты стоит в нуле шкалы."""
+    if zero_event_flag and not text:
+        return 0.0
+    return parse_offset(text, abbreviature)
@@ -0,0 +1,18 @@
+from django.urls import path
+
+from . import views
+
+app_name = "cbpi"
+
+urlpatterns = [
+    path("api/search/", views.search, name="search"),
+    path("api/sagas/<int:pk>/export/", views.saga_export, name="saga-export"),
+    path("api/sagas/<int:pk>/document/", views.saga_document, name="saga-document"),
+    path("api/heroes/<int:pk>/trajectory/", views.hero_trajectory, name="hero-trajectory"),
+    path("api/heroes/<int:pk>/similar/", views.hero_similar, name="hero-similar"),
+    path("api/heroes/<int:pk>/state/", views.hero_state, name="hero-state"),
+    path("api/events/<int:pk>/states/", views.event_states, name="event-states"),
+    path("api/timeline/", views.timeline, name="timeline"),
+    path("api/<slug:resource>/", views.resource_list, name="resource-list"),
+    path("api/<slug:resource>/<int:pk>/", views.resource_detail, name="resource-detail"),
+]
@@ -0,0 +1,175 @@
+"""Версии таблиц для условных запросов API и кеша справочников.
+
+Для каждой модели из TRACKED строка TableVersion хранит счётчик изменений и
+время последнего изменения. Счётчик увеличивают триггеры SQLite на вставку,
+обновление и удаление, поэтому он верен и при bulk_create/update и при записи
+из других процессов. Как и у поиска, триггеры создаёт миграция, а после
+каждого migrate install() восстанавливает потерянные при пересоздании таблиц.
+Те же триггеры ведут число строк (row_count) — по нему админка показывает
+размер больших таблиц без COUNT(*). На других СУБД версий нет, и version()
+и row_count() возвращают None.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import connection
+
+from .models import (ActionType, AffectOnValue, Composition, CompositionType, Country, DecisionEvaluation, DecisionType,
+                     Episode, Event, EventSequence, Fact, FactRelation, FactType, Hero, HeroValue, Participation,
+                     RoleType, Saga, StampStatus, TableVersion, UserStamp, ValueDimension)
+
+TRACKED = (
+    Saga, Composition, Event, Hero, Episode, Fact,
+    # кеши аналитики (VersionedCache)
+    FactRelation, AffectOnValue,
+    # файлы траекторий ценностей (jobs.load_trajectories)
+    DecisionEvaluation, EventSequence,
+    # справочники (refcache)
+    Country, StampStatus, RoleType, FactType, CompositionType, ActionType, DecisionType, ValueDimension,
+    # большие таблицы, у которых админка берёт число строк отсюда
+    Participation, UserStamp, HeroValue,
+)
+
+# суффикс триггера → (событие, изменение числа строк)
+TRIGGERS = {"ai": ("INSERT", " + 1"), "au": ("UPDATE", ""), "ad": ("DELETE", " - 1")}
+
+_NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+
+def version(model):
+    """(версия, время изменения) таблицы модели или None, если версии не ведутся."""
+    if connection.vendor != "sqlite":
+        return None
+    row = TableVersion.objects.filter(table_name=model._meta.db_table).values_list("version", "modified").first()
+    return row or (0, None)
+
+
+async def aversion(model):
+    if connection.vendor != "sqlite":
+        return None
+    row = await TableVersion.objects.filter(table_name=model._meta.db_table).values_list("version", "modified").afirst()
+    return row or (0, None)
+
+
+def stamp(models):
+    """Версии нескольких таблиц одним запросом или None, если версии не ведутся."""
+    if connection.vendor != "sqlite":
+        return None
+    tables = [model._meta.db_table for model in models]
+    current = dict(TableVersion.objects.filter(table_name__in=tables).values_list("table_name", "version"))
+    return tuple(current.get(table, 0) for table in tables)
+
+
+class VersionedCache:
+    """Кеш процесса для данных, построенных по таблицам models.
+
+    Как и у refcache, в своём процессе кеш сбрасывают или правят на месте
+    сигналы, а записи других процессов видны по версиям таблиц: они сверяются
+    одним запросом не чаще раза в ANALYTICS_CACHE_CHECK_INTERVAL секунд, и при
+    любом изменении кеш очищается целиком. После правки на месте accept()
+    берёт текущие версии за учтённые, чтобы своя запись не сбросила кеш (чужая
+    запись, попавшая между ними, тоже будет считаться учтённой). Значений не
+    больше ANALYTICS_CACHE_SIZE, вытесняются давно не читанные. Построение и
+    сверка идут под блокировкой.
+    """
+
+    def __init__(self, *models):
+        self.models = models
+        self.lock = threading.RLock()
+        self._values = OrderedDict()
+        self._stamp = None
+        self._checked = None
+
+    def _validate(self):
+        if self._checked is not None and time.monotonic() - self._checked < settings.ANALYTICS_CACHE_CHECK_INTERVAL:
+            return
+        self._checked = time.monotonic()
+        current = stamp(self.models)
+        if current != self._stamp:
+            self._values.clear()
+            self._stamp = current
+
+    def get(self, key, build):
+        with self.lock:
+            self._validate()
+            if key in self._values:
+                self._values.move_to_end(key)
+                return self._values[key]
+            value = self._values[key] = build()
+            while len(self._values) > settings.ANALYTICS_CACHE_SIZE:
+                self._values.popitem(last=False)
+            return value
+
+    def loaded(self):
+        """{ключ: значение} без сверки версий — для правки значений на месте."""
+        with self.lock:
+            return dict(self._values)
+
+    def accept(self):
+        """Текущие версии таблиц — уже учтённые в значениях кеша."""
+        with self.lock:
+            if self._stamp is not None:
+                self._stamp = stamp(self.models)
+                self._checked = time.monotonic()
+
+    def clear(self):
+        with self.lock:
+            self._values.clear()
+            # Следующее чтение заново сверит версии.
+            self._checked = None
+
+
+def row_count(model):
+    """Число строк таблицы по счётчику триггеров или None, если он не ведётся."""
+    if connection.vendor != "sqlite" or model not in TRACKED:
+        return None
+    return TableVersion.objects.filter(table_name=model._meta.db_table).values_list("row_count", flat=True).first()
+
+
+def install(connection=connection):
+    if connection.vendor != "sqlite":
+        return
+    tables = connection.introspection.table_names()
+    versions = TableVersion._meta.db_table
+    if versions not in tables:
+        return
+    with connection.cursor() as cursor:
+        columns = {column.name for column in connection.introspection.get_table_description(cursor, versions)}
+        if "row_count" not in columns:
+            # Миграции до 0011: триггеры создаст она.
+            return
+        for model in TRACKED:
+            table = model._meta.db_table
+            if table not in tables:
+                continue
+            cursor.execute(
+                f"INSERT OR IGNORE INTO {versions}(table_name, version, modified, row_count) "
+                f"VALUES ('{table}', 0, {_NOW}, (SELECT COUNT(*) FROM {table}))")
+            for suffix, (event, change) in TRIGGERS.items():
+                cursor.execute(
+                    f"CREATE TRIGGER IF NOT EXISTS {table}_version_{suffix} AFTER {event} ON {table} BEGIN "
+                    f"UPDATE {versions} SET version = version + 1, modified = {_NOW}, row_count = row_count{change} "
+                    f"WHERE table_name = '{table}'; END")
+
+
+def recount(connection=connection):
+    """Пересчитывает row_count по таблицам (после создания счётчика или правки базы в обход триггеров)."""
+    if connection.vendor != "sqlite":
+        return
+    versions = TableVersion._meta.db_table
+    with connection.cursor() as cursor:
+        for model in TRACKED:
+            table = model._meta.db_table
+            cursor.execute(f"UPDATE {versions} SET row_count = (SELECT COUNT(*) FROM {table}) "
+                           f"WHERE table_name = '{table}'")
+
+
+def uninstall(connection=connection):
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        for model in TRACKED:
+            for suffix in TRIGGERS:
+                cursor.execute(f"DROP TRIGGER IF EXISTS {model._meta.db_table}_version_{suffix}")
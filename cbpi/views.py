@@ -1,3 +1,216 @@
-from django.shortcuts import render
+from asgiref.sync import sync_to_async
+from django.db import connections
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.views.decorators.http import require_GET, require_safe
 
-# Create your views here.
+from . import api, documents, history, jobs, similarity, versions
+from . import search as fulltext
+from .analytics import value_trajectories
+from .exporter import ExportError, SagaExporter
+from .models import Composition, Event, Hero, Saga
+
+
+@require_GET
+def search(request):
+    try:
+        limit = max(1, min(int(request.GET.get("limit", 20)), 100))
+    except ValueError:
+        limit = 20
+    results = fulltext.search(request.GET.get("q", ""), limit=limit)
+    return JsonResponse({"results": [
+        {"type": model._meta.model_name, "id": obj.pk, "title": str(obj), "rank": rank}
+        for model, obj, rank in results
+    ]})
+
+
+def _resource(name):
+    try:
+        return api.RESOURCES[name]
+    except KeyError:
+        raise Http404(f"Нет ресурса {name}")
+
+
+async def _conditional(request, name, models, key, build):
+    """Ответ build() с ETag/Last-Modified по версиям таблиц или 304, если клиент уже видел эту версию."""
+    table_versions = [await versions.aversion(model) for model in models]
+    etag = api.etag(name, table_versions, request.GET.dict(), key)
+    modified = [table_version[1] for table_version in table_versions if table_version and table_version[1]]
+    last_modified = int(max(modified).timestamp()) if modified and len(modified) == len(models) else None
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = await build()
+    if response.status_code == 200:
+        if etag:
+            response.headers.setdefault("ETag", etag)
+        if last_modified:
+            response.headers.setdefault("Last-Modified", http_date(last_modified))
+    return response
+
+
+async def _stream(request, chunks):
+    if isinstance(request, ASGIRequest):
+        return StreamingHttpResponse(chunks, content_type="application/json")
+    # Под WSGI Django всё равно собрал бы асинхронный итератор целиком, да ещё с предупреждением.
+    return HttpResponse("".join([chunk async for chunk in chunks]), content_type="application/json")
+
+
+def _next_url(request):
+    def next_url(cursor):
+        query = request.GET.copy()
+        query["cursor"] = cursor
+        return request.build_absolute_uri("?" + query.urlencode())
+    return next_url
+
+
+@require_safe
+async def resource_list(request, resource):
+    resource = _resource(resource)
+
+    async def build():
+        try:
+            fields, size, rows = api.page(resource, request.GET.dict())
+        except api.ApiError as exc:
+            return JsonResponse({"error": str(exc)}, status=400)
+        rows = rows.aiterator(chunk_size=api.DEFAULT_LIMIT)
+        return await _stream(request, api.stream_page(rows, size, _next_url(request)))
+
+    return await _conditional(request, resource.model._meta.db_table, [resource.model], None, build)
+
+
+@require_safe
+async def resource_detail(request, resource, pk):
+    resource = _resource(resource)
+
+    async def build():
+        try:
+            fields = resource.select(request.GET.get("fields"))
+        except api.ApiError as exc:
+            return JsonResponse({"error": str(exc)}, status=400)
+        row = await resource.model.objects.filter(pk=pk).values(*fields).afirst()
+        if row is None:
+            raise Http404(f"Нет объекта {pk}")
+        return JsonResponse(row, json_dumps_params={"ensure_ascii": False})
+
+    return await _conditional(request, resource.model._meta.db_table, [resource.model], pk, build)
+
+
+@require_safe
+async def timeline(request):
+    async def build():
+        try:
+            size, rows = api.timeline_page(request.GET.dict())
+        except api.ApiError as exc:
+            return JsonResponse({"error": str(exc)}, status=400)
+        rows = rows.aiterator(chunk_size=api.DEFAULT_LIMIT)
+        return await _stream(request, api.stream_page(rows, size, _next_url(request), key=("timeline_offset", "id")))
+
+    return await _conditional(request, "timeline", [Event, Composition, Saga], None, build)
+
+
+def _hero_trajectories(saga, hero_pk):
+    # Выполняется в отдельном потоке: соединение этого потока закрываем сами.
+    try:
+        # Файл задачи value_trajectories, пока он свежий, иначе расчёт по одному герою.
+        return jobs.load_trajectories(saga.pk) or value_trajectories(saga, heroes=Hero.objects.filter(pk=hero_pk))
+    finally:
+        connections.close_all()
+
+
+@require_GET
+async def hero_trajectory(request, pk):
+    hero = await Hero.objects.filter(pk=pk, saga__isnull=False).select_related("saga").afirst()
+    if hero is None:
+        raise Http404(f"Нет героя саги {pk}")
+    # Расчёт на NumPy идёт вне цикла событий и не занимает общий поток sync-представлений.
+    trajectories = await sync_to_async(_hero_trajectories, thread_sensitive=False)(hero.saga, hero.pk)
+    return JsonResponse({
+        "hero": hero.pk,
+        "dimensions": trajectories.dimension_ids.tolist(),
+        "events": trajectories.event_ids.tolist(),
+        "score": trajectories.hero(hero.pk).tolist(),
+    })
+
+
+@require_GET
+def hero_similar(request, pk):
+    params = request.GET
+    for name in ("k", "saga", "universe"):
+        if params.get(name) and not params[name].isdigit():
+            return JsonResponse({"error": f"{name} должен быть числом"}, status=400)
+    index = similarity.value_index()
+    if index.vector(pk) is None:
+        raise Http404(f"Нет ценностей героя {pk}")
+    try:
+        results = index.similar(pk, k=min(int(params.get("k") or 10), api.MAX_LIMIT),
+                                metric=params.get("metric", "cosine"),
+                                saga=params.get("saga") or None, universe=params.get("universe") or None)
+    except ValueError as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+    return JsonResponse({"hero": pk, "results": [{"id": hero, "score": score} for hero, score in results]})
+
+
+def _state(state):
+    return {
+        "hero": state.hero_id,
+        "values": state.values,
+        "evaluations": [dict(zip(("id", "action", "dimension", "weight", "event"), row)) for row in state.evaluations],
+        "totals": state.totals,
+    }
+
+
+@require_GET
+def hero_state(request, pk):
+    event = request.GET.get("event", "")
+    if not event.isdigit():
+        return JsonResponse({"error": "event должен быть id"}, status=400)
+    if not Event.objects.filter(pk=event).exists():
+        raise Http404(f"Нет события {event}")
+    state = history.state_at(pk, int(event))
+    if state is None:
+        raise Http404(f"Нет героя {pk}")
+    return JsonResponse({"event": int(event), **_state(state)})
+
+
+@require_GET
+def event_states(request, pk):
+    """Состояние героев на событие: ?heroes=1,2,3 или все герои ?saga=."""
+    event = get_object_or_404(Event.objects.select_related("composition"), pk=pk)
+    if request.GET.get("heroes"):
+        ids = request.GET["heroes"].split(",")
+        if not all(value.isdigit() for value in ids):
+            return JsonResponse({"error": "heroes — список id через запятую"}, status=400)
+        heroes = [int(value) for value in ids][:api.MAX_LIMIT]
+    else:
+        saga = request.GET.get("saga") or (event.composition.saga_id if event.composition_id else "")
+        if not str(saga).isdigit():
+            return JsonResponse({"error": "нужен heroes или saga"}, status=400)
+        heroes = Hero.objects.filter(saga=saga)
+    states = history.states_at(event, heroes)
+    return JsonResponse({"event": event.pk, "results": [_state(states[hero]) for hero in sorted(states)]})
+
+
+@require_GET
+def saga_document(request, pk):
+    document = documents.saga_document(pk)
+    if document is None:
+        raise Http404(f"Нет саги {pk}")
+    return JsonResponse(document, json_dumps_params={"ensure_ascii": False})
+
+
+@require_GET
+def saga_export(request, pk):
+    saga = get_object_or_404(Saga, pk=pk)
+    compression = request.GET.get("compression") or None
+    try:
+        chunks = SagaExporter(saga).chunks(compression)
+    except ExportError as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+    suffix = {"gzip": ".gz", "zstd": ".zst"}.get(compression, "")
+    response = StreamingHttpResponse(chunks, content_type={
+        "gzip": "application/gzip", "zstd": "application/zstd"}.get(compression, "application/x-ndjson"))
+    response["Content-Disposition"] = f'attachment; filename="saga-{saga.pk}.jsonl{suffix}"'
+    return response
@@ -81,13 +81,47 @@ WSGI_APPLICATION = 'conf.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+SQLITE_NAME = env.str('SQLITE_NAME', default=str(BASE_DIR / 'db.sqlite3'))
+# Тяжёлые аналитические чтения идут через отдельное read-only соединение
+# (см. cbpi.routers); можно направить их в снимок базы.
+SQLITE_ANALYTICS_NAME = env.str('SQLITE_ANALYTICS_NAME', default=SQLITE_NAME)
+SQLITE_PRAGMAS = {
+    'journal_mode': env.str('SQLITE_JOURNAL_MODE', default='WAL'),
+    'synchronous': env.str('SQLITE_SYNCHRONOUS', default='NORMAL'),
+    'busy_timeout': env.int('SQLITE_BUSY_TIMEOUT', default=5000),
+    'mmap_size': env.int('SQLITE_MMAP_SIZE', default=256 * 1024 * 1024),
+    'cache_size': env.int('SQLITE_CACHE_SIZE', default=-64 * 1024),
+    'temp_store': env.str('SQLITE_TEMP_STORE', default='MEMORY'),
+}
+SQLITE_INIT_COMMAND = ';'.join(f'PRAGMA {name}={value}' for name, value in SQLITE_PRAGMAS.items())
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'NAME': SQLITE_NAME,
+        'OPTIONS': {
+            'init_command': SQLITE_INIT_COMMAND,
+            # Блокировка на запись берётся в начале транзакции, а не при
+            # первом UPDATE — это и убирает "database is locked" посреди транзакции.
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': SQLITE_PRAGMAS['busy_timeout'] / 1000,
+        },
+    },
+    'analytics': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': f'file:{SQLITE_ANALYTICS_NAME}?mode=ro',
+        'OPTIONS': {
+            'init_command': f'{SQLITE_INIT_COMMAND};PRAGMA query_only=1',
+            'timeout': SQLITE_PRAGMAS['busy_timeout'] / 1000,
+        },
+        'TEST': {
+            'MIRROR': 'default',
+        },
+    },
 }
 
+DATABASE_ROUTERS = ['cbpi.routers.AnalyticsRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -137,6 +171,31 @@ os.path.join(BASE_DIR, "bundles"),
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
 
+# Миниатюры фото авторов и героев: имя размера → сторона квадрата в пикселях.
+THUMBNAIL_SIZES = {'small': 64, 'medium': 256}
+THUMBNAIL_QUALITY = env.int('THUMBNAIL_QUALITY', default=80)
+# 0 — создавать миниатюры прямо в запросе, без пула процессов.
+THUMBNAIL_WORKERS = env.int('THUMBNAIL_WORKERS', default=2)
+
+# Как часто (в секундах) кеш справочников сверяет версии таблиц с базой.
+REFERENCE_CACHE_CHECK_INTERVAL = env.float('REFERENCE_CACHE_CHECK_INTERVAL', default=1.0)
+
+# Кеши аналитики в памяти процесса (граф фактов, сети соучастия, индекс ценностей):
+# как часто сверять версии таблиц и сколько значений держать.
+ANALYTICS_CACHE_CHECK_INTERVAL = env.float('ANALYTICS_CACHE_CHECK_INTERVAL', default=1.0)
+ANALYTICS_CACHE_SIZE = env.int('ANALYTICS_CACHE_SIZE', default=32)
+
+# Фоновые задачи (run_jobs): 0 воркеров — выполнять в процессе команды.
+JOB_WORKERS = env.int('JOB_WORKERS', default=2)
+JOB_MAX_ATTEMPTS = env.int('JOB_MAX_ATTEMPTS', default=3)
+# Пауза перед повтором, секунды; удваивается с каждой попыткой.
+JOB_RETRY_DELAY = env.int('JOB_RETRY_DELAY', default=30)
+# Задача, выполняющаяся дольше, считается брошенной и возвращается в очередь.
+JOB_TIMEOUT = env.int('JOB_TIMEOUT', default=3600)
+
+# Сколько строк больших таблиц админка досчитывает при фильтре или поиске.
+ADMIN_COUNT_LIMIT = env.int('ADMIN_COUNT_LIMIT', default=10000)
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
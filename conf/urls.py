@@ -21,7 +21,7 @@ from django.urls import path, include
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-#    path('', include('cbpi.urls')),
+    path('', include('cbpi.urls')),
 ]
 
 if settings.DEBUG: